@@ -0,0 +1,47 @@
+-- Add bounded conversational memory for the AI coach
+-- Older coach_conversations rows are folded into a rolling summary per user
+
+-- Create coach_memory table holding the rolling summary
+CREATE TABLE IF NOT EXISTS coach_memory (
+    user_id TEXT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+    summary TEXT,
+    summarized_through TIMESTAMP,
+    history_tokens INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Track prompt size so savings over naive history replay can be measured:
+-- SELECT SUM(naive_prompt_tokens) - SUM(prompt_tokens) FROM coach_conversations;
+ALTER TABLE coach_conversations ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER;
+ALTER TABLE coach_conversations ADD COLUMN IF NOT EXISTS naive_prompt_tokens INTEGER;
+
+-- Unsummarized turns are fetched per user in created_at order
+CREATE INDEX IF NOT EXISTS idx_coach_conversations_user_created ON coach_conversations(user_id, created_at);
+
+-- Record one coach answer: add its tokens to history_tokens in place, so concurrent
+-- answers don't overwrite each other's count, and store a new summary only if it
+-- covers more turns than the stored one
+CREATE OR REPLACE FUNCTION record_coach_memory(
+    p_user_id TEXT,
+    p_tokens INTEGER,
+    p_summary TEXT DEFAULT NULL,
+    p_summarized_through TIMESTAMP DEFAULT NULL
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO coach_memory (user_id, history_tokens, summary, summarized_through)
+    VALUES (p_user_id, p_tokens, p_summary, p_summarized_through)
+    ON CONFLICT (user_id) DO UPDATE SET
+        history_tokens = COALESCE(coach_memory.history_tokens, 0) + EXCLUDED.history_tokens,
+        summary = CASE
+            WHEN EXCLUDED.summarized_through > COALESCE(coach_memory.summarized_through, '-infinity')
+            THEN EXCLUDED.summary ELSE coach_memory.summary
+        END,
+        summarized_through = GREATEST(coach_memory.summarized_through, EXCLUDED.summarized_through);
+$$;
+
+-- Add trigger to coach_memory table (dropped first so the migration can be re-run for record_coach_memory)
+DROP TRIGGER IF EXISTS update_coach_memory_updated_at ON coach_memory;
+CREATE TRIGGER update_coach_memory_updated_at BEFORE UPDATE ON coach_memory
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
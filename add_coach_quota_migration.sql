@@ -0,0 +1,67 @@
+-- Atomic daily quota for the AI coach
+-- Replaces the read / reset / increment round trips in the /coach handler
+
+-- Reset the daily counter if needed and claim one session in a single statement.
+-- The row lock taken by UPDATE keeps concurrent questions from going over the limit.
+CREATE OR REPLACE FUNCTION claim_coach_session(p_user_id TEXT, p_daily_limit INTEGER)
+RETURNS TABLE (tier TEXT, used INTEGER, remaining INTEGER, claimed BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_tier TEXT;
+    v_used INTEGER;
+BEGIN
+    UPDATE users u SET
+        coach_sessions_used = CASE
+            WHEN u.coach_sessions_reset_at < CURRENT_DATE THEN 1
+            ELSE COALESCE(u.coach_sessions_used, 0) + 1
+        END,
+        coach_sessions_reset_at = CURRENT_DATE
+    WHERE u.user_id = p_user_id
+      AND u.subscription_tier = 'coach'
+      AND (u.coach_sessions_reset_at < CURRENT_DATE OR COALESCE(u.coach_sessions_used, 0) < p_daily_limit)
+    RETURNING u.subscription_tier, u.coach_sessions_used INTO v_tier, v_used;
+
+    IF FOUND THEN
+        RETURN QUERY SELECT v_tier, v_used, GREATEST(p_daily_limit - v_used, 0), TRUE;
+        RETURN;
+    END IF;
+
+    -- Nothing claimed: either not on the coach tier or the limit is reached
+    RETURN QUERY
+    SELECT u.subscription_tier,
+           COALESCE(u.coach_sessions_used, 0),
+           GREATEST(p_daily_limit - COALESCE(u.coach_sessions_used, 0), 0),
+           FALSE
+    FROM users u
+    WHERE u.user_id = p_user_id;
+END;
+$$;
+
+-- The day's quota without claiming a session, for /coach without a question
+CREATE OR REPLACE FUNCTION coach_quota(p_user_id TEXT, p_daily_limit INTEGER)
+RETURNS TABLE (tier TEXT, used INTEGER, remaining INTEGER)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT u.subscription_tier, q.used, GREATEST(p_daily_limit - q.used, 0)
+    FROM users u
+    CROSS JOIN LATERAL (
+        SELECT CASE
+                   WHEN u.coach_sessions_reset_at < CURRENT_DATE THEN 0
+                   ELSE COALESCE(u.coach_sessions_used, 0)
+               END AS used
+    ) q
+    WHERE u.user_id = p_user_id;
+$$;
+
+-- Give back a claimed session when no answer was produced (off-topic or API error)
+CREATE OR REPLACE FUNCTION release_coach_session(p_user_id TEXT)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE users
+    SET coach_sessions_used = GREATEST(COALESCE(coach_sessions_used, 0) - 1, 0)
+    WHERE user_id = p_user_id
+      AND coach_sessions_reset_at = CURRENT_DATE;
+$$;
@@ -0,0 +1,153 @@
+-- Entitlements (tier + expiry) driven by Stripe webhooks
+-- Requires add_stripe_events_migration.sql and add_coach_quota_migration.sql
+
+-- When the user's paid tier runs out unless Stripe reports a renewal (NULL = no known end)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS tier_expires_at TIMESTAMPTZ;
+ALTER TABLE subscription_history ADD COLUMN IF NOT EXISTS current_period_end TIMESTAMPTZ;
+
+-- Same as before plus the billing period end, and it now returns the user's resulting
+-- entitlement so the bot can update its cache. The return type changed, so drop first.
+DROP FUNCTION IF EXISTS apply_subscription_change(TEXT, TIMESTAMPTZ, TEXT, TEXT, TEXT, TEXT, TEXT, BOOLEAN);
+
+CREATE OR REPLACE FUNCTION apply_subscription_change(
+    p_event_id TEXT,
+    p_event_created TIMESTAMPTZ,
+    p_user_id TEXT,
+    p_subscription_id TEXT,
+    p_customer_id TEXT,
+    p_tier TEXT,
+    p_price_id TEXT,
+    p_active BOOLEAN,
+    p_current_period_end TIMESTAMPTZ DEFAULT NULL
+)
+RETURNS TABLE (user_id TEXT, tier TEXT, expires_at TIMESTAMPTZ)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_user_id TEXT := p_user_id;
+    v_last_event_at TIMESTAMPTZ;
+    v_tier TEXT;
+    v_expires_at TIMESTAMPTZ;
+BEGIN
+    -- Lock the event so a concurrent worker can't apply it twice
+    PERFORM 1 FROM stripe_events e WHERE e.id = p_event_id AND e.status <> 'done' FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    SELECT sh.user_id, sh.last_event_at INTO v_user_id, v_last_event_at
+    FROM subscription_history sh
+    WHERE sh.stripe_subscription_id = p_subscription_id;
+    v_user_id := COALESCE(p_user_id, v_user_id);
+
+    -- Without metadata the subscription must already be known. Failing lets the worker retry
+    -- (the checkout event may still be on its way) and finally mark the event failed with this reason
+    IF v_user_id IS NULL THEN
+        RAISE EXCEPTION 'No user for subscription %: no telegram_user_id in its metadata and no subscription_history row',
+            p_subscription_id;
+    END IF;
+
+    IF v_last_event_at IS NULL OR p_event_created >= v_last_event_at THEN
+        INSERT INTO subscription_history (
+            user_id, tier, stripe_price_id, stripe_subscription_id, stripe_customer_id,
+            is_active, ended_at, last_event_at, current_period_end
+        )
+        VALUES (
+            v_user_id, p_tier, p_price_id, p_subscription_id, p_customer_id,
+            p_active, CASE WHEN p_active THEN NULL ELSE NOW() END, p_event_created, p_current_period_end
+        )
+        ON CONFLICT (stripe_subscription_id) DO UPDATE SET
+            tier = EXCLUDED.tier,
+            stripe_price_id = COALESCE(EXCLUDED.stripe_price_id, subscription_history.stripe_price_id),
+            stripe_customer_id = COALESCE(EXCLUDED.stripe_customer_id, subscription_history.stripe_customer_id),
+            is_active = EXCLUDED.is_active,
+            ended_at = CASE WHEN EXCLUDED.is_active THEN NULL ELSE COALESCE(subscription_history.ended_at, NOW()) END,
+            last_event_at = EXCLUDED.last_event_at,
+            current_period_end = COALESCE(EXCLUDED.current_period_end, subscription_history.current_period_end);
+
+        -- The user's tier is the best of their active subscriptions, so cancelling
+        -- an old Basic plan after moving to Coach doesn't downgrade them
+        SELECT sh.tier, sh.current_period_end INTO v_tier, v_expires_at
+        FROM subscription_history sh
+        WHERE sh.user_id = v_user_id AND sh.is_active AND sh.stripe_subscription_id IS NOT NULL
+        ORDER BY (sh.tier = 'coach') DESC, sh.started_at DESC
+        LIMIT 1;
+
+        UPDATE users u SET
+            is_premium = v_tier IS NOT NULL,
+            subscription_tier = COALESCE(v_tier, 'free'),
+            tier_expires_at = v_expires_at
+        WHERE u.user_id = v_user_id;
+
+        RETURN QUERY SELECT v_user_id, COALESCE(v_tier, 'free'), v_expires_at;
+    END IF;
+
+    UPDATE stripe_events e SET
+        status = 'done',
+        processed_at = NOW(),
+        locked_until = NULL,
+        last_error = NULL
+    WHERE e.id = p_event_id;
+END;
+$$;
+
+-- Coach sessions also require the Coach tier not to have lapsed (2 days grace for renewals)
+CREATE OR REPLACE FUNCTION claim_coach_session(p_user_id TEXT, p_daily_limit INTEGER)
+RETURNS TABLE (tier TEXT, used INTEGER, remaining INTEGER, claimed BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_tier TEXT;
+    v_used INTEGER;
+BEGIN
+    UPDATE users u SET
+        coach_sessions_used = CASE
+            WHEN u.coach_sessions_reset_at < CURRENT_DATE THEN 1
+            ELSE COALESCE(u.coach_sessions_used, 0) + 1
+        END,
+        coach_sessions_reset_at = CURRENT_DATE
+    WHERE u.user_id = p_user_id
+      AND u.subscription_tier = 'coach'
+      AND (u.tier_expires_at IS NULL OR u.tier_expires_at + INTERVAL '2 days' > NOW())
+      AND (u.coach_sessions_reset_at < CURRENT_DATE OR COALESCE(u.coach_sessions_used, 0) < p_daily_limit)
+    RETURNING u.subscription_tier, u.coach_sessions_used INTO v_tier, v_used;
+
+    IF FOUND THEN
+        RETURN QUERY SELECT v_tier, v_used, GREATEST(p_daily_limit - v_used, 0), TRUE;
+        RETURN;
+    END IF;
+
+    -- Nothing claimed: not on the coach tier, the tier lapsed, or the limit is reached
+    RETURN QUERY
+    SELECT CASE
+               WHEN u.tier_expires_at + INTERVAL '2 days' <= NOW() THEN 'free'
+               ELSE u.subscription_tier
+           END,
+           COALESCE(u.coach_sessions_used, 0),
+           GREATEST(p_daily_limit - COALESCE(u.coach_sessions_used, 0), 0),
+           FALSE
+    FROM users u
+    WHERE u.user_id = p_user_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION coach_quota(p_user_id TEXT, p_daily_limit INTEGER)
+RETURNS TABLE (tier TEXT, used INTEGER, remaining INTEGER)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE
+               WHEN u.tier_expires_at + INTERVAL '2 days' <= NOW() THEN 'free'
+               ELSE u.subscription_tier
+           END,
+           q.used,
+           GREATEST(p_daily_limit - q.used, 0)
+    FROM users u
+    CROSS JOIN LATERAL (
+        SELECT CASE
+                   WHEN u.coach_sessions_reset_at < CURRENT_DATE THEN 0
+                   ELSE COALESCE(u.coach_sessions_used, 0)
+               END AS used
+    ) q
+    WHERE u.user_id = p_user_id;
+$$;
@@ -0,0 +1,177 @@
+-- Partition habit_logs by month and archive old months into rollups
+-- Queries for today / this week only touch the newest partitions, and
+-- archive_habit_logs.py folds months past the retention period into
+-- habit_log_rollups and moves their raw rows out of the live table.
+
+-- Monthly completion counts per habit, kept after the raw rows are archived
+CREATE TABLE IF NOT EXISTS habit_log_rollups (
+    user_id TEXT REFERENCES users(user_id) ON DELETE CASCADE,
+    habit_id UUID REFERENCES habits(id) ON DELETE CASCADE,
+    month DATE NOT NULL,
+    completions INTEGER NOT NULL,
+    first_completed_at TIMESTAMP,
+    last_completed_at TIMESTAMP,
+    best_streak INTEGER,
+    PRIMARY KEY (user_id, habit_id, month)
+);
+
+-- Archived partitions live here: not exposed through the API, and the whole
+-- schema can be dumped with pg_dump -n habit_logs_archive and dropped
+CREATE SCHEMA IF NOT EXISTS habit_logs_archive;
+
+-- Create the partition for p_month (habit_logs_YYYY_MM). Rows that already
+-- landed in the default partition for that month are moved into it first.
+CREATE OR REPLACE FUNCTION create_habit_log_partition(p_month DATE)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_start TIMESTAMP := date_trunc('month', p_month);
+    v_end TIMESTAMP := date_trunc('month', p_month) + INTERVAL '1 month';
+    v_name TEXT := 'habit_logs_' || to_char(p_month, 'YYYY_MM');
+BEGIN
+    IF to_regclass('public.' || v_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    EXECUTE format('CREATE TABLE public.%I (LIKE public.habit_logs INCLUDING DEFAULTS)', v_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM public.habit_logs_default WHERE completed_at >= %L AND completed_at < %L RETURNING *) '
+        'INSERT INTO public.%I SELECT * FROM moved',
+        v_start, v_end, v_name
+    );
+    EXECUTE format(
+        'ALTER TABLE public.habit_logs ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_start, v_end
+    );
+    RETURN TRUE;
+END;
+$$;
+
+-- Make sure partitions exist from this month to p_months_ahead months out.
+-- Returns how many were created.
+CREATE OR REPLACE FUNCTION ensure_habit_log_partitions(p_months_ahead INTEGER DEFAULT 2)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_created INTEGER := 0;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        IF create_habit_log_partition((date_trunc('month', NOW()) + make_interval(months => i))::date) THEN
+            v_created := v_created + 1;
+        END IF;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Convert the existing table, once
+DO $$
+DECLARE
+    v_month DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'public.habit_logs'::regclass) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE habit_logs RENAME TO habit_logs_unpartitioned;
+
+    -- The primary key has to include the partition key
+    CREATE TABLE habit_logs (
+        id UUID NOT NULL DEFAULT gen_random_uuid(),
+        habit_id UUID REFERENCES habits(id) ON DELETE CASCADE,
+        user_id TEXT REFERENCES users(user_id) ON DELETE CASCADE,
+        completed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        streak_count INTEGER DEFAULT 1,
+        PRIMARY KEY (id, completed_at)
+    ) PARTITION BY RANGE (completed_at);
+
+    -- Catches anything outside the monthly partitions so inserts never fail
+    CREATE TABLE habit_logs_default PARTITION OF habit_logs DEFAULT;
+
+    SELECT date_trunc('month', COALESCE(MIN(completed_at), NOW()))::date INTO v_month FROM habit_logs_unpartitioned;
+    WHILE v_month < date_trunc('month', NOW()) LOOP
+        PERFORM create_habit_log_partition(v_month);
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+    PERFORM ensure_habit_log_partitions(2);
+
+    INSERT INTO habit_logs (id, habit_id, user_id, completed_at, streak_count)
+    SELECT id, habit_id, user_id, COALESCE(completed_at, NOW()), streak_count
+    FROM habit_logs_unpartitioned;
+
+    DROP TABLE habit_logs_unpartitioned;
+END;
+$$;
+
+-- Created on every partition (same access paths as add_query_indexes_migration.sql)
+CREATE INDEX IF NOT EXISTS idx_habit_logs_habit_completed ON habit_logs(habit_id, completed_at);
+CREATE INDEX IF NOT EXISTS idx_habit_logs_user_completed ON habit_logs(user_id, completed_at);
+
+-- Live partitions with their month (NULL for the default partition) and size
+CREATE OR REPLACE FUNCTION habit_log_partitions()
+RETURNS TABLE(partition_name TEXT, month DATE, row_estimate BIGINT, total_bytes BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT c.relname::text,
+           CASE WHEN c.relname ~ '_\d{4}_\d{2}$'
+                THEN to_date(substring(c.relname FROM '\d{4}_\d{2}$'), 'YYYY_MM') END,
+           GREATEST(c.reltuples, 0)::bigint,
+           pg_total_relation_size(c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'public.habit_logs'::regclass
+    ORDER BY 2 NULLS FIRST;
+$$;
+
+-- Fold a finished month into habit_log_rollups, then detach its partition and
+-- move it to the habit_logs_archive schema, all in one transaction.
+CREATE OR REPLACE FUNCTION archive_habit_log_partition(p_month DATE)
+RETURNS TABLE(rows_archived BIGINT, rollup_rows BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_month)::date;
+    v_name TEXT := 'habit_logs_' || to_char(p_month, 'YYYY_MM');
+BEGIN
+    IF v_month >= date_trunc('month', NOW()) THEN
+        RAISE EXCEPTION 'Refusing to archive %: the month is not over', v_name;
+    END IF;
+    IF to_regclass('public.' || v_name) IS NULL THEN
+        RAISE EXCEPTION 'No live partition %', v_name;
+    END IF;
+
+    EXECUTE format('SELECT count(*) FROM public.%I', v_name) INTO rows_archived;
+
+    -- Logs without a user or habit can't be rolled up; they stay in the archived rows
+    EXECUTE format(
+        'INSERT INTO habit_log_rollups (user_id, habit_id, month, completions, first_completed_at, last_completed_at, best_streak) '
+        'SELECT user_id, habit_id, %L, count(*), MIN(completed_at), MAX(completed_at), MAX(streak_count) '
+        'FROM public.%I WHERE user_id IS NOT NULL AND habit_id IS NOT NULL '
+        'GROUP BY user_id, habit_id '
+        'ON CONFLICT (user_id, habit_id, month) DO UPDATE SET '
+        'completions = habit_log_rollups.completions + EXCLUDED.completions, '
+        'first_completed_at = LEAST(habit_log_rollups.first_completed_at, EXCLUDED.first_completed_at), '
+        'last_completed_at = GREATEST(habit_log_rollups.last_completed_at, EXCLUDED.last_completed_at), '
+        'best_streak = GREATEST(habit_log_rollups.best_streak, EXCLUDED.best_streak)',
+        v_month, v_name
+    );
+    GET DIAGNOSTICS rollup_rows = ROW_COUNT;
+
+    EXECUTE format('ALTER TABLE public.habit_logs DETACH PARTITION public.%I', v_name);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA habit_logs_archive', v_name);
+    RETURN NEXT;
+END;
+$$;
+
+-- All-time completions for /stats: archived months from the rollups plus live rows
+CREATE OR REPLACE FUNCTION count_user_completions(p_user_id TEXT)
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT (SELECT count(*) FROM habit_logs WHERE user_id = p_user_id)
+         + (SELECT COALESCE(SUM(completions), 0) FROM habit_log_rollups WHERE user_id = p_user_id);
+$$;
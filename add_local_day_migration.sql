@@ -0,0 +1,85 @@
+-- Reset daily coach sessions at the user's local midnight instead of UTC midnight
+-- Requires add_coach_quota_migration.sql and add_entitlements_migration.sql (users.tier_expires_at)
+
+-- Today's date in a timezone, UTC if the name is missing or unknown
+CREATE OR REPLACE FUNCTION local_date(p_timezone TEXT)
+RETURNS DATE
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+    RETURN (NOW() AT TIME ZONE COALESCE(p_timezone, 'UTC'))::date;
+EXCEPTION WHEN invalid_parameter_value THEN
+    RETURN (NOW() AT TIME ZONE 'UTC')::date;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION claim_coach_session(p_user_id TEXT, p_daily_limit INTEGER)
+RETURNS TABLE (tier TEXT, used INTEGER, remaining INTEGER, claimed BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_tier TEXT;
+    v_used INTEGER;
+BEGIN
+    UPDATE users u SET
+        coach_sessions_used = CASE
+            WHEN u.coach_sessions_reset_at < local_date(u.timezone) THEN 1
+            ELSE COALESCE(u.coach_sessions_used, 0) + 1
+        END,
+        coach_sessions_reset_at = local_date(u.timezone)
+    WHERE u.user_id = p_user_id
+      AND u.subscription_tier = 'coach'
+      AND (u.tier_expires_at IS NULL OR u.tier_expires_at + INTERVAL '2 days' > NOW())
+      AND (u.coach_sessions_reset_at < local_date(u.timezone) OR COALESCE(u.coach_sessions_used, 0) < p_daily_limit)
+    RETURNING u.subscription_tier, u.coach_sessions_used INTO v_tier, v_used;
+
+    IF FOUND THEN
+        RETURN QUERY SELECT v_tier, v_used, GREATEST(p_daily_limit - v_used, 0), TRUE;
+        RETURN;
+    END IF;
+
+    -- Nothing claimed: not on the coach tier, the tier lapsed, or the limit is reached
+    RETURN QUERY
+    SELECT CASE
+               WHEN u.tier_expires_at + INTERVAL '2 days' <= NOW() THEN 'free'
+               ELSE u.subscription_tier
+           END,
+           COALESCE(u.coach_sessions_used, 0),
+           GREATEST(p_daily_limit - COALESCE(u.coach_sessions_used, 0), 0),
+           FALSE
+    FROM users u
+    WHERE u.user_id = p_user_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION coach_quota(p_user_id TEXT, p_daily_limit INTEGER)
+RETURNS TABLE (tier TEXT, used INTEGER, remaining INTEGER)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE
+               WHEN u.tier_expires_at + INTERVAL '2 days' <= NOW() THEN 'free'
+               ELSE u.subscription_tier
+           END,
+           q.used,
+           GREATEST(p_daily_limit - q.used, 0)
+    FROM users u
+    CROSS JOIN LATERAL (
+        SELECT CASE
+                   WHEN u.coach_sessions_reset_at < local_date(u.timezone) THEN 0
+                   ELSE COALESCE(u.coach_sessions_used, 0)
+               END AS used
+    ) q
+    WHERE u.user_id = p_user_id;
+$$;
+
+CREATE OR REPLACE FUNCTION release_coach_session(p_user_id TEXT)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE users
+    SET coach_sessions_used = GREATEST(COALESCE(coach_sessions_used, 0) - 1, 0)
+    WHERE user_id = p_user_id
+      AND coach_sessions_reset_at = local_date(timezone);
+$$;
@@ -0,0 +1,43 @@
+-- Typed profile columns instead of rewriting the profiles.data document
+-- XP, level, language and name get their own columns so each change is a
+-- single-field update; users.timezone becomes the only timezone.
+
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS name TEXT;
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS xp INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS level INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS language TEXT NOT NULL DEFAULT 'en';
+ALTER TABLE users ALTER COLUMN timezone SET DEFAULT 'UTC';
+
+-- Backfill from the existing documents, ignoring values that aren't numbers
+UPDATE profiles SET
+    name = COALESCE(name, data->>'name'),
+    xp = CASE WHEN data->>'xp' ~ '^\d+$' THEN (data->>'xp')::int ELSE xp END,
+    level = CASE WHEN data->>'level' ~ '^\d+$' THEN (data->>'level')::int ELSE level END,
+    language = COALESCE(NULLIF(data->>'language', ''), language)
+WHERE data ?| ARRAY['name', 'xp', 'level', 'language'];
+
+-- Both copies were written together, but users.timezone may still be the
+-- default for profiles created before it existed
+UPDATE users u SET timezone = p.data->>'timezone'
+FROM profiles p
+WHERE p.user_id = u.user_id
+  AND COALESCE(p.data->>'timezone', 'UTC') <> 'UTC'
+  AND COALESCE(u.timezone, 'UTC') = 'UTC';
+UPDATE users SET timezone = 'UTC' WHERE timezone IS NULL;
+
+-- Drop the moved keys so nothing reads a stale copy
+UPDATE profiles SET data = data - 'name' - 'xp' - 'level' - 'language' - 'timezone'
+WHERE data ?| ARRAY['name', 'xp', 'level', 'language', 'timezone'];
+
+-- Add XP in one statement, so concurrent completions can't overwrite each other.
+-- Returns the new totals.
+CREATE OR REPLACE FUNCTION award_xp(p_user_id TEXT, p_amount INTEGER, p_level_xp INTEGER)
+RETURNS TABLE(xp INTEGER, level INTEGER)
+LANGUAGE sql
+AS $$
+    UPDATE profiles p SET
+        xp = p.xp + p_amount,
+        level = (p.xp + p_amount) / p_level_xp + 1
+    WHERE p.user_id = p_user_id
+    RETURNING p.xp, p.level;
+$$;
@@ -0,0 +1,35 @@
+-- Indexes matching the bot's hot queries
+-- The original schema only indexes single columns, so every "completed today?"
+-- check scans all of a habit's logs and the reminder jobs filter in the heap.
+-- Benchmark with: python bench_query_plans.py
+
+-- "Completed today?" in /habits, /complete and reminders:
+--   habit_logs WHERE habit_id = ? AND completed_at >= ?
+CREATE INDEX IF NOT EXISTS idx_habit_logs_habit_completed ON habit_logs(habit_id, completed_at);
+
+-- Per-user history (/stats, coach context):
+--   habit_logs WHERE user_id = ? [AND completed_at >= ?]
+CREATE INDEX IF NOT EXISTS idx_habit_logs_user_completed ON habit_logs(user_id, completed_at);
+
+-- Active habits, the most common query in the bot:
+--   habits WHERE user_id = ? AND is_active
+CREATE INDEX IF NOT EXISTS idx_habits_user_active ON habits(user_id) WHERE is_active;
+
+-- Free-user reminder job:
+--   users WHERE subscription_tier = 'free' AND reminder_enabled
+CREATE INDEX IF NOT EXISTS idx_users_tier_reminders ON users(subscription_tier, reminder_enabled);
+
+-- Pause check before each scheduled reminder:
+--   habit_pauses WHERE habit_id = ? AND start_date <= ? AND end_date >= ?
+CREATE INDEX IF NOT EXISTS idx_habit_pauses_habit_dates ON habit_pauses(habit_id, start_date, end_date);
+
+-- These are now prefixes of the composite indexes above and only slow down writes
+DROP INDEX IF EXISTS idx_habit_logs_habit_id;
+DROP INDEX IF EXISTS idx_habit_logs_user_id;
+DROP INDEX IF EXISTS idx_habit_pauses_habit;
+
+-- Refresh planner statistics so the new indexes are picked up straight away
+ANALYZE habit_logs;
+ANALYZE habits;
+ANALYZE users;
+ANALYZE habit_pauses;
@@ -0,0 +1,130 @@
+-- Durable inbox for Stripe webhook events
+-- The webhook only stores the event; a worker applies it exactly once
+
+-- One row per Stripe event id, so Stripe retries of the same event are no-ops
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, processing, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    locked_until TIMESTAMPTZ,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMPTZ
+);
+
+-- The worker only ever scans unfinished events
+CREATE INDEX IF NOT EXISTS idx_stripe_events_unfinished ON stripe_events(received_at)
+    WHERE status IN ('pending', 'processing');
+
+-- Link subscription history to Stripe so updates and cancellations find their row
+ALTER TABLE subscription_history ADD COLUMN IF NOT EXISTS stripe_subscription_id TEXT;
+ALTER TABLE subscription_history ADD COLUMN IF NOT EXISTS stripe_customer_id TEXT;
+ALTER TABLE subscription_history ADD COLUMN IF NOT EXISTS last_event_at TIMESTAMPTZ;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_subscription_history_stripe_subscription
+    ON subscription_history(stripe_subscription_id);
+
+-- Lease up to p_limit events to a worker. Events whose lease ran out (worker died)
+-- are picked up again; SKIP LOCKED lets several workers claim without blocking.
+CREATE OR REPLACE FUNCTION claim_stripe_events(p_limit INTEGER, p_lease_seconds INTEGER)
+RETURNS SETOF stripe_events
+LANGUAGE sql
+AS $$
+    UPDATE stripe_events e SET
+        status = 'processing',
+        attempts = e.attempts + 1,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds)
+    WHERE e.id IN (
+        SELECT id FROM stripe_events
+        WHERE status IN ('pending', 'processing')
+          AND (locked_until IS NULL OR locked_until < NOW())
+        ORDER BY received_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING e.*;
+$$;
+
+-- Apply a subscription change and mark its event done in one transaction.
+-- p_user_id may be NULL for subscription events; the user is then found through
+-- the subscription. Events older than the last one applied to a subscription are
+-- recorded as done without changing anything. Events whose user can't be found raise
+-- an error and stay unfinished. Returns the affected user id.
+CREATE OR REPLACE FUNCTION apply_subscription_change(
+    p_event_id TEXT,
+    p_event_created TIMESTAMPTZ,
+    p_user_id TEXT,
+    p_subscription_id TEXT,
+    p_customer_id TEXT,
+    p_tier TEXT,
+    p_price_id TEXT,
+    p_active BOOLEAN
+)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_user_id TEXT := p_user_id;
+    v_last_event_at TIMESTAMPTZ;
+    v_tier TEXT;
+BEGIN
+    -- Lock the event so a concurrent worker can't apply it twice
+    PERFORM 1 FROM stripe_events WHERE id = p_event_id AND status <> 'done' FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT user_id, last_event_at INTO v_user_id, v_last_event_at
+    FROM subscription_history
+    WHERE stripe_subscription_id = p_subscription_id;
+    v_user_id := COALESCE(p_user_id, v_user_id);
+
+    -- Without metadata the subscription must already be known. Failing lets the worker retry
+    -- (the checkout event may still be on its way) and finally mark the event failed with this reason
+    IF v_user_id IS NULL THEN
+        RAISE EXCEPTION 'No user for subscription %: no telegram_user_id in its metadata and no subscription_history row',
+            p_subscription_id;
+    END IF;
+
+    IF v_last_event_at IS NULL OR p_event_created >= v_last_event_at THEN
+        INSERT INTO subscription_history (
+            user_id, tier, stripe_price_id, stripe_subscription_id, stripe_customer_id,
+            is_active, ended_at, last_event_at
+        )
+        VALUES (
+            v_user_id, p_tier, p_price_id, p_subscription_id, p_customer_id,
+            p_active, CASE WHEN p_active THEN NULL ELSE NOW() END, p_event_created
+        )
+        ON CONFLICT (stripe_subscription_id) DO UPDATE SET
+            tier = EXCLUDED.tier,
+            stripe_price_id = COALESCE(EXCLUDED.stripe_price_id, subscription_history.stripe_price_id),
+            stripe_customer_id = COALESCE(EXCLUDED.stripe_customer_id, subscription_history.stripe_customer_id),
+            is_active = EXCLUDED.is_active,
+            ended_at = CASE WHEN EXCLUDED.is_active THEN NULL ELSE COALESCE(subscription_history.ended_at, NOW()) END,
+            last_event_at = EXCLUDED.last_event_at;
+
+        -- The user's tier is the best of their active subscriptions, so cancelling
+        -- an old Basic plan after moving to Coach doesn't downgrade them
+        SELECT tier INTO v_tier
+        FROM subscription_history
+        WHERE user_id = v_user_id AND is_active AND stripe_subscription_id IS NOT NULL
+        ORDER BY (tier = 'coach') DESC, started_at DESC
+        LIMIT 1;
+
+        UPDATE users SET
+            is_premium = v_tier IS NOT NULL,
+            subscription_tier = COALESCE(v_tier, 'free')
+        WHERE user_id = v_user_id;
+    END IF;
+
+    UPDATE stripe_events SET
+        status = 'done',
+        processed_at = NOW(),
+        locked_until = NULL,
+        last_error = NULL
+    WHERE id = p_event_id;
+
+    RETURN v_user_id;
+END;
+$$;
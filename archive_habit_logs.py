@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Retention job for the month-partitioned habit_logs table.
+
+Creates the partitions for the coming months, then archives every month older
+than the retention period: its completions are folded into habit_log_rollups
+(so /stats totals don't change) and the raw rows move to the habit_logs_archive
+schema. Run it monthly from cron; add_habit_logs_partitioning_migration.sql must
+have been applied.
+
+Usage:
+    python archive_habit_logs.py --dry-run
+    python archive_habit_logs.py --retention-months 13
+"""
+
+import argparse
+import os
+from datetime import date
+from services import supabase
+
+HABIT_LOG_RETENTION_MONTHS = int(os.getenv('HABIT_LOG_RETENTION_MONTHS', '13'))
+PARTITIONS_AHEAD = 2  # Months of empty partitions kept ready for inserts
+
+
+def months_before(day, months):
+    """First day of the month `months` before day's month"""
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def format_bytes(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old habit_logs partitions into monthly rollups")
+    parser.add_argument('--retention-months', type=int, default=HABIT_LOG_RETENTION_MONTHS,
+                        help="Full months of raw completions to keep besides the current one")
+    parser.add_argument('--dry-run', action='store_true', help="Show what would be archived")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        created = supabase.rpc('ensure_habit_log_partitions', {'p_months_ahead': PARTITIONS_AHEAD}).execute().data
+        print(f"🗓️  Created {created} new partition(s)")
+
+    cutoff = months_before(date.today(), args.retention_months)
+    partitions = supabase.rpc('habit_log_partitions', {}).execute().data
+    print(f"📦 {len(partitions)} live partitions, archiving months before {cutoff:%Y-%m}")
+
+    expired = []
+    for partition in partitions:
+        month = date.fromisoformat(partition['month']) if partition['month'] else None
+        if month and month < cutoff:
+            expired.append((month, partition))
+        elif month is None and partition['row_estimate']:
+            print(f"⚠️  {partition['partition_name']} holds ~{partition['row_estimate']} rows outside the monthly partitions")
+
+    if not expired:
+        print("✅ Nothing to archive")
+        return
+
+    total_rows = 0
+    for month, partition in expired:
+        label = f"{partition['partition_name']} (~{partition['row_estimate']} rows, {format_bytes(partition['total_bytes'])})"
+        if args.dry_run:
+            print(f"  would archive {label}")
+            continue
+        try:
+            result = supabase.rpc('archive_habit_log_partition', {'p_month': month.isoformat()}).execute().data[0]
+            total_rows += result['rows_archived']
+            print(f"  ✅ archived {label}: {result['rows_archived']} rows into {result['rollup_rows']} rollups")
+        except Exception as e:
+            # Each month is its own transaction, so the rest can still go ahead
+            print(f"  ❌ Error archiving {partition['partition_name']}: {e}")
+
+    if not args.dry_run:
+        print(f"✅ Archived {total_rows} completions from {len(expired)} month(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of callback query dispatch cost.
+Compares the router's dict lookup against the old if/elif chain in handle_callback.
+
+Usage:
+    python bench_callback_router.py
+"""
+
+import os
+import timeit
+
+HABIT_ID = '123e4567-e89b-12d3-a456-426614174000'
+
+# (route name, router args, callback_data the old chain received)
+ROUTES = [
+    ('upgrade_basic', (), 'upgrade_basic'),
+    ('remind_setup', (HABIT_ID,), f'remind_setup_{HABIT_ID}'),
+    ('day', ('Mon', HABIT_ID), f'day_Mon_{HABIT_ID}'),
+    ('settime', ('08:00', HABIT_ID), f'settime_08:00_{HABIT_ID}'),
+    ('save_reminder', (HABIT_ID,), f'save_reminder_{HABIT_ID}'),
+    ('set_lang', ('de',), 'set_lang_de'),
+    ('settings_back', (), 'settings_back'),
+    ('complete', (HABIT_ID,), f'complete_{HABIT_ID}'),
+]
+
+
+def legacy_chain(data):
+    """The branch order of the old handle_callback if/elif chain"""
+    if data == 'upgrade_basic':
+        return 0
+    elif data == 'upgrade_coach':
+        return 1
+    elif data.startswith('remind_setup_'):
+        return 2
+    elif data.startswith('days_'):
+        return 3
+    elif data.startswith('day_'):
+        return 4
+    elif data.startswith('time_'):
+        return 5
+    elif data.startswith('settime_'):
+        return 6
+    elif data.startswith('customtime_'):
+        return 7
+    elif data.startswith('fallback_'):
+        return 8
+    elif data.startswith('save_reminder_'):
+        return 9
+    elif data.startswith('save_schedule_'):
+        return 10
+    elif data.startswith('enable_fallback_'):
+        return 11
+    elif data.startswith('disable_fallback_'):
+        return 12
+    elif data == 'settings_language_more':
+        return 13
+    elif data == 'settings_language':
+        return 14
+    elif data.startswith('set_lang_'):
+        return 15
+    elif data.startswith('settings_timezone'):
+        return 16
+    elif data == 'settings_back':
+        return 17
+    elif data.startswith('complete_'):
+        return 18
+    return None
+
+
+def main():
+    # habit_bot creates its Supabase client at import, a placeholder is enough here
+    os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:54321')
+    os.environ.setdefault('SUPABASE_KEY', 'mock.supabase.key')
+    from habit_bot import callbacks
+
+    number = 200000
+    print(f"⏱️ Callback dispatch cost ({number} iterations each, ns per call)\n")
+    print(f"{'route':<16}{'bytes':>6}{'router':>10}{'legacy':>10}{'old chain':>11}")
+
+    for name, args, legacy_data in ROUTES:
+        data = callbacks.encode(name, *args)
+        router = timeit.timeit(lambda: callbacks.resolve(data), number=number) / number * 1e9
+        legacy = timeit.timeit(lambda: callbacks.resolve(legacy_data), number=number) / number * 1e9
+        chain = timeit.timeit(lambda: legacy_chain(legacy_data), number=number) / number * 1e9
+        print(f"{name:<16}{len(data.encode()):>6}{router:>10.0f}{legacy:>10.0f}{chain:>11.0f}")
+
+    print("\nrouter = versioned callback data, legacy = old-format data still decoded by the router")
+
+
+if __name__ == '__main__':
+    main()
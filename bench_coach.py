@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark the AI coach's OpenAI pipeline against mock_openai_server.py.
+Runs the same validation, retry and fallback code as /coach, fully offline.
+
+Usage:
+    python mock_openai_server.py --rate-limit-ratio 0.1 --unavailable-models gpt-4o-mini --unavailable-after-validation
+    python bench_coach.py --requests 200 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+QUESTIONS = [
+    "Why do I keep breaking my reading streak on weekends?",
+    "How can I build discipline to exercise every morning?",
+    "I feel unmotivated today, how do I still do my habits?",
+    "What is the best way to stop scrolling my phone at night?",
+]
+
+
+def fetch_stats(base_url):
+    """Read the mock server's counters"""
+    stats_url = base_url.rstrip('/').rsplit('/v1', 1)[0] + '/stats'
+    with urllib.request.urlopen(stats_url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the coach OpenAI pipeline offline")
+    parser.add_argument('--base-url', default='http://127.0.0.1:8089/v1')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    # Configure before import, habit_bot reads these at module level
+    os.environ['OPENAI_BASE_URL'] = args.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'mock-key')
+    os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:54321')
+    os.environ.setdefault('SUPABASE_KEY', 'mock.supabase.key')
+
+    import habit_bot
+    from coach_memory import build_coach_messages, empty_memory
+
+    client = habit_bot.get_openai_client()
+
+    async def run_pipeline(question):
+        if not await habit_bot.validate_coach_question(client, question):
+            return 'rejected'
+        messages = build_coach_messages(
+            habit_bot.COACH_SYSTEM_PROMPT,
+            f"User's current habits: Read 10 pages, Morning run\n\nQuestion: {question}",
+            empty_memory()
+        )
+        await habit_bot.create_coach_completion(client, messages)
+        return 'answered'
+
+    def one_request(i):
+        started = time.perf_counter()
+        try:
+            outcome = asyncio.run(run_pipeline(QUESTIONS[i % len(QUESTIONS)]))
+        except Exception as e:
+            outcome = f"error: {type(e).__name__}"
+        return outcome, time.perf_counter() - started
+
+    before = fetch_stats(args.base_url)
+    print(f"🏋️ Running {args.requests} coach requests with concurrency {args.concurrency}...")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one_request, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    after = fetch_stats(args.base_url)
+    latencies = [latency for _, latency in results]
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def delta(key):
+        return after[key] - before[key]
+
+    fallback_calls = after['by_model'].get('gpt-3.5-turbo', 0) - before['by_model'].get('gpt-3.5-turbo', 0)
+
+    print("\n📊 Results")
+    print(f"• Throughput: {args.requests / elapsed:.1f} coach requests/s")
+    print(f"• Latency p50: {percentile(latencies, 50) * 1000:.0f}ms")
+    print(f"• Latency p95: {percentile(latencies, 95) * 1000:.0f}ms")
+    print(f"• Latency p99: {percentile(latencies, 99) * 1000:.0f}ms")
+    print(f"• Mean: {statistics.mean(latencies) * 1000:.0f}ms")
+    print(f"• Outcomes: {outcomes}")
+    print(f"• OpenAI HTTP calls: {delta('requests')} ({delta('requests') / args.requests:.2f} per request)")
+    print(f"• 429 responses: {delta('rate_limited')}")
+    print(f"• Fallback (gpt-3.5-turbo) calls: {fallback_calls}")
+    print(f"• Tokens: {delta('prompt_tokens')} prompt, {delta('completion_tokens')} completion")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the bot's handlers with synthetic users and updates.
+
+Starts mock_supabase_server.py (a generated population of users, habits and
+completion history), mock_openai_server.py, mock_stripe_server.py and
+mock_telegram_server.py on free local ports, then feeds synthetic Telegram
+updates for each command and button through the real Application from
+habit_bot.py. Reports p50/p95/p99 latency, Supabase round trips, Bot API calls
+and allocated memory per update for each scenario.
+
+Data, user choice and mock latencies are seeded and fixed, so runs are
+repeatable: save one with --json and compare later runs against it with
+--baseline to catch regressions.
+
+Usage:
+    python bench_handlers.py
+    python bench_handlers.py --users 5000 --updates 300 --db-latency-ms 20 --json bench.json
+    python bench_handlers.py --scenarios /habits /stats --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOT_TOKEN = '1000000001:mock-token'
+COACH_QUESTIONS = [
+    "How do I keep my reading streak going on weekends?",
+    "What's a good way to build a morning exercise habit?",
+    "I keep skipping meditation, any advice?",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Mock server on port {port} exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Mock server on port {port} did not start")
+
+
+def start_mocks(args):
+    """Start the stand-ins, returns (processes, environment for the bot)"""
+    ports = {name: free_port() for name in ('supabase', 'openai', 'stripe', 'telegram')}
+    commands = {
+        'supabase': ['mock_supabase_server.py', '--users', args.users, '--seed', args.seed,
+                     '--latency-ms', args.db_latency_ms],
+        'openai': ['mock_openai_server.py', '--latency-ms', args.openai_latency_ms, '--jitter-ms', 0,
+                   '--distribution', 'fixed'],
+        'stripe': ['mock_stripe_server.py', '--subscriptions', 10, '--latency-ms', args.stripe_latency_ms],
+        'telegram': ['mock_telegram_server.py', '--latency-ms', args.telegram_latency_ms],
+    }
+    processes = []
+    for name, command in commands.items():
+        argv = [sys.executable, os.path.join(HERE, command[0]), '--port', str(ports[name])]
+        processes.append(subprocess.Popen(argv + [str(arg) for arg in command[1:]], stdout=subprocess.DEVNULL))
+    for process, port in zip(processes, ports.values()):
+        wait_for_port(port, process)
+
+    env = {
+        'SUPABASE_URL': f"http://127.0.0.1:{ports['supabase']}",
+        'SUPABASE_KEY': 'mock.supabase.key',
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{ports['openai']}/v1",
+        'OPENAI_API_KEY': 'mock-key',
+        'STRIPE_API_BASE': f"http://127.0.0.1:{ports['stripe']}",
+        'STRIPE_SECRET_KEY': 'sk_test_mock',
+        'STRIPE_PRICE_ID': 'price_mock_basic',
+        'STRIPE_COACH_PRICE_ID': 'price_mock_coach',
+        'TELEGRAM_API_BASE': f"http://127.0.0.1:{ports['telegram']}",
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'STATE_BACKEND': 'none',
+    }
+    return processes, env
+
+
+class UpdateFactory:
+    """Telegram update payloads for synthetic users"""
+
+    def __init__(self):
+        self.next_id = 1
+
+    def _ids(self):
+        self.next_id += 1
+        return self.next_id
+
+    def sender(self, user):
+        return {'id': int(user['user_id']), 'is_bot': False, 'first_name': 'Bench', 'language_code': 'en'}
+
+    def command(self, user, text):
+        update_id = self._ids()
+        command = text.split()[0]
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': int(user['user_id']), 'type': 'private'}, 'from': self.sender(user),
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        }}
+
+    def callback(self, user, data):
+        update_id = self._ids()
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self.sender(user), 'chat_instance': str(user['user_id']), 'data': data,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()), 'text': '…',
+                'chat': {'id': int(user['user_id']), 'type': 'private'}
+            }
+        }}
+
+
+def build_scenarios(callbacks):
+    """(handler label, users it applies to, payload builder) for each scenario"""
+    anyone = lambda user: True
+    with_habits = lambda user: bool(user['habits'])
+    return [
+        ('/start', anyone, lambda f, u, rng: f.command(u, '/start')),
+        ('/habits', anyone, lambda f, u, rng: f.command(u, '/habits')),
+        ('/complete', anyone, lambda f, u, rng: f.command(u, '/complete')),
+        ('/stats', anyone, lambda f, u, rng: f.command(u, '/stats')),
+        ('/commands', anyone, lambda f, u, rng: f.command(u, '/commands')),
+        ('/settings', anyone, lambda f, u, rng: f.command(u, '/settings')),
+        ('/upgrade', anyone, lambda f, u, rng: f.command(u, '/upgrade')),
+        ('/remind', anyone, lambda f, u, rng: f.command(u, '/remind')),
+        ('/pause', with_habits, lambda f, u, rng: f.command(u, '/pause 2030-01-01 2030-01-07')),
+        ('/coach', lambda user: user['tier'] == 'coach',
+         lambda f, u, rng: f.command(u, f"/coach {rng.choice(COACH_QUESTIONS)}")),
+        ('callback:complete', with_habits,
+         lambda f, u, rng: f.callback(u, callbacks.encode('complete', rng.choice(u['habits'])))),
+        ('callback:remind_setup', with_habits,
+         lambda f, u, rng: f.callback(u, callbacks.encode('remind_setup', rng.choice(u['habits'])))),
+        ('callback:upgrade_basic', lambda user: user['tier'] == 'free',
+         lambda f, u, rng: f.callback(u, callbacks.encode('upgrade_basic'))),
+        ('callback:settings_language', anyone, lambda f, u, rng: f.callback(u, callbacks.encode('settings_language'))),
+    ]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def load_population(supabase):
+    """Users and their active habit ids, read once from the mock before measuring"""
+    users = {row['user_id']: {'user_id': row['user_id'], 'tier': row['subscription_tier'], 'habits': []}
+             for row in supabase.table('users').select('user_id, subscription_tier').execute().data}
+    for habit in supabase.table('habits').select('id, user_id').eq('is_active', True).execute().data:
+        users[habit['user_id']]['habits'].append(habit['id'])
+    return sorted(users.values(), key=lambda user: user['user_id'])
+
+
+async def run(args):
+    # Imported here, habit_bot reads the mock URLs from the environment at import
+    from telegram import Update
+    import metrics
+    import query_trace
+    from habit_bot import build_application, callbacks
+    from services import supabase
+
+    app = build_application()
+    await app.initialize()
+    await app.start()  # So background tasks (coach memory, logging) are awaited on stop
+    population = await load_population(supabase)
+    factory = UpdateFactory()
+    rng = random.Random(args.seed)
+    results = {}
+
+    async def process(payload):
+        await app.process_update(Update.de_json(payload, app.bot))
+
+    def telegram_calls(label):
+        return sum(count for (handler, _, _), count in metrics.telegram_requests.values.items() if handler == label)
+
+    try:
+        for label, eligible, build in build_scenarios(callbacks):
+            if args.scenarios and label not in args.scenarios:
+                continue
+            users = [user for user in population if eligible(user)]
+            if not users:
+                print(f"⏭️ {label}: no eligible users")
+                continue
+            payloads = [build(factory, rng.choice(users), rng) for _ in range(args.warmup + args.updates + args.alloc_samples)]
+            warmup, measured, sampled = (payloads[:args.warmup], payloads[args.warmup:args.warmup + args.updates],
+                                         payloads[args.warmup + args.updates:])
+
+            for payload in warmup:
+                await process(payload)
+            query_trace.summary.clear()
+            calls_before = telegram_calls(label)
+            errors_before = metrics.handler_errors.values.get((label,), 0)
+
+            latencies = []
+            for payload in measured:
+                started = time.perf_counter()
+                await process(payload)
+                latencies.append(time.perf_counter() - started)
+
+            traced = query_trace.summary.handlers.get(label, {})
+            runs = traced.get('runs') or 1
+            calls = telegram_calls(label) - calls_before
+
+            # Separate pass, tracemalloc slows everything it traces
+            allocated = []
+            tracemalloc.start()
+            for payload in sampled:
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                await process(payload)
+                allocated.append(tracemalloc.get_traced_memory()[1] - baseline)
+            tracemalloc.stop()
+
+            results[label] = {
+                'updates': len(latencies),
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'mean_ms': statistics.mean(latencies) * 1000,
+                'queries_per_update': traced.get('queries', 0) / runs,
+                'max_queries': traced.get('max_queries', 0),
+                'n_plus_one_runs': traced.get('n_plus_one_runs', 0),
+                'telegram_calls_per_update': calls / len(latencies),
+                'errors': metrics.handler_errors.values.get((label,), 0) - errors_before,
+                'alloc_kb': statistics.mean(allocated) / 1024 if allocated else 0.0,
+            }
+    finally:
+        await app.stop()
+        await app.shutdown()
+    return results
+
+
+def print_results(results, baseline):
+    print(f"\n{'scenario':<28}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}{'queries':>9}{'max':>5}"
+          f"{'N+1':>5}{'bot API':>9}{'alloc KB':>10}{'errors':>8}")
+    for label, r in results.items():
+        line = (f"{label:<28}{r['p50_ms']:>8.1f}{r['p95_ms']:>8.1f}{r['p99_ms']:>8.1f}{r['queries_per_update']:>9.2f}"
+                f"{r['max_queries']:>5}{r['n_plus_one_runs']:>5}{r['telegram_calls_per_update']:>9.2f}"
+                f"{r['alloc_kb']:>10.1f}{r['errors']:>8}")
+        old = baseline.get(label)
+        if old:
+            line += f"   p95 {(r['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}%, queries {r['queries_per_update'] - old['queries_per_update']:+.2f}"
+        print(line)
+    print("\nqueries = Supabase round trips per update, max = most in one update, "
+          "N+1 = updates repeating a query shape (query_trace.py), bot API = Telegram calls per update")
+
+
+def regressions(results, baseline, max_regression):
+    """Scenarios slower or issuing more queries than the baseline"""
+    failures = []
+    for label, r in results.items():
+        old = baseline.get(label)
+        if not old:
+            continue
+        if r['queries_per_update'] > old['queries_per_update'] + 0.01:
+            failures.append(f"{label}: {r['queries_per_update']:.2f} queries per update, was {old['queries_per_update']:.2f}")
+        if r['p95_ms'] > old['p95_ms'] * (1 + max_regression):
+            failures.append(f"{label}: p95 {r['p95_ms']:.1f}ms, was {old['p95_ms']:.1f}ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers offline")
+    parser.add_argument('--users', type=int, default=1000, help="Synthetic users generated by the Supabase mock")
+    parser.add_argument('--updates', type=int, default=100, help="Measured updates per scenario")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured updates per scenario first")
+    parser.add_argument('--alloc-samples', type=int, default=20, help="Updates per scenario measured with tracemalloc")
+    parser.add_argument('--scenarios', nargs='*', help="Only these, e.g. /habits callback:complete")
+    parser.add_argument('--db-latency-ms', type=float, default=10, help="Round trip to Supabase")
+    parser.add_argument('--telegram-latency-ms', type=float, default=30, help="Round trip to the Bot API")
+    parser.add_argument('--openai-latency-ms', type=float, default=500)
+    parser.add_argument('--stripe-latency-ms', type=float, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Write the results here")
+    parser.add_argument('--baseline', help="Results of an earlier run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.3,
+                        help="Allowed p95 slowdown against the baseline (query counts must not grow at all)")
+    args = parser.parse_args()
+
+    processes, env = start_mocks(args)
+    try:
+        os.environ.update(env)
+        print(f"🏋️ {args.updates} updates per scenario, {args.users} users, "
+              f"Supabase {args.db_latency_ms}ms, Bot API {args.telegram_latency_ms}ms")
+        results = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+    failures = regressions(results, baseline, args.max_regression)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of message rendering cost.
+Compares the compiled catalog in i18n.py against raw dict lookups plus
+str.format on every call, and reports the one-off cost of loading and
+compiling each language.
+
+Usage:
+    python bench_translations.py
+    python bench_translations.py --language de --number 100000
+"""
+
+import argparse
+import json
+import timeit
+import i18n
+from i18n import get_translation, load_translations, compile_language, TRANSLATIONS_PATH
+
+# (label, key, values) for messages the handlers send most
+MESSAGES = [
+    ('plain', 'which_completed', {}),
+    ('one field', 'habit_added', {'habit': 'Drink 8 glasses of water'}),
+    ('repeat field', 'time_set', {'time': '07:30', 'habit': 'Morning run'}),
+    ('stats', 'stats', {
+        'level': 4, 'xp': 370, 'progress': 70, 'level_xp': 100,
+        'needed': 30, 'completions': 37, 'habits': 3
+    }),
+    ('long plain', 'premium_coach_welcome', {}),
+]
+
+
+def naive_translation(translations, language, key, **kwargs):
+    """The old get_translation's dict lookups and str.format, plus the same English fallback"""
+    lang = translations.get(language, translations['en'])
+    text = lang.get(key) or translations['en'].get(key, key)
+    return text.format(**kwargs)
+
+
+def clear_caches():
+    load_translations.cache_clear()
+    compile_language.cache_clear()
+    i18n._catalogs.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark translation rendering")
+    parser.add_argument('--language', default='es', help="Language to render in (English fills the gaps)")
+    parser.add_argument('--number', type=int, default=200000, help="Iterations per message")
+    args = parser.parse_args()
+
+    # One-off costs, paid by the first message in each language
+    clear_caches()
+    load_ms = timeit.timeit(load_translations, number=1) * 1000
+    english_ms = timeit.timeit(lambda: compile_language(i18n.DEFAULT_LANGUAGE), number=1) * 1000
+    other_ms = []
+    for language in load_translations():
+        if language != i18n.DEFAULT_LANGUAGE:
+            other_ms.append(timeit.timeit(lambda: compile_language(language), number=1) * 1000)
+    print(f"📦 Load translations.json: {load_ms:.2f} ms")
+    print(f"🔧 Compile English: {english_ms:.2f} ms, other languages: "
+          f"{sum(other_ms) / len(other_ms):.2f} ms each ({len(other_ms)} languages)\n")
+
+    with open(TRANSLATIONS_PATH, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+
+    number = args.number
+    print(f"⏱️ Rendering cost in '{args.language}' ({number} iterations each, ns per message)\n")
+    print(f"{'message':<14}{'key':<24}{'catalog':>10}{'naive':>10}")
+    for label, key, values in MESSAGES:
+        language = args.language
+        catalog = timeit.timeit(lambda: get_translation(language, key, **values), number=number) / number * 1e9
+        naive = timeit.timeit(lambda: naive_translation(raw, language, key, **values), number=number) / number * 1e9
+        print(f"{label:<14}{key:<24}{catalog:>10.0f}{naive:>10.0f}")
+
+    missing = [key for key in raw[i18n.DEFAULT_LANGUAGE] if key not in raw.get(args.language, {})]
+    print("\ncatalog = compiled templates, naive = dict lookups and str.format per message")
+    print(f"{len(missing)} of {len(raw[i18n.DEFAULT_LANGUAGE])} keys fall back to English in '{args.language}'")
+
+
+if __name__ == '__main__':
+    main()
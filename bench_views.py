@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the static screens (/commands, /upgrade, /settings, language picker).
+Compares building the text and keyboard on every call against the memoized render_view.
+
+Usage:
+    python bench_views.py
+    python bench_views.py --language de --number 20000
+"""
+
+import argparse
+import os
+import timeit
+import tracemalloc
+
+# (view, tier, extra args)
+VIEWS = [
+    ('commands', 'free', ()),
+    ('commands', 'coach', ()),
+    ('upgrade', None, ()),
+    ('settings', None, ('Europe/London',)),
+    ('settings_language', None, ()),
+    ('settings_language_more', None, ()),
+]
+
+
+def allocated_bytes(fn):
+    """Peak bytes allocated during one call"""
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark static screen rendering")
+    parser.add_argument('--language', default='en')
+    parser.add_argument('--number', type=int, default=20000, help="Iterations per view")
+    args = parser.parse_args()
+
+    # habit_bot creates its Supabase client at import, a placeholder is enough here
+    os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:54321')
+    os.environ.setdefault('SUPABASE_KEY', 'mock.supabase.key')
+    from habit_bot import render_view, VIEWS as BUILDERS
+
+    number = args.number
+    language = args.language
+    print(f"⏱️ Static screen cost in '{language}' ({number} iterations each)\n")
+    print(f"{'view':<24}{'tier':<7}{'build µs':>10}{'cached µs':>11}{'build B':>10}{'cached B':>10}")
+    for view, tier, extra in VIEWS:
+        build = lambda: BUILDERS[view](tier, language, *extra)
+        cached = lambda: render_view(view, tier, language, *extra)
+        cached()  # Warm the cache, as the first user of each language does
+
+        build_us = timeit.timeit(build, number=number) / number * 1e6
+        cached_us = timeit.timeit(cached, number=number) / number * 1e6
+        print(f"{view:<24}{str(tier):<7}{build_us:>10.2f}{cached_us:>11.2f}"
+              f"{allocated_bytes(build):>10}{allocated_bytes(cached):>10}")
+
+    info = render_view.cache_info()
+    print(f"\n📦 render_view cache: {info.currsize} entries, {info.hits} hits, {info.misses} misses")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Router for inline button callback queries.
+
+callback_data is encoded as "<version>|<code>|<arg>|..." using a short code per
+action, so dispatch is a single dict lookup instead of an if/elif chain and the
+data always fits in Telegram's 64 byte limit. Buttons sent before the router
+existed still carry the old "days_<id>" style data, those are decoded through a
+fallback table of legacy prefixes.
+"""
+
+import inspect
+
+CALLBACK_VERSION = '1'
+SEPARATOR = '|'
+MAX_CALLBACK_DATA = 64  # Telegram limit, in bytes
+
+
+class CallbackRouter:
+    def __init__(self):
+        self.handlers = {}  # code -> handler
+        self.codes = {}  # route name -> code
+        self.names = {}  # code -> route name
+        self.signatures = {}  # handler -> inspect.Signature, to check args before calling
+        self.legacy_exact = {}  # old callback_data -> code
+        self.legacy_prefixes = []  # (prefix, code, arg count), longest prefix first
+        self.prefix = CALLBACK_VERSION + SEPARATOR
+
+    def route(self, name, code, legacy=None, legacy_prefix=None, legacy_args=1):
+        """Register a handler(update, context, *args) for a route"""
+        def decorator(handler):
+            if code in self.handlers:
+                raise ValueError(f"Callback code '{code}' is already used by '{self.names[code]}'")
+            self.handlers[code] = handler
+            self.signatures[handler] = inspect.signature(handler)
+            self.codes[name] = code
+            self.names[code] = name
+            if legacy:
+                self.legacy_exact[legacy] = code
+            if legacy_prefix:
+                self.legacy_prefixes.append((legacy_prefix, code, legacy_args))
+                self.legacy_prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            return handler
+        return decorator
+
+    def encode(self, name, *args):
+        """Build the callback_data for a route"""
+        parts = [CALLBACK_VERSION, self.codes[name]]
+        for arg in args:
+            arg = str(arg)
+            if SEPARATOR in arg:
+                raise ValueError(f"Callback argument '{arg}' contains '{SEPARATOR}'")
+            parts.append(arg)
+        data = SEPARATOR.join(parts)
+        if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+            raise ValueError(f"Callback data for '{name}' is over {MAX_CALLBACK_DATA} bytes: {data}")
+        return data
+
+    def decode_legacy(self, data):
+        """Decode callback_data from buttons sent before the router existed"""
+        code = self.legacy_exact.get(data)
+        if code:
+            return code, ()
+        for prefix, code, arg_count in self.legacy_prefixes:
+            if data.startswith(prefix):
+                rest = data[len(prefix):]
+                return code, tuple(rest.split('_', arg_count - 1)) if arg_count > 1 else (rest,)
+        return None, ()
+
+    def resolve(self, data):
+        """Return (handler, args) for callback_data, or (None, ()) if unknown"""
+        if data.startswith(self.prefix):
+            parts = data.split(SEPARATOR)
+            return self.handlers.get(parts[1]), tuple(parts[2:])
+        code, args = self.decode_legacy(data)
+        return self.handlers.get(code), args
+
+    def name_for(self, data):
+        """Route name for callback_data, used for logging"""
+        if data.startswith(self.prefix):
+            return self.names.get(data.split(SEPARATOR, 2)[1], 'unknown')
+        code, _ = self.decode_legacy(data)
+        return self.names.get(code, 'unknown')
+
+    async def dispatch(self, update, context):
+        """Run the handler for an update's callback query"""
+        data = update.callback_query.data or ''
+        handler, args = self.resolve(data)
+        if handler is None:
+            print(f"Unknown callback data: {data}")
+            return
+        # Truncated or hand-crafted data can carry the wrong number of args
+        try:
+            self.signatures[handler].bind(update, context, *args)
+        except TypeError:
+            print(f"Malformed callback data: {data}")
+            return
+        await handler(update, context, *args)
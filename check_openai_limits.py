@@ -8,6 +8,7 @@ from datetime import datetime
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or 'https://api.openai.com/v1'
 
 if not OPENAI_API_KEY:
     print("❌ No OpenAI API key found in environment!")
@@ -31,7 +32,7 @@ test_data = {
 
 try:
     response = requests.post(
-        "https://api.openai.com/v1/chat/completions",
+        f"{OPENAI_BASE_URL.rstrip('/')}/chat/completions",
         headers=headers,
         json=test_data
     )
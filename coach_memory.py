@@ -0,0 +1,160 @@
+"""
+Bounded conversational memory for the AI Habit Coach.
+
+Recent coach_conversations rows are replayed verbatim, and anything older is
+folded into a rolling summary stored in the coach_memory table. This keeps the
+prompt size bounded no matter how long a user has been talking to the coach.
+"""
+
+import asyncio
+from metrics import track_call
+from services import run_query
+
+# Memory limits
+COACH_HISTORY_TURNS = 8  # Max unsummarized turns fetched per request
+COACH_FOLD_MAX_TURNS = 50  # Max turns folded into the summary at once, the rest wait for the next compaction
+COACH_MEMORY_TOKEN_BUDGET = 600  # Summary + replayed turns must fit in this
+COACH_KEEP_RECENT_TURNS = 2  # Turns left verbatim after compaction
+COACH_SUMMARY_MAX_TOKENS = 200
+
+SUMMARY_PROMPT = (
+    "You maintain a short memory of a habit coaching conversation. "
+    "Merge the existing summary with the new exchanges into one concise summary "
+    "of the user's goals, struggles, habits mentioned and advice already given. "
+    "Write in third person, plain text, at most 120 words."
+)
+
+
+def estimate_tokens(text):
+    """Rough token estimate, same heuristic as the coach's usage logging"""
+    return int(len((text or '').split()) * 1.3)
+
+
+def turn_tokens(turn):
+    """Estimated tokens for one question/response pair"""
+    return estimate_tokens(turn['question']) + estimate_tokens(turn['response'])
+
+
+def empty_memory():
+    """Memory for a user with no coaching history"""
+    return {'summary': '', 'summarized_through': None, 'history_tokens': 0, 'turns': []}
+
+
+async def load_coach_memory(supabase, user_id):
+    """Load the rolling summary and the turns that haven't been summarized yet"""
+    memory_result = await run_query(supabase.table('coach_memory').select(
+        "summary, summarized_through, history_tokens"
+    ).eq('user_id', user_id))
+    row = memory_result.data[0] if memory_result.data else {}
+
+    turns_query = supabase.table('coach_conversations').select(
+        "question, response, created_at"
+    ).eq('user_id', user_id)
+    if row.get('summarized_through'):
+        turns_query = turns_query.gt('created_at', row['summarized_through'])
+    turns_result = await run_query(turns_query.order('created_at', desc=True).limit(COACH_HISTORY_TURNS))
+
+    return {
+        'summary': row.get('summary') or '',
+        'summarized_through': row.get('summarized_through'),
+        'history_tokens': row.get('history_tokens') or 0,
+        'turns': list(reversed(turns_result.data or []))  # Oldest first
+    }
+
+
+def build_coach_messages(system_prompt, user_content, memory):
+    """Build the chat messages for a coach call, keeping memory within budget"""
+    messages = [{"role": "system", "content": system_prompt}]
+    budget = COACH_MEMORY_TOKEN_BUDGET
+
+    if memory['summary']:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of your earlier conversation with this user: {memory['summary']}"
+        })
+        budget -= estimate_tokens(memory['summary'])
+
+    # Replay the newest turns that still fit, dropping the oldest first
+    replayed = []
+    for turn in reversed(memory['turns']):
+        cost = turn_tokens(turn)
+        if cost > budget:
+            break
+        budget -= cost
+        replayed.append(turn)
+
+    for turn in reversed(replayed):
+        messages.append({"role": "user", "content": turn['question']})
+        messages.append({"role": "assistant", "content": turn['response']})
+
+    messages.append({"role": "user", "content": user_content})
+    return messages
+
+
+def prompt_tokens(messages):
+    """Estimated prompt size of a list of chat messages"""
+    return sum(estimate_tokens(m['content']) for m in messages)
+
+
+def naive_prompt_tokens(bounded_messages, memory):
+    """What the same prompt would cost if the full history were replayed instead"""
+    base = prompt_tokens(bounded_messages[:1]) + estimate_tokens(bounded_messages[-1]['content'])
+    return base + memory['history_tokens']
+
+
+def needs_compaction(memory, new_turn):
+    """Check if the unsummarized history has outgrown the memory budget"""
+    total = estimate_tokens(memory['summary'])
+    total += sum(turn_tokens(t) for t in memory['turns']) + turn_tokens(new_turn)
+    return total > COACH_MEMORY_TOKEN_BUDGET and len(memory['turns']) + 1 > COACH_KEEP_RECENT_TURNS
+
+
+def summarize_turns(client, summary, turns):
+    """Ask the model to fold older turns into the rolling summary"""
+    transcript = "\n\n".join(f"User: {t['question']}\nCoach: {t['response']}" for t in turns)
+    completion = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary: {summary or 'None'}\n\nNew exchanges:\n{transcript}"}
+        ],
+        max_tokens=COACH_SUMMARY_MAX_TOKENS,
+        temperature=0.3
+    )
+    return completion.choices[0].message.content.strip()
+
+
+async def load_older_turns(supabase, user_id, summarized_through, before):
+    """Unsummarized turns older than the fetched ones, oldest first"""
+    query = supabase.table('coach_conversations').select(
+        "question, response, created_at"
+    ).eq('user_id', user_id).lt('created_at', before)
+    if summarized_through:
+        query = query.gt('created_at', summarized_through)
+    result = await run_query(query.order('created_at').limit(COACH_FOLD_MAX_TURNS))
+    return result.data or []
+
+
+async def record_coach_turn(supabase, client, user_id, memory, new_turn):
+    """Update the memory row after an answer, compacting old turns if needed"""
+    params = {'p_user_id': user_id, 'p_tokens': turn_tokens(new_turn)}
+
+    if needs_compaction(memory, new_turn):
+        # The new turn is already stored and counts as one of the recent turns kept verbatim
+        keep = COACH_KEEP_RECENT_TURNS - 1
+        to_fold = memory['turns'][:len(memory['turns']) - keep]
+        if to_fold:
+            try:
+                if len(memory['turns']) >= COACH_HISTORY_TURNS:
+                    # The fetch stopped at COACH_HISTORY_TURNS, so older turns may be unsummarized too
+                    older = await load_older_turns(
+                        supabase, user_id, memory['summarized_through'], memory['turns'][0]['created_at'])
+                    to_fold = (older + to_fold)[:COACH_FOLD_MAX_TURNS]
+                with track_call('openai', 'summarize'):
+                    params['p_summary'] = await asyncio.to_thread(summarize_turns, client, memory['summary'], to_fold)
+                params['p_summarized_through'] = to_fold[-1]['created_at']
+            except Exception as e:
+                # Keep the old summary, build_coach_messages still enforces the budget
+                print(f"Error compacting coach memory: {e}")
+
+    await run_query(supabase.rpc('record_coach_memory', params))
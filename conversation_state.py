@@ -0,0 +1,71 @@
+"""
+Per-user conversation state for free-text replies.
+
+Each user has one ConversationState in context.user_data holding the step we
+are waiting on, the habit it's about and the reminder settings being edited.
+handle_message routes on the step with a dict lookup, and the draft only ever
+holds one habit, so state stays small however many habits a user configures.
+"""
+
+import time
+
+STATE_KEY = 'conversation'
+STATE_TTL = 30 * 60  # Seconds of inactivity before pending input is forgotten
+
+# Steps
+IDLE = 'idle'
+AWAITING_HABIT_NAME = 'awaiting_habit_name'
+AWAITING_TIME = 'awaiting_time'
+AWAITING_FALLBACK_TIME = 'awaiting_fallback_time'
+AWAITING_TIMEZONE = 'awaiting_timezone'
+
+
+class ConversationState:
+    __slots__ = ('step', 'habit_id', 'draft', 'expires_at')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.step = IDLE
+        self.habit_id = None  # Habit the draft belongs to
+        self.draft = {}  # Pending reminder settings: days, time, fallback_enabled, fallback_time
+        self.expires_at = 0
+
+    def touch(self):
+        self.expires_at = time.time() + STATE_TTL
+
+    def expect(self, step, habit_id=None):
+        """Wait for a free-text reply for the given step"""
+        if habit_id is not None:
+            self.schedule_draft(habit_id)
+        self.step = step
+        self.touch()
+
+    def done(self):
+        """Stop waiting for a reply, keeping any draft"""
+        self.step = IDLE
+        self.touch()
+
+    def schedule_draft(self, habit_id):
+        """Pending reminder settings for a habit, dropping any draft for another habit"""
+        habit_id = str(habit_id)
+        if self.habit_id != habit_id:
+            self.habit_id = habit_id
+            self.draft = {}
+        self.touch()
+        return self.draft
+
+    def discard_draft(self):
+        self.habit_id = None
+        self.draft = {}
+
+
+def get_state(user_data):
+    """The user's conversation state, reset if it has expired"""
+    state = user_data.get(STATE_KEY)
+    if state is None:
+        state = user_data[STATE_KEY] = ConversationState()
+    elif state.expires_at and time.time() > state.expires_at:
+        state.reset()
+    return state
@@ -0,0 +1,63 @@
+"""
+Local-day boundaries for "completed today?" checks.
+
+habit_logs.completed_at is stored in UTC, so "today" for a user is the UTC
+range between their local midnights. The bounds for each (timezone, date) pair
+are computed once and cached; every user in the same timezone shares the entry,
+and days with a DST change come out 23 or 25 hours long.
+"""
+
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+import pytz
+
+DAY_BOUNDS_CACHE_SIZE = 8192  # About two days for every IANA timezone
+
+
+@lru_cache(maxsize=None)
+def get_zone(tz_name):
+    """The pytz timezone for a name, UTC if it's missing or unknown"""
+    try:
+        return pytz.timezone(tz_name or 'UTC')
+    except pytz.UnknownTimeZoneError:
+        return pytz.utc
+
+
+def local_midnight(zone, day):
+    """The UTC instant a local day starts, even if midnight is skipped or repeated"""
+    midnight = datetime.combine(day, time.min)
+    try:
+        local = zone.localize(midnight, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        local = zone.localize(midnight, is_dst=True)  # The first of the two midnights
+    except pytz.NonExistentTimeError:
+        local = zone.localize(midnight, is_dst=False)  # The moment the clocks jump
+    return local.astimezone(pytz.utc)
+
+
+@lru_cache(maxsize=DAY_BOUNDS_CACHE_SIZE)
+def day_bounds(tz_name, day):
+    """(start, end) of a local day as naive UTC ISO strings, for gte/lt filters"""
+    zone = get_zone(tz_name)
+    start = local_midnight(zone, day)
+    end = local_midnight(zone, day + timedelta(days=1))
+    return start.replace(tzinfo=None).isoformat(), end.replace(tzinfo=None).isoformat()
+
+
+def local_now(tz_name, now=None):
+    """The current time in a timezone"""
+    return (now or datetime.now(timezone.utc)).astimezone(get_zone(tz_name))
+
+
+def today_bounds(tz_name, now=None):
+    """(local date, start, end) of the user's current day"""
+    today = local_now(tz_name, now).date()
+    return (today,) + day_bounds(tz_name, today)
+
+
+def local_date_of(value, tz_name):
+    """Local date of a stored timestamp; naive values are UTC"""
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00')) if isinstance(value, str) else value
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(get_zone(tz_name)).date()
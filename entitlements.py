@@ -0,0 +1,82 @@
+"""
+Entitlement store: each user's subscription tier and when it runs out.
+
+Tier checks in the bot read from here, never from Stripe. Entries are loaded
+from the users table on first use and replaced by the Stripe event worker
+whenever a webhook changes a subscription, so upgrades and cancellations take
+effect without the user doing anything. The TTL only matters for changes made
+outside this process, e.g. by fix_coach_tier.py.
+"""
+
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from services import supabase, run_query
+
+ENTITLEMENT_TTL = 300  # Seconds before a cached entry is read again
+ENTITLEMENT_CACHE_SIZE = 50000
+EXPIRY_GRACE = timedelta(days=2)  # Keep paid features while Stripe retries a renewal
+
+Entitlement = namedtuple('Entitlement', ['tier', 'expires_at'])
+
+_cache = {}  # user_id -> (Entitlement or None for unknown users, cached_at)
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def effective_tier(tier, expires_at):
+    """The tier, or 'free' once it has lapsed past the grace period"""
+    if tier != 'free' and expires_at and datetime.now(timezone.utc) > expires_at + EXPIRY_GRACE:
+        return 'free'
+    return tier or 'free'
+
+
+def set_entitlement(user_id, tier, expires_at=None):
+    """Record a user's entitlement, e.g. after a webhook or signup"""
+    if isinstance(expires_at, str):
+        expires_at = parse_timestamp(expires_at)
+    _store(str(user_id), Entitlement(tier, expires_at))
+
+
+def forget_entitlement(user_id):
+    _cache.pop(str(user_id), None)
+
+
+def _store(user_id, entitlement):
+    _cache.pop(user_id, None)
+    if len(_cache) >= ENTITLEMENT_CACHE_SIZE:
+        _cache.pop(next(iter(_cache)))  # Oldest entry
+    _cache[user_id] = (entitlement, time.monotonic())
+
+
+async def get_entitlement(user_id):
+    """The user's Entitlement with expiry applied, or None if they haven't used /start"""
+    user_id = str(user_id)
+    cached = _cache.get(user_id)
+    if cached and time.monotonic() - cached[1] < ENTITLEMENT_TTL:
+        entitlement = cached[0]
+    else:
+        result = await run_query(
+            supabase.table('users').select("subscription_tier, tier_expires_at").eq('user_id', user_id)
+        )
+        entitlement = None
+        if result.data:
+            row = result.data[0]
+            entitlement = Entitlement(row['subscription_tier'] or 'free', parse_timestamp(row.get('tier_expires_at')))
+        _store(user_id, entitlement)
+
+    if entitlement is None:
+        return None
+    return Entitlement(effective_tier(*entitlement), entitlement.expires_at)
+
+
+async def get_tier(user_id):
+    """The user's current tier, 'free' for unknown users"""
+    entitlement = await get_entitlement(user_id)
+    return entitlement.tier if entitlement else 'free'
@@ -0,0 +1,176 @@
+"""
+Flood control for incoming updates, applied by the webhook before an update
+is queued, so excess updates cost no Supabase queries and no handler time.
+
+- Each user gets a token bucket per command class: cheap views (/habits,
+  /stats, ...), writes (/complete, /addhabit, ...), /coach, plain messages and
+  button taps each refill at their own rate, so spamming /stats doesn't use up
+  a user's /complete allowance.
+- A command or button tap identical to one of the user's updates that is still
+  queued or running is coalesced into it (double taps, repeated /stats), as is
+  a redelivery of an update that hasn't been handled yet.
+- At most FLOOD_MAX_BACKLOG updates are admitted but not yet handled. Past
+  that the webhook answers 503 and Telegram redelivers the update later.
+
+Rejected button taps are answered and throttled users are told once per burst,
+both in the webhook response itself (no extra Bot API call). Rejections are
+counted in bot_flood_rejected_total on /metrics.
+"""
+
+import os
+import time
+from collections import namedtuple
+
+from i18n import get_translation
+from metrics import flood_rejected
+
+FLOOD_CONTROL = os.getenv('FLOOD_CONTROL', '1') != '0'
+FLOOD_MAX_BACKLOG = int(os.getenv('FLOOD_MAX_BACKLOG', '1000'))  # Updates admitted but not yet handled
+FLOOD_LIMIT_SCALE = float(os.getenv('FLOOD_LIMIT_SCALE', '1'))  # Multiplies every rate and burst below
+SWEEP_INTERVAL = 60  # Seconds between dropping buckets that have refilled
+
+COMMAND_CLASSES = {
+    'start': 'view', 'habits': 'view', 'stats': 'view', 'commands': 'view', 'settings': 'view', 'upgrade': 'view',
+    'addhabit': 'write', 'complete': 'write', 'remind': 'write', 'pause': 'write',
+    'coach': 'coach',
+}
+# Class -> (updates per minute, burst) for each user
+LIMITS = {
+    'view': (20, 6),
+    'write': (30, 10),
+    'coach': (6, 3),  # On top of the daily session quota, which costs a query to check
+    'message': (30, 10),  # Habit names, reminder times and coach questions
+    'callback': (60, 15),
+    'other': (30, 10),  # Unknown commands, stickers, edits
+}
+
+Rejection = namedtuple('Rejection', ['status', 'reply'])  # reply: Bot API method call for the webhook response
+
+
+class TokenBucket:
+    """Holds up to burst tokens, refilled at rate per second"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'warned')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.warned = False  # The user was told to slow down since the bucket last ran dry
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.warned = False
+            return True
+        return False
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+_buckets = {}  # (user_id, class) -> TokenBucket
+_inflight = {}  # update_id -> coalescing key or None, for admitted updates until they are handled
+_pending = {}  # coalescing key -> number of admitted updates with it
+_last_sweep = time.monotonic()
+
+
+def classify(data):
+    """(user id, class, coalescing key or None, chat id, callback query id) for an update payload"""
+    callback = data.get('callback_query')
+    if callback:
+        user_id = callback['from']['id']
+        return user_id, 'callback', (user_id, 'callback', callback.get('data')), None, callback['id']
+
+    message = data.get('message') or data.get('edited_message')
+    if not message or 'from' not in message:
+        return None, None, None, None, None  # Channel posts, payments, membership changes: never limited
+    user_id = message['from']['id']
+    chat_id = message['chat']['id']
+    text = message.get('text')
+    if text is None or 'edited_message' in data:
+        return user_id, 'other', None, chat_id, None
+    if text.startswith('/'):
+        command = text.split()[0][1:].split('@')[0].lower()
+        return user_id, COMMAND_CLASSES.get(command, 'other'), (user_id, 'command', text.strip()), chat_id, None
+    return user_id, 'message', None, chat_id, None
+
+
+def _bucket(user_id, update_class, now):
+    bucket = _buckets.get((user_id, update_class))
+    if bucket is None:
+        per_minute, burst = LIMITS[update_class]
+        bucket = _buckets[(user_id, update_class)] = TokenBucket(
+            per_minute * FLOOD_LIMIT_SCALE / 60, max(burst * FLOOD_LIMIT_SCALE, 1), now)
+    return bucket
+
+
+def _sweep(now):
+    """Forget buckets that have refilled, they behave the same as new ones"""
+    global _last_sweep
+    _last_sweep = now
+    for key in [key for key, bucket in _buckets.items() if bucket.full(now)]:
+        del _buckets[key]
+
+
+def _language(data):
+    sender = (data.get('callback_query') or data.get('message') or data.get('edited_message') or {}).get('from', {})
+    return (sender.get('language_code') or 'en').split('-')[0]
+
+
+def _reject(data, update_class, reason, callback_id, chat_id, notify):
+    flood_rejected.inc(update_class or 'none', reason)
+    if callback_id:
+        # Stops the button's loading spinner, with a hint only when the user is being throttled
+        reply = {'method': 'answerCallbackQuery', 'callback_query_id': callback_id}
+        if notify:
+            reply['text'] = get_translation(_language(data), 'flood_slow_down')
+        return Rejection(200, reply)
+    if notify and chat_id is not None:
+        return Rejection(200, {
+            'method': 'sendMessage', 'chat_id': chat_id,
+            'text': get_translation(_language(data), 'flood_slow_down')
+        })
+    return Rejection(200, None)
+
+
+def admit(data):
+    """None if the update should be handled, otherwise the Rejection to answer the webhook with"""
+    if not FLOOD_CONTROL:
+        return None
+    update_id = data.get('update_id')
+    user_id, update_class, key, chat_id, callback_id = classify(data)
+
+    if update_id is not None and update_id in _inflight:
+        return _reject(data, update_class, 'duplicate', None, None, False)  # Telegram redelivered it
+    if len(_inflight) >= FLOOD_MAX_BACKLOG:
+        flood_rejected.inc(update_class or 'none', 'backlog')
+        return Rejection(503, None)
+    if user_id is not None:
+        if key is not None and key in _pending:
+            return _reject(data, update_class, 'coalesced', callback_id, chat_id, False)
+        now = time.monotonic()
+        if now - _last_sweep > SWEEP_INTERVAL:
+            _sweep(now)
+        bucket = _bucket(user_id, update_class, now)
+        if not bucket.take(now):
+            notify = not bucket.warned
+            bucket.warned = True
+            return _reject(data, update_class, 'rate', callback_id, chat_id, notify)
+
+    _inflight[update_id] = key
+    if key is not None:
+        _pending[key] = _pending.get(key, 0) + 1
+    return None
+
+
+def release(update):
+    """Called once an admitted update has been handled"""
+    key = _inflight.pop(getattr(update, 'update_id', None), None)
+    if key is not None:
+        if _pending[key] > 1:
+            _pending[key] -= 1
+        else:
+            del _pending[key]
@@ -1,39 +1,33 @@
 import os
 import asyncio
 from datetime import datetime, timedelta, time
+from functools import lru_cache
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from supabase import create_client, Client
 import stripe
-import json
 import openai
 import pytz
+from callback_router import CallbackRouter
+from conversation_state import get_state, AWAITING_HABIT_NAME, AWAITING_TIME, AWAITING_FALLBACK_TIME, AWAITING_TIMEZONE
+from coach_memory import empty_memory, load_coach_memory, build_coach_messages, prompt_tokens, naive_prompt_tokens, record_coach_turn
+from state_persistence import build_persistence
+from update_processor import build_update_processor
+from day_bounds import today_bounds, local_now
+from timezone_search import search_timezones
+from entitlements import get_entitlement, get_tier, set_entitlement, forget_entitlement
+from i18n import get_translation, LANGUAGE_NAMES, DEFAULT_LANGUAGE
+from metrics import instrument, track_handler, track_call, TelegramMetricsRequest
+from services import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL, STRIPE_PRICE_ID, STRIPE_COACH_PRICE_ID,
+    supabase, run_query, run_stripe
+)
 
 load_dotenv()
 
-# Load translations
-with open('translations.json', 'r') as f:
-    translations = json.load(f)
-
-def get_translation(user_language, key, **kwargs):
-    # Default to English if language is not supported
-    lang = translations.get(user_language, translations['en'])
-    return lang.get(key, '').format(**kwargs)
-
-# Environment variables
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
-STRIPE_PRICE_ID = os.getenv('STRIPE_PRICE_ID')
-STRIPE_COACH_PRICE_ID = os.getenv('STRIPE_COACH_PRICE_ID')
-STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# Environment variables (Telegram, Supabase and Stripe ones live in services.py)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-
-# Initialize services
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-stripe.api_key = STRIPE_SECRET_KEY
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # e.g. mock_openai_server.py for offline testing
 
 # Constants
 FREE_HABIT_LIMIT = 3
@@ -41,6 +35,29 @@ XP_PER_COMPLETION = 10
 LEVEL_XP_REQUIREMENT = 100
 DAILY_COACH_LIMIT = 10  # Max coach sessions per day
 
+def cancel_tasks(*tasks):
+    """Cancel speculative work that is no longer needed"""
+    for task in tasks:
+        if task is None:
+            continue
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # Mark failures as retrieved so they aren't logged as lost
+
+async def user_language(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """The user's language, read from their profile once and then kept in user_data"""
+    language = context.user_data.get('language')
+    if language is None:
+        try:
+            result = await run_query(supabase.table('profiles').select("language").eq('user_id', user_id))
+        except Exception as e:
+            print(f"Error loading language: {e}")
+            return DEFAULT_LANGUAGE
+        language = (result.data[0]['language'] if result.data else None) or DEFAULT_LANGUAGE
+        context.user_data['language'] = language
+    return language
+
 # Start command
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
@@ -49,117 +66,70 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check for payment success parameter
     if context.args and len(context.args) > 0:
         if context.args[0] == 'premium_success':
-            # Check if there's a pending Stripe session for this user
+            # The Stripe webhook applies the upgrade, so just report the current entitlement
             try:
-                # Store session ID when creating checkout
-                session_id = context.user_data.get('pending_session_id')
-                if session_id:
-                    # Verify the session with Stripe
-                    session = stripe.checkout.Session.retrieve(session_id)
-                    if session.payment_status == 'paid':
-                        # Retrieve the full session details with line items expanded
-                        session_with_items = stripe.checkout.Session.retrieve(
-                            session_id,
-                            expand=['line_items']
-                        )
-                        
-                        # Determine which tier based on price ID
-                        if session_with_items.line_items and session_with_items.line_items.data:
-                            price_id = session_with_items.line_items.data[0].price.id
-                            if price_id == STRIPE_COACH_PRICE_ID:
-                                # Update user to coach tier
-                                supabase.table('users').update({
-                                    'is_premium': True,
-                                    'subscription_tier': 'coach'
-                                }).eq('user_id', user_id).execute()
-                                await update.message.reply_text(
-                                    "🎆 **WELCOME TO COACH TIER!** 🎆\n\n"
-                                    "You've just unlocked the ULTIMATE habit transformation experience! 🚀\n\n"
-                                    "✨ **Your Coach Tier Superpowers:**\n"
-                                    "• 🤖 **AI Habit Coach** - Your personal habit expert available 24/7\n"
-                                    "• ♾️ **Unlimited Habits** - Track as many as you want\n"
-                                    "• 🔔 **Smart Reminders** - Custom times for each habit\n"
-                                    "• 📈 **Advanced Analytics** - Deep insights into your progress\n"
-                                    "• 🏆 **XP & Levels** - Gamified motivation system\n"
-                                    "• 🌍 **24 Languages** - Use the bot in your preferred language\n"
-                                    "• ⏸️ **Pause Mode** - Take breaks without losing streaks\n\n"
-                                    "🔥 **Get Started:**\n"
-                                    "• Try /coach to chat with your AI habit expert\n"
-                                    "• Use /addhabit to start building new habits\n"
-                                    "• Set custom /remind times for each habit\n\n"
-                                    "Let's build life-changing habits together! 💪\n\n"
-                                    "Thank you for believing in your potential! 💙",
-                                    parse_mode='Markdown'
-                                )
-                            else:
-                                # Update user to basic premium
-                                supabase.table('users').update({
-                                    'is_premium': True,
-                                    'subscription_tier': 'basic'
-                                }).eq('user_id', user_id).execute()
-                                await update.message.reply_text(
-                                    "🎉 Congratulations! You're now a Premium member!\n\n"
-                                    "✨ You can now add unlimited habits and access all premium features.\n\n"
-                                    "Thank you for your support! 💙"
-                                )
-                        context.user_data['pending_session_id'] = None
-                        return
+                context.user_data.pop('checkout_sessions', None)
+                forget_entitlement(user_id)
+                subscription_tier = await get_tier(user_id)
+                language = await user_language(context, user_id)
+                if subscription_tier == 'coach':
+                    await update.message.reply_text(
+                        get_translation(language, 'premium_coach_welcome'),
+                        parse_mode='Markdown'
+                    )
+                    return
+                elif subscription_tier == 'basic':
+                    await update.message.reply_text(
+                        get_translation(language, 'premium_success') + "\n\n" +
+                        get_translation(language, 'premium_basic_body')
+                    )
+                    return
+                else:
+                    await update.message.reply_text(get_translation(language, 'premium_pending'))
+                    return
             except Exception as e:
                 print(f"Error checking payment: {e}")
         elif context.args[0] == 'premium_cancel':
-            await update.message.reply_text(
-                "❌ Payment cancelled.\n\n"
-                "If you change your mind, you can always upgrade later with /upgrade"
-            )
+            language = await user_language(context, user_id)
+            await update.message.reply_text(get_translation(language, 'premium_cancel'))
             return
     
     # Check if user exists
     try:
-        result = supabase.table('users').select("*").eq('user_id', user_id).execute()
+        result = await run_query(supabase.table('users').select("*").eq('user_id', user_id))
         
         if not result.data:
             # Create new user
-            supabase.table('users').insert({
+            await run_query(supabase.table('users').insert({
                 'user_id': user_id,
                 'is_premium': False,
-                'subscription_tier': 'free'
-            }).execute()
+                'subscription_tier': 'free',
+                'timezone': 'UTC'
+            }))
+            set_entitlement(user_id, 'free')
             
             # Create user profile
-            supabase.table('profiles').insert({
+            await run_query(supabase.table('profiles').insert({
                 'user_id': user_id,
-                'data': {
-                    'name': user_name,
-                    'xp': 0,
-                    'level': 1,
-                    'language': 'en',
-                    'timezone': 'UTC'
-                }
-            }).execute()
-            
-            language = 'en'  # Default language for new users
-            welcome_message = f"🎉 Welcome to Habit Tracker Bot, {user_name}!\n\n"
-            welcome_message += "I'll help you build better habits and track your progress.\n\n"
-            welcome_message += "📋 Available commands:\n"
-            welcome_message += "/addhabit - Add a new habit\n"
-            welcome_message += "/habits - View your habits\n"
-            welcome_message += "/complete - Mark habit as complete\n"
-            welcome_message += "/stats - View your XP and level\n"
-            welcome_message += "/upgrade - Upgrade to premium\n"
+                'name': user_name,
+                'xp': 0,
+                'level': 1,
+                'language': 'en'
+            }))
+            
+            language = DEFAULT_LANGUAGE  # Default language for new users
+            context.user_data['language'] = language
+            welcome_message = get_translation(language, 'welcome_new', name=user_name) + "\n\n"
+            welcome_message += get_translation(language, 'welcome_new_body')
         else:
             # Get user's language preference from profile
-            profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
-            if profile_result.data and profile_result.data[0]['data']:
-                language = profile_result.data[0]['data'].get('language', 'en')
-            else:
-                language = 'en'
-            
-            welcome_message = f"👋 Welcome back, {user_name}!\n\n"
-            welcome_message += "Ready to continue your habit journey?\n"
-            welcome_message += "Use /habits to see your current habits."
+            language = await user_language(context, user_id)
             
+            welcome_message = get_translation(language, 'welcome_back', name=user_name) + "\n\n"
+            welcome_message += get_translation(language, 'welcome_back_body')
+    
     except Exception as e:
-        welcome_message = "❌ There was an error setting up your account. Please make sure the bot is properly configured."
+        welcome_message = get_translation(context.user_data.get('language'), 'setup_error')
         print(f"Error in start: {e}")
     
     await update.message.reply_text(welcome_message)
@@ -167,859 +137,925 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # Add habit command
 async def add_habit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     try:
         # Check user's premium status
-        user_result = supabase.table('users').select("is_premium").eq('user_id', user_id).execute()
-        is_premium = user_result.data[0]['is_premium'] if user_result.data else False
+        is_premium = await get_tier(user_id) != 'free'
         
         # Count current habits
-        habits_result = supabase.table('habits').select("id").eq('user_id', user_id).eq('is_active', True).execute()
+        habits_result = await run_query(supabase.table('habits').select("id").eq('user_id', user_id).eq('is_active', True))
         habit_count = len(habits_result.data)
         
         if not is_premium and habit_count >= FREE_HABIT_LIMIT:
-            await update.message.reply_text(
-                f"❌ Free users can only track up to {FREE_HABIT_LIMIT} habits.\n\n"
-                "🌟 Upgrade to premium for unlimited habits!\n"
-                "Use /upgrade to learn more."
-            )
+            await update.message.reply_text(get_translation(language, 'habit_limit', limit=FREE_HABIT_LIMIT))
             return
         
         # Store state for conversation
-        context.user_data['adding_habit'] = True
+        get_state(context.user_data).expect(AWAITING_HABIT_NAME)
         await update.message.reply_text(
-            "📝 Let's add a new habit!\n\n"
-            "What habit would you like to track?\n"
-            "(e.g., 'Drink 8 glasses of water', 'Exercise for 30 minutes')"
+            get_translation(language, 'add_habit') + "\n" +
+            get_translation(language, 'add_habit_examples')
         )
-        
+    
     except Exception as e:
-        await update.message.reply_text("❌ Error adding habit. Please try again.")
+        await update.message.reply_text(get_translation(language, 'add_habit_error'))
         print(f"Error in add_habit: {e}")
 
-# Handle habit text
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def parse_time_input(text):
+    """Parse a 24-hour HH:MM time, raising ValueError if it isn't one"""
+    time_parts = text.split(':')
+    if len(time_parts) != 2:
+        raise ValueError
+    
+    hour = int(time_parts[0])
+    minute = int(time_parts[1])
+    
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError
+    return text
+
+# Custom reminder time reply
+async def time_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state, text) -> None:
+    language = await user_language(context, str(update.effective_user.id))
+    
+    # Validate time format
+    try:
+        parse_time_input(text)
+        
+        # Store the time
+        habit_id = state.habit_id
+        state.schedule_draft(habit_id)['time'] = text
+        state.done()
+        
+        # Get habit name
+        habit_result = await run_query(supabase.table('habits').select("name").eq('id', habit_id))
+        habit_name = habit_result.data[0]['name'] if habit_result.data else get_translation(language, 'your_habit')
+        
+        # Show confirmation with options
+        keyboard = [
+            [InlineKeyboardButton(get_translation(language, 'btn_choose_days'), callback_data=callbacks.encode('days', habit_id))],
+            [InlineKeyboardButton(get_translation(language, 'btn_fallback'), callback_data=callbacks.encode('fallback', habit_id))],
+            [InlineKeyboardButton(get_translation(language, 'btn_save_settings'), callback_data=callbacks.encode('save_reminder', habit_id))]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(
+            get_translation(language, 'time_set', time=text, habit=habit_name),
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    
+    except ValueError:
+        await update.message.reply_text(
+            get_translation(language, 'invalid_time') + "\n" +
+            get_translation(language, 'time_examples')
+        )
+
+# Fallback reminder time reply
+async def fallback_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state, text) -> None:
+    language = await user_language(context, str(update.effective_user.id))
+    
+    # Similar validation for fallback time
+    try:
+        parse_time_input(text)
+        
+        # Store the fallback time
+        habit_id = state.habit_id
+        draft = state.schedule_draft(habit_id)
+        draft['fallback_time'] = text
+        draft['fallback_enabled'] = True
+        state.done()
+        
+        # Back to reminder setup
+        keyboard = [[InlineKeyboardButton(get_translation(language, 'btn_back_to_settings'), callback_data=callbacks.encode('remind_setup', habit_id))]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(
+            get_translation(language, 'fallback_time_set', time=text),
+            reply_markup=reply_markup
+        )
+    
+    except ValueError:
+        await update.message.reply_text(get_translation(language, 'invalid_time'))
+
+# Timezone reply
+async def timezone_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state, text) -> None:
     user_id = str(update.effective_user.id)
-    text = update.message.text
+    language = await user_language(context, user_id)
     
-    # Check if we're waiting for time input
-    setting_time_key = None
-    for key in context.user_data:
-        if key.startswith('setting_time_'):
-            setting_time_key = key
-            break
+    try:
+        # Validate timezone
+        tz_name = pytz.timezone(text.strip()).zone
+    except (pytz.exceptions.UnknownTimeZoneError, ValueError):
+        tz_name = None
     
-    if setting_time_key:
-        # Validate time format
-        try:
-            time_parts = text.split(':')
-            if len(time_parts) != 2:
-                raise ValueError
-            
-            hour = int(time_parts[0])
-            minute = int(time_parts[1])
-            
-            if not (0 <= hour <= 23 and 0 <= minute <= 59):
-                raise ValueError
-            
-            # Store the time
-            habit_id = setting_time_key.replace('setting_time_', '')
-            context.user_data[f'time_{habit_id}'] = text
-            context.user_data.pop(setting_time_key)
-            
-            # Get habit name
-            habit_result = supabase.table('habits').select("name").eq('id', habit_id).execute()
-            habit_name = habit_result.data[0]['name'] if habit_result.data else "your habit"
-            
-            # Show confirmation with options
-            keyboard = [
-                [InlineKeyboardButton("📅 Choose Days", callback_data=f'days_{habit_id}')],
-                [InlineKeyboardButton("🚑 Fallback Reminder", callback_data=f'fallback_{habit_id}')],
-                [InlineKeyboardButton("💾 Save Settings", callback_data=f'save_reminder_{habit_id}')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"✅ Time set to {text}!\n\n"
-                f"**{habit_name}** will remind you at {text}.\n\n"
-                "What would you like to do next?",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            
-        except ValueError:
-            await update.message.reply_text(
-                "❌ Invalid time format!\n\n"
-                "Please use 24-hour format: HH:MM\n"
-                "Examples: 09:00, 21:30, 13:45"
-            )
+    if tz_name:
+        await save_timezone(user_id, tz_name)
+        state.done()
+        await update.message.reply_text(get_translation(language, 'timezone_updated', timezone=tz_name))
         return
     
-    # Check for fallback time input
-    setting_fallback_key = None
-    for key in context.user_data:
-        if key.startswith('setting_fallback_time_'):
-            setting_fallback_key = key
-            break
-            
-    if setting_fallback_key:
-        # Similar validation for fallback time
-        try:
-            time_parts = text.split(':')
-            if len(time_parts) != 2:
-                raise ValueError
-            
-            hour = int(time_parts[0])
-            minute = int(time_parts[1])
-            
-            if not (0 <= hour <= 23 and 0 <= minute <= 59):
-                raise ValueError
-            
-            # Store the fallback time
-            habit_id = setting_fallback_key.replace('setting_fallback_time_', '')
-            context.user_data[f'fallback_time_{habit_id}'] = text
-            context.user_data[f'fallback_enabled_{habit_id}'] = True
-            context.user_data.pop(setting_fallback_key)
-            
-            # Back to reminder setup
-            keyboard = [[InlineKeyboardButton("⬅ Back to Settings", callback_data=f'remind_setup_{habit_id}')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"✅ Fallback time set to {text}!\n\n"
-                f"You'll get a final reminder at {text} if you haven't logged your habit.",
-                reply_markup=reply_markup
-            )
-            
-        except ValueError:
-            await update.message.reply_text(
-                "❌ Invalid time format!\n\n"
-                "Please use 24-hour format: HH:MM"
-            )
+    # Not an exact name, offer the closest matches (the user can also type again)
+    matches = search_timezones(text)
+    if matches:
+        keyboard = [
+            [InlineKeyboardButton(f"{zone} ({local_now(zone):%H:%M})", callback_data=callbacks.encode('tz_pick', zone))]
+            for zone in matches
+        ]
+        await update.message.reply_text(
+            get_translation(language, 'timezone_suggestions'),
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
         return
     
-    # Check if setting timezone
-    if context.user_data.get('setting_timezone'):
-        try:
-            # Validate timezone
-            test_tz = pytz.timezone(text)
-            
-            # Update user profile
-            profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
-            profile_data = profile_result.data[0]['data']
-            profile_data['timezone'] = text
-            
-            supabase.table('profiles').update({
-                'data': profile_data
-            }).eq('user_id', user_id).execute()
-            
-            # Also update users table for reminders
-            supabase.table('users').update({
-                'timezone': text
-            }).eq('user_id', user_id).execute()
-            
-            context.user_data.pop('setting_timezone', None)
-            
-            await update.message.reply_text(
-                f"✅ Timezone updated to {text}!\n\n"
-                f"All your reminders will now use this timezone."
-            )
-            
-        except pytz.exceptions.UnknownTimeZoneError:
-            await update.message.reply_text(
-                "❌ Invalid timezone!\n\n"
-                "Please use a valid timezone like:\n"
-                "• Europe/London\n"
-                "• America/New_York\n"
-                "• UTC"
-            )
-        return
+    await update.message.reply_text(
+        get_translation(language, 'invalid_timezone') + "\n\n" +
+        get_translation(language, 'timezone_help')
+    )
+
+async def save_timezone(user_id, tz_name):
+    # users.timezone is the only copy, reminders read it too
+    await run_query(supabase.table('users').update({
+        'timezone': tz_name
+    }).eq('user_id', user_id))
+
+# New habit name reply
+async def habit_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state, text) -> None:
+    user_id = str(update.effective_user.id)
+    habit_name = text
+    language = await user_language(context, user_id)
     
-    # Original habit adding logic
-    if context.user_data.get('adding_habit'):
-        habit_name = text
+    try:
+        # Create the habit
+        await run_query(supabase.table('habits').insert({
+            'user_id': user_id,
+            'name': habit_name,
+            'frequency': 'daily',
+            'is_active': True
+        }))
         
-        try:
-            # Create the habit
-            supabase.table('habits').insert({
-                'user_id': user_id,
-                'name': habit_name,
-                'frequency': 'daily',
-                'is_active': True
-            }).execute()
-            
-            context.user_data['adding_habit'] = False
-            
-            await update.message.reply_text(
-                f"✅ Great! I've added '{habit_name}' to your habits.\n\n"
-                "You can mark it as complete using /complete\n"
-                "View all your habits with /habits"
-            )
-            
-        except Exception as e:
-            await update.message.reply_text("❌ Error saving habit. Please try again.")
-            print(f"Error saving habit: {e}")
+        state.done()
+        
+        await update.message.reply_text(get_translation(language, 'habit_added', habit=habit_name))
+    
+    except Exception as e:
+        await update.message.reply_text(get_translation(language, 'habit_save_error'))
+        print(f"Error saving habit: {e}")
+
+# Which reply handler runs for each conversation step
+MESSAGE_STEPS = {
+    AWAITING_TIME: time_input,
+    AWAITING_FALLBACK_TIME: fallback_time_input,
+    AWAITING_TIMEZONE: timezone_input,
+    AWAITING_HABIT_NAME: habit_name_input
+}
+
+# Handle habit text
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    state = get_state(context.user_data)
+    handler = MESSAGE_STEPS.get(state.step)
+    if handler:
+        await handler(update, context, state, update.message.text)
+
+async def completed_today(habits):
+    """Ids of the habits completed during the user's local day, in one query"""
+    tz_name = (habits[0].get('users') or {}).get('timezone')
+    _, start, end = today_bounds(tz_name)
+    result = await run_query(supabase.table('habit_logs').select("habit_id")
+                             .in_('habit_id', [habit['id'] for habit in habits])
+                             .gte('completed_at', start).lt('completed_at', end))
+    return {row['habit_id'] for row in result.data}
 
 # View habits
 async def view_habits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     try:
         # Get user's habits
-        habits_result = supabase.table('habits').select("*").eq('user_id', user_id).eq('is_active', True).execute()
+        habits_result = await run_query(
+            supabase.table('habits').select("*, users(timezone)").eq('user_id', user_id).eq('is_active', True)
+        )
         
         if not habits_result.data:
-            await update.message.reply_text(
-                "📋 You don't have any habits yet!\n\n"
-                "Use /addhabit to start tracking your first habit."
-            )
+            await update.message.reply_text(get_translation(language, 'no_habits'))
             return
         
-        message = "📋 Your Active Habits:\n\n"
+        done_today = await completed_today(habits_result.data)
+        message = get_translation(language, 'habits_title') + "\n\n"
         
         for i, habit in enumerate(habits_result.data, 1):
-            # Check if completed today
-            today = datetime.now().date()
-            completion_result = supabase.table('habit_logs').select("id").eq(
-                'habit_id', habit['id']
-            ).gte('completed_at', today.isoformat()).execute()
-            
-            completed_today = len(completion_result.data) > 0
-            status = "✅" if completed_today else "⭕"
+            status = "✅" if habit['id'] in done_today else "⭕"
             
             message += f"{i}. {status} {habit['name']}\n"
         
-        message += "\n💡 Use /complete to mark habits as done!"
+        message += "\n" + get_translation(language, 'habits_footer')
         
         await update.message.reply_text(message)
-        
+    
     except Exception as e:
-        await update.message.reply_text("❌ Error fetching habits. Please try again.")
+        await update.message.reply_text(get_translation(language, 'habits_error'))
         print(f"Error in view_habits: {e}")
 
 # Complete habit
 async def complete_habit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     try:
         # Get user's incomplete habits for today
-        habits_result = supabase.table('habits').select("*").eq('user_id', user_id).eq('is_active', True).execute()
+        habits_result = await run_query(
+            supabase.table('habits').select("*, users(timezone)").eq('user_id', user_id).eq('is_active', True)
+        )
         
         if not habits_result.data:
-            await update.message.reply_text("You don't have any habits to complete!")
+            await update.message.reply_text(get_translation(language, 'nothing_to_complete'))
             return
         
         # Create inline keyboard
+        done_today = await completed_today(habits_result.data)
         keyboard = []
         for habit in habits_result.data:
-            # Check if already completed today
-            today = datetime.now().date()
-            completion_result = supabase.table('habit_logs').select("id").eq(
-                'habit_id', habit['id']
-            ).gte('completed_at', today.isoformat()).execute()
-            
-            if not completion_result.data:  # Not completed today
+            if habit['id'] not in done_today:  # Not completed today
                 keyboard.append([InlineKeyboardButton(
                     habit['name'], 
-                    callback_data=f"complete_{habit['id']}"
+                    callback_data=callbacks.encode('complete', habit['id'])
                 )])
         
         if not keyboard:
-            await update.message.reply_text("🎉 All habits completed for today! Great job!")
+            await update.message.reply_text(get_translation(language, 'all_completed'))
             return
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
-            "Which habit did you complete?",
+            get_translation(language, 'which_completed'),
             reply_markup=reply_markup
         )
-        
+    
     except Exception as e:
-        await update.message.reply_text("❌ Error loading habits. Please try again.")
+        await update.message.reply_text(get_translation(language, 'habits_load_error'))
         print(f"Error in complete_habit: {e}")
 
-# Handle callback queries
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    
-    # Handle upgrade tier selection
-    if query.data == 'upgrade_basic':
-        user_id = str(query.from_user.id)
-        try:
-            # Create Stripe checkout for basic tier
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price': STRIPE_PRICE_ID,
-                    'quantity': 1,
-                }],
-                mode='subscription',
-                success_url='https://t.me/' + (await context.bot.get_me()).username + '?start=premium_success',
-                cancel_url='https://t.me/' + (await context.bot.get_me()).username + '?start=premium_cancel',
-                metadata={
-                    'telegram_user_id': user_id,
-                    'tier': 'basic'
-                },
-                client_reference_id=user_id
-            )
-            context.user_data['pending_session_id'] = checkout_session.id
-            
-            keyboard = [[InlineKeyboardButton("💳 Pay Now", url=checkout_session.url)]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "🌟 **Basic Premium** (£0.50/month)\n\n"
-                "Click below to complete your purchase:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            await query.edit_message_text("❌ Error creating payment link. Please try again.")
-            print(f"Error creating basic checkout: {e}")
-    
-    elif query.data == 'upgrade_coach':
-        user_id = str(query.from_user.id)
+# Inline button callbacks, each route is a separate handler
+callbacks = CallbackRouter()
+
+CHECKOUT_REUSE_MARGIN = 10 * 60  # Don't reuse checkout sessions expiring within this many seconds
+
+async def get_checkout_url(context: ContextTypes.DEFAULT_TYPE, user_id, tier, price_id):
+    """Checkout URL for a tier, reusing the user's open session until it nears expiry"""
+    sessions = context.user_data.setdefault('checkout_sessions', {})
+    cached = sessions.pop(tier, None)
+    if cached and cached['expires_at'] - CHECKOUT_REUSE_MARGIN > datetime.now().timestamp():
+        # A session that was paid or expired early can't be opened again
         try:
-            # Create Stripe checkout for coach tier
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price': STRIPE_COACH_PRICE_ID,
-                    'quantity': 1,
-                }],
-                mode='subscription',
-                success_url='https://t.me/' + (await context.bot.get_me()).username + '?start=premium_success',
-                cancel_url='https://t.me/' + (await context.bot.get_me()).username + '?start=premium_cancel',
-                metadata={
-                    'telegram_user_id': user_id,
-                    'tier': 'coach'
-                },
-                client_reference_id=user_id
-            )
-            context.user_data['pending_session_id'] = checkout_session.id
-            
-            keyboard = [[InlineKeyboardButton("💳 Pay Now", url=checkout_session.url)]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "💪 **Coach Tier** (£2.50/month)\n\n"
-                "Click below to complete your purchase:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+            existing = await run_stripe(stripe.checkout.Session.retrieve, cached['id'])
+            if existing.status == 'open':
+                sessions[tier] = cached
+                return cached['url']
         except Exception as e:
-            await query.edit_message_text("❌ Error creating payment link. Please try again.")
-            print(f"Error creating coach checkout: {e}")
-    
-    elif query.data.startswith('remind_setup_'):
-        habit_id = query.data.replace('remind_setup_', '')
-        user_id = str(query.from_user.id)
-        
-        # Get current schedule if exists
-        schedule_result = supabase.table('habit_schedules').select("*").eq('habit_id', habit_id).execute()
-        if schedule_result.data:
-            current = schedule_result.data[0]
-            days = ', '.join(current['days'])
-            time = str(current['reminder_time'])[:5]  # HH:MM format
-            fallback = f"\n🚑 Fallback: {str(current['fallback_time'])[:5]}" if current['fallback_enabled'] else ""
-            
-            message = f"**Current Settings:**\n"
-            message += f"📅 Days: {days}\n"
-            message += f"🕓 Time: {time}{fallback}\n\n"
-            message += "What would you like to change?"
-        else:
-            message = "Let's set up a reminder for this habit!\n\nChoose what to configure:"
+            print(f"Error checking checkout session {cached['id']}: {e}")
+
+    # The bot username is fetched once by Application.initialize()
+    bot_url = f"https://t.me/{context.bot.username}"
+    checkout_session = await run_stripe(
+        stripe.checkout.Session.create,
+        payment_method_types=['card'],
+        line_items=[{
+            'price': price_id,
+            'quantity': 1,
+        }],
+        mode='subscription',
+        success_url=bot_url + '?start=premium_success',
+        cancel_url=bot_url + '?start=premium_cancel',
+        metadata={
+            'telegram_user_id': user_id,
+            'tier': tier
+        },
+        # Lets subscription update/cancel webhooks find the user
+        subscription_data={
+            'metadata': {
+                'telegram_user_id': user_id,
+                'tier': tier
+            }
+        },
+        client_reference_id=user_id
+    )
+    sessions[tier] = {
+        'id': checkout_session.id,
+        'url': checkout_session.url,
+        'expires_at': checkout_session.expires_at
+    }
+    return checkout_session.url
+
+@callbacks.route('upgrade_basic', 'ub', legacy='upgrade_basic')
+async def upgrade_basic_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create a Stripe checkout for the Basic tier"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    language = await user_language(context, user_id)
+    try:
+        checkout_url = await get_checkout_url(context, user_id, 'basic', STRIPE_PRICE_ID)
         
-        keyboard = [
-            [InlineKeyboardButton("📅 Choose Days", callback_data=f'days_{habit_id}')],
-            [InlineKeyboardButton("⏰ Set Time", callback_data=f'time_{habit_id}')],
-            [InlineKeyboardButton("🚑 Fallback Reminder", callback_data=f'fallback_{habit_id}')],
-            [InlineKeyboardButton("💾 Save Settings", callback_data=f'save_reminder_{habit_id}')]
-        ]
+        keyboard = [[InlineKeyboardButton(get_translation(language, 'btn_pay_now'), url=checkout_url)]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(
-            message,
+            get_translation(language, 'checkout_basic'),
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
-    
-    elif query.data.startswith('days_'):
-        habit_id = query.data.replace('days_', '')
-        
-        # Get current days or defaults
-        schedule_key = f'schedule_{habit_id}'
-        
-        # Check if we already have days in context
-        if schedule_key not in context.user_data:
-            # If not, check database
-            schedule_result = supabase.table('habit_schedules').select("days").eq('habit_id', habit_id).execute()
-            
-            if schedule_result.data:
-                selected_days = schedule_result.data[0]['days']
-            else:
-                # Default to weekdays
-                selected_days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri']
-            
-            context.user_data[schedule_key] = selected_days
-        else:
-            selected_days = context.user_data[schedule_key]
-        
-        keyboard = [
-            [InlineKeyboardButton(f"{'✅' if 'Mon' in selected_days else '⬜'} Mon", callback_data=f'day_Mon_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Tue' in selected_days else '⬜'} Tue", callback_data=f'day_Tue_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Wed' in selected_days else '⬜'} Wed", callback_data=f'day_Wed_{habit_id}')],
-            [InlineKeyboardButton(f"{'✅' if 'Thu' in selected_days else '⬜'} Thu", callback_data=f'day_Thu_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Fri' in selected_days else '⬜'} Fri", callback_data=f'day_Fri_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Sat' in selected_days else '⬜'} Sat", callback_data=f'day_Sat_{habit_id}')],
-            [InlineKeyboardButton(f"{'✅' if 'Sun' in selected_days else '⬜'} Sun", callback_data=f'day_Sun_{habit_id}')],
-            [InlineKeyboardButton("✅ Done", callback_data=f'remind_setup_{habit_id}')]
-        ]
+    except Exception as e:
+        await query.edit_message_text(get_translation(language, 'checkout_error'))
+        print(f"Error creating basic checkout: {e}")
+
+@callbacks.route('upgrade_coach', 'uc', legacy='upgrade_coach')
+async def upgrade_coach_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create a Stripe checkout for the Coach tier"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    language = await user_language(context, user_id)
+    try:
+        checkout_url = await get_checkout_url(context, user_id, 'coach', STRIPE_COACH_PRICE_ID)
         
+        keyboard = [[InlineKeyboardButton(get_translation(language, 'btn_pay_now'), url=checkout_url)]]
         reply_markup = InlineKeyboardMarkup(keyboard)
+        
         await query.edit_message_text(
-            "📅 **Select Days**\n\n"
-            "When should we remind you about this habit?\n\n"
-            f"Selected: {', '.join(selected_days) or 'None'}",
+            get_translation(language, 'checkout_coach'),
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
+    except Exception as e:
+        await query.edit_message_text(get_translation(language, 'checkout_error'))
+        print(f"Error creating coach checkout: {e}")
+
+@callbacks.route('remind_setup', 'rs', legacy_prefix='remind_setup_')
+async def remind_setup_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Show the reminder settings menu for a habit"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    language = await user_language(context, user_id)
     
-    elif query.data.startswith('day_'):
-        parts = query.data.split('_')
-        day = parts[1]
-        habit_id = parts[2]
-        
-        # Toggle day selection
-        schedule_key = f'schedule_{habit_id}'
-        selected_days = context.user_data.get(schedule_key, [])
+    # Get current schedule if exists
+    schedule_result = await run_query(supabase.table('habit_schedules').select("*").eq('habit_id', habit_id))
+    if schedule_result.data:
+        current = schedule_result.data[0]
+        days = ', '.join(current['days'])
+        time = str(current['reminder_time'])[:5]  # HH:MM format
+        fallback = get_translation(language, 'reminder_current_fallback', time=str(current['fallback_time'])[:5]) if current['fallback_enabled'] else ""
+        
+        message = get_translation(language, 'reminder_current', days=days, time=time, fallback=fallback)
+    else:
+        message = get_translation(language, 'reminder_new')
+    
+    keyboard = [
+        [InlineKeyboardButton(get_translation(language, 'btn_choose_days'), callback_data=callbacks.encode('days', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_set_time'), callback_data=callbacks.encode('time', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_fallback'), callback_data=callbacks.encode('fallback', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_save_settings'), callback_data=callbacks.encode('save_reminder', habit_id))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        message,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+def build_days_keyboard(habit_id, selected_days, language):
+    """Day picker keyboard with the selected days ticked"""
+    rows = [['Mon', 'Tue', 'Wed'], ['Thu', 'Fri', 'Sat'], ['Sun']]
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{'✅' if day in selected_days else '⬜'} {day}",
+            callback_data=callbacks.encode('day', day, habit_id)
+        ) for day in row]
+        for row in rows
+    ]
+    keyboard.append([InlineKeyboardButton(get_translation(language, 'btn_done'), callback_data=callbacks.encode('remind_setup', habit_id))])
+    return InlineKeyboardMarkup(keyboard)
+
+@callbacks.route('days', 'ds', legacy_prefix='days_')
+async def days_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Show the day picker for a habit's reminder"""
+    query = update.callback_query
+    
+    # Get current days or defaults
+    draft = get_state(context.user_data).schedule_draft(habit_id)
+    
+    # Check if we already have days in the draft
+    if 'days' not in draft:
+        # If not, check database
+        schedule_result = await run_query(supabase.table('habit_schedules').select("days").eq('habit_id', habit_id))
         
-        if day in selected_days:
-            selected_days.remove(day)
+        if schedule_result.data:
+            selected_days = schedule_result.data[0]['days']
         else:
-            selected_days.append(day)
-        
-        context.user_data[schedule_key] = selected_days
-        
-        # Refresh the keyboard
-        keyboard = [
-            [InlineKeyboardButton(f"{'✅' if 'Mon' in selected_days else '⬜'} Mon", callback_data=f'day_Mon_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Tue' in selected_days else '⬜'} Tue", callback_data=f'day_Tue_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Wed' in selected_days else '⬜'} Wed", callback_data=f'day_Wed_{habit_id}')],
-            [InlineKeyboardButton(f"{'✅' if 'Thu' in selected_days else '⬜'} Thu", callback_data=f'day_Thu_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Fri' in selected_days else '⬜'} Fri", callback_data=f'day_Fri_{habit_id}'),
-             InlineKeyboardButton(f"{'✅' if 'Sat' in selected_days else '⬜'} Sat", callback_data=f'day_Sat_{habit_id}')],
-            [InlineKeyboardButton(f"{'✅' if 'Sun' in selected_days else '⬜'} Sun", callback_data=f'day_Sun_{habit_id}')],
-            [InlineKeyboardButton("✅ Done", callback_data=f'remind_setup_{habit_id}')]
-        ]
+            # Default to weekdays
+            selected_days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri']
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📅 **Select Days**\n\n"
-            "When should we remind you about this habit?\n\n"
-            f"Selected: {', '.join(selected_days) or 'None'}",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+        draft['days'] = selected_days
+    else:
+        selected_days = draft['days']
+    
+    language = await user_language(context, str(query.from_user.id))
+    reply_markup = build_days_keyboard(habit_id, selected_days, language)
+    await query.edit_message_text(
+        get_translation(language, 'select_days', days=', '.join(selected_days) or get_translation(language, 'none')),
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('day', 'dt', legacy_prefix='day_', legacy_args=2)
+async def day_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, day, habit_id) -> None:
+    """Toggle one day in the reminder day picker"""
+    query = update.callback_query
+    
+    # Toggle day selection
+    draft = get_state(context.user_data).schedule_draft(habit_id)
+    selected_days = draft.get('days', [])
+    
+    if day in selected_days:
+        selected_days.remove(day)
+    else:
+        selected_days.append(day)
+    
+    draft['days'] = selected_days
+    
+    # Refresh the keyboard
+    language = await user_language(context, str(query.from_user.id))
+    reply_markup = build_days_keyboard(habit_id, selected_days, language)
+    await query.edit_message_text(
+        get_translation(language, 'select_days', days=', '.join(selected_days) or get_translation(language, 'none')),
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('time', 'tm', legacy_prefix='time_')
+async def time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Show the reminder time grid"""
+    query = update.callback_query
+    language = await user_language(context, str(query.from_user.id))
+    
+    # Show time selection grid
+    keyboard = [
+        [InlineKeyboardButton("🌅 6:00", callback_data=callbacks.encode('settime', '06:00', habit_id)),
+         InlineKeyboardButton("☀️ 7:00", callback_data=callbacks.encode('settime', '07:00', habit_id)),
+         InlineKeyboardButton("🍳 8:00", callback_data=callbacks.encode('settime', '08:00', habit_id))],
+        [InlineKeyboardButton("💼 9:00", callback_data=callbacks.encode('settime', '09:00', habit_id)),
+         InlineKeyboardButton("☕ 10:00", callback_data=callbacks.encode('settime', '10:00', habit_id)),
+         InlineKeyboardButton("🌞 12:00", callback_data=callbacks.encode('settime', '12:00', habit_id))],
+        [InlineKeyboardButton("🍕 14:00", callback_data=callbacks.encode('settime', '14:00', habit_id)),
+         InlineKeyboardButton("🎉 17:00", callback_data=callbacks.encode('settime', '17:00', habit_id)),
+         InlineKeyboardButton("🌃 19:00", callback_data=callbacks.encode('settime', '19:00', habit_id))],
+        [InlineKeyboardButton("🌙 20:00", callback_data=callbacks.encode('settime', '20:00', habit_id)),
+         InlineKeyboardButton("🌜 21:00", callback_data=callbacks.encode('settime', '21:00', habit_id)),
+         InlineKeyboardButton("😴 22:00", callback_data=callbacks.encode('settime', '22:00', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_custom_time'), callback_data=callbacks.encode('customtime', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_back'), callback_data=callbacks.encode('remind_setup', habit_id))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # Get current time if set
+    current_time = get_state(context.user_data).schedule_draft(habit_id).get('time') or get_translation(language, 'not_set')
+    
+    await query.edit_message_text(
+        get_translation(language, 'set_time', time=current_time),
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('settime', 'st', legacy_prefix='settime_', legacy_args=2)
+async def settime_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, time_str, habit_id) -> None:
+    """Pick a reminder time from the grid"""
+    query = update.callback_query
+    language = await user_language(context, str(query.from_user.id))
+    
+    # Save the selected time
+    draft = get_state(context.user_data).schedule_draft(habit_id)
+    draft['time'] = time_str
+    
+    # Go back to reminder setup
+    try:
+        await query.edit_message_text(get_translation(language, 'time_picked', time=time_str))
+    except Exception as e:
+        # If message hasn't changed, answer the callback to remove loading state
+        await query.answer()
+    
+    # Show the reminder setup menu
+    # Get habit info
+    habit_result = await run_query(supabase.table('habits').select("name").eq('id', habit_id))
+    habit_name = habit_result.data[0]['name'] if habit_result.data else get_translation(language, 'habit')
+    
+    # Get current settings
+    not_set = get_translation(language, 'not_set')
+    days = draft.get('days', [])
+    time = draft.get('time') or not_set
+    
+    keyboard = [
+        [InlineKeyboardButton(get_translation(language, 'btn_choose_days'), callback_data=callbacks.encode('days', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_set_time'), callback_data=callbacks.encode('time', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_fallback'), callback_data=callbacks.encode('fallback', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_save_settings'), callback_data=callbacks.encode('save_reminder', habit_id))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.message.reply_text(
+        get_translation(language, 'reminder_settings', habit=habit_name, days=', '.join(days) if days else not_set, time=time),
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('customtime', 'ct', legacy_prefix='customtime_')
+async def customtime_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Ask the user to type a custom reminder time"""
+    query = update.callback_query
+    get_state(context.user_data).expect(AWAITING_TIME, habit_id)
+    language = await user_language(context, str(query.from_user.id))
+    
+    await query.edit_message_text(
+        get_translation(language, 'custom_time'),
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('fallback', 'fb', legacy_prefix='fallback_')
+async def fallback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Show the fallback reminder options"""
+    query = update.callback_query
+    language = await user_language(context, str(query.from_user.id))
+    keyboard = [
+        [InlineKeyboardButton(get_translation(language, 'btn_enable_fallback'), callback_data=callbacks.encode('enable_fallback', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_disable_fallback'), callback_data=callbacks.encode('disable_fallback', habit_id))],
+        [InlineKeyboardButton(get_translation(language, 'btn_back'), callback_data=callbacks.encode('remind_setup', habit_id))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        get_translation(language, 'fallback_info'),
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('save_reminder', 'sr', legacy_prefix='save_reminder_')
+async def save_reminder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Save the pending reminder settings"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    language = await user_language(context, user_id)
     
-    elif query.data.startswith('time_'):
-        habit_id = query.data.replace('time_', '')
-        
-        # Show time selection grid
-        keyboard = [
-            [InlineKeyboardButton("🌅 6:00", callback_data=f'settime_06:00_{habit_id}'),
-             InlineKeyboardButton("☀️ 7:00", callback_data=f'settime_07:00_{habit_id}'),
-             InlineKeyboardButton("🍳 8:00", callback_data=f'settime_08:00_{habit_id}')],
-            [InlineKeyboardButton("💼 9:00", callback_data=f'settime_09:00_{habit_id}'),
-             InlineKeyboardButton("☕ 10:00", callback_data=f'settime_10:00_{habit_id}'),
-             InlineKeyboardButton("🌞 12:00", callback_data=f'settime_12:00_{habit_id}')],
-            [InlineKeyboardButton("🍕 14:00", callback_data=f'settime_14:00_{habit_id}'),
-             InlineKeyboardButton("🎉 17:00", callback_data=f'settime_17:00_{habit_id}'),
-             InlineKeyboardButton("🌃 19:00", callback_data=f'settime_19:00_{habit_id}')],
-            [InlineKeyboardButton("🌙 20:00", callback_data=f'settime_20:00_{habit_id}'),
-             InlineKeyboardButton("🌜 21:00", callback_data=f'settime_21:00_{habit_id}'),
-             InlineKeyboardButton("😴 22:00", callback_data=f'settime_22:00_{habit_id}')],
-            [InlineKeyboardButton("🕒 Custom Time", callback_data=f'customtime_{habit_id}')],
-            [InlineKeyboardButton("⬅ Back", callback_data=f'remind_setup_{habit_id}')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Get current time if set
-        current_time = context.user_data.get(f'time_{habit_id}', 'Not set')
-        
-        await query.edit_message_text(
-            "⏰ **Set Reminder Time**\n\n"
-            f"Current time: {current_time}\n\n"
-            "Choose when you want to be reminded:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+    # Get all settings from the draft
+    state = get_state(context.user_data)
+    draft = state.schedule_draft(habit_id)
+    days = draft.get('days', ['Mon', 'Tue', 'Wed', 'Thu', 'Fri'])
+    reminder_time = draft.get('time', '20:00')
+    fallback_enabled = draft.get('fallback_enabled', False)
+    fallback_time = draft.get('fallback_time', '23:00')
     
-    elif query.data.startswith('settime_'):
-        parts = query.data.split('_')
-        time_str = parts[1]
-        habit_id = parts[2]
-        
-        # Save the selected time
-        context.user_data[f'time_{habit_id}'] = time_str
-        
-        # Go back to reminder setup
-        try:
-            await query.edit_message_text(
-                f"✅ Reminder time set to {time_str}!\n\n"
-                "Going back to settings..."
-            )
-        except Exception as e:
-            # If message hasn't changed, answer the callback to remove loading state
-            await query.answer()
-        
-        # Show the reminder setup menu
-        await asyncio.sleep(1)  # Brief pause for better UX
-        
-        # Get habit info
-        habit_result = supabase.table('habits').select("name").eq('id', habit_id).execute()
-        habit_name = habit_result.data[0]['name'] if habit_result.data else "Habit"
-        
-        # Get current settings
-        days = context.user_data.get(f'schedule_{habit_id}', [])
-        time = context.user_data.get(f'time_{habit_id}', 'Not set')
+    try:
+        # Check if schedule exists
+        existing = await run_query(supabase.table('habit_schedules').select("id").eq('habit_id', habit_id))
+        
+        schedule_data = {
+            'user_id': user_id,
+            'habit_id': habit_id,
+            'days': days,
+            'reminder_time': reminder_time,
+            'fallback_enabled': fallback_enabled,
+            'fallback_time': fallback_time if fallback_enabled else None
+        }
+        
+        if existing.data:
+            # Update existing
+            await run_query(supabase.table('habit_schedules').update(schedule_data).eq('habit_id', habit_id))
+        else:
+            # Create new
+            await run_query(supabase.table('habit_schedules').insert(schedule_data))
         
-        keyboard = [
-            [InlineKeyboardButton("📅 Choose Days", callback_data=f'days_{habit_id}')],
-            [InlineKeyboardButton("⏰ Set Time", callback_data=f'time_{habit_id}')],
-            [InlineKeyboardButton("😑 Fallback Reminder", callback_data=f'fallback_{habit_id}')],
-            [InlineKeyboardButton("🔔 Toggle On/Off", callback_data=f'toggle_{habit_id}')],
-            [InlineKeyboardButton("💾 Save Settings", callback_data=f'save_reminder_{habit_id}')],
-            [InlineKeyboardButton("⬅ Back", callback_data=f'view_habit_{habit_id}')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Get habit name
+        habit_result = await run_query(supabase.table('habits').select("name").eq('id', habit_id))
+        habit_name = habit_result.data[0]['name'] if habit_result.data else get_translation(language, 'your_habit')
         
-        await query.message.reply_text(
-            f"🔔 **Reminder Settings**\n\n"
-            f"Habit: {habit_name}\n\n"
-            f"📅 Days: {', '.join(days) if days else 'Not set'}\n"
-            f"⏰ Time: {time}\n\n"
-            "Choose an option:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-    
-    elif query.data.startswith('customtime_'):
-        habit_id = query.data.replace('customtime_', '')
-        context.user_data[f'setting_time_{habit_id}'] = True
+        fallback_msg = get_translation(language, 'reminder_saved_fallback', time=fallback_time) if fallback_enabled else ""
         
         await query.edit_message_text(
-            "⏰ **Custom Time**\n\n"
-            "Please send the time in 24-hour format (HH:MM).\n\n"
-            "Examples:\n"
-            "• `09:30` for 9:30 AM\n"
-            "• `15:45` for 3:45 PM\n"
-            "• `23:15` for 11:15 PM",
+            get_translation(language, 'reminder_saved', habit=habit_name, days=', '.join(days), time=reminder_time, fallback=fallback_msg),
             parse_mode='Markdown'
         )
         
-    elif query.data.startswith('fallback_'):
-        habit_id = query.data.replace('fallback_', '')
-        
-        keyboard = [
-            [InlineKeyboardButton("✅ Enable Fallback", callback_data=f'enable_fallback_{habit_id}')],
-            [InlineKeyboardButton("❌ Disable Fallback", callback_data=f'disable_fallback_{habit_id}')],
-            [InlineKeyboardButton("⬅ Back", callback_data=f'remind_setup_{habit_id}')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "🚑 **Fallback Reminder**\n\n"
-            "Get a final reminder if you haven't logged your habit by a certain time.\n\n"
-            "Example: If you forget to log by 11 PM, get a \"Don't lose your streak!\" alert.",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+        # Clean up the draft
+        state.discard_draft()
     
-    elif query.data.startswith('save_reminder_'):
-        habit_id = query.data.replace('save_reminder_', '')
-        user_id = str(query.from_user.id)
-        
-        # Get all settings from context
-        days = context.user_data.get(f'schedule_{habit_id}', ['Mon', 'Tue', 'Wed', 'Thu', 'Fri'])
-        reminder_time = context.user_data.get(f'time_{habit_id}', '20:00')
-        fallback_enabled = context.user_data.get(f'fallback_enabled_{habit_id}', False)
-        fallback_time = context.user_data.get(f'fallback_time_{habit_id}', '23:00')
-        
-        try:
-            # Check if schedule exists
-            existing = supabase.table('habit_schedules').select("id").eq('habit_id', habit_id).execute()
-            
-            schedule_data = {
-                'user_id': user_id,
-                'habit_id': habit_id,
-                'days': days,
-                'reminder_time': reminder_time,
-                'fallback_enabled': fallback_enabled,
-                'fallback_time': fallback_time if fallback_enabled else None
-            }
-            
-            if existing.data:
-                # Update existing
-                supabase.table('habit_schedules').update(schedule_data).eq('habit_id', habit_id).execute()
-            else:
-                # Create new
-                supabase.table('habit_schedules').insert(schedule_data).execute()
-            
-            # Get habit name
-            habit_result = supabase.table('habits').select("name").eq('id', habit_id).execute()
-            habit_name = habit_result.data[0]['name'] if habit_result.data else "your habit"
-            
-            fallback_msg = f"\n🚑 Fallback reminder at {fallback_time}" if fallback_enabled else ""
-            
-            await query.edit_message_text(
-                f"✅ **Reminder Set!**\n\n"
-                f"Habit: {habit_name}\n"
-                f"📅 Days: {', '.join(days)}\n"
-                f"🕓 Time: {reminder_time}{fallback_msg}\n\n"
-                f"You'll be reminded at {reminder_time} on {', '.join(days)}.",
-                parse_mode='Markdown'
-            )
-            
-            # Clean up context
-            for key in list(context.user_data.keys()):
-                if habit_id in key:
-                    context.user_data.pop(key, None)
-                    
-        except Exception as e:
-            await query.edit_message_text("❌ Error saving reminder settings. Please try again.")
-            print(f"Error saving reminder: {e}")
+    except Exception as e:
+        await query.edit_message_text(get_translation(language, 'reminder_save_error'))
+        print(f"Error saving reminder: {e}")
+
+@callbacks.route('save_schedule', 'ss', legacy_prefix='save_schedule_')
+async def save_schedule_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Save the selected days as the habit schedule"""
+    query = update.callback_query
+    state = get_state(context.user_data)
+    selected_days = state.schedule_draft(habit_id).get('days', [])
+    language = await user_language(context, str(query.from_user.id))
+    
+    if not selected_days:
+        await query.edit_message_text(get_translation(language, 'select_day_required'))
+        return
     
-    elif query.data.startswith('save_schedule_'):
-        habit_id = query.data.replace('save_schedule_', '')
-        schedule_key = f'schedule_{habit_id}'
-        selected_days = context.user_data.get(schedule_key, [])
+    try:
+        # Update habit schedule
+        await run_query(supabase.table('habits').update({
+            'schedule_days': selected_days
+        }).eq('id', habit_id))
         
-        if not selected_days:
-            await query.edit_message_text("❌ Please select at least one day!")
-            return
+        await query.edit_message_text(get_translation(language, 'schedule_updated', days=', '.join(selected_days)))
         
-        try:
-            # Update habit schedule
-            supabase.table('habits').update({
-                'schedule_days': selected_days
-            }).eq('id', habit_id).execute()
-            
-            await query.edit_message_text(
-                f"✅ Schedule updated!\n\n"
-                f"This habit is now scheduled for: {', '.join(selected_days)}"
-            )
-            
-            # Clean up context
-            context.user_data.pop(schedule_key, None)
-            
-        except Exception as e:
-            await query.edit_message_text("❌ Error updating schedule. Please try again.")
-            print(f"Error saving schedule: {e}")
+        # Clean up the draft
+        state.discard_draft()
     
-    elif query.data.startswith('enable_fallback_'):
-        habit_id = query.data.replace('enable_fallback_', '')
-        context.user_data[f'setting_fallback_time_{habit_id}'] = True
-        
-        await query.edit_message_text(
-            "🚑 **Set Fallback Time**\n\n"
-            "When should we send the final reminder?\n\n"
-            "Please send the time in 24-hour format (HH:MM).\n\n"
-            "Recommended: 23:00 (11 PM)",
-            parse_mode='Markdown'
-        )
+    except Exception as e:
+        await query.edit_message_text(get_translation(language, 'schedule_error'))
+        print(f"Error saving schedule: {e}")
+
+@callbacks.route('enable_fallback', 'fe', legacy_prefix='enable_fallback_')
+async def enable_fallback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Ask the user for a fallback reminder time"""
+    query = update.callback_query
+    get_state(context.user_data).expect(AWAITING_FALLBACK_TIME, habit_id)
+    language = await user_language(context, str(query.from_user.id))
     
-    elif query.data.startswith('disable_fallback_'):
-        habit_id = query.data.replace('disable_fallback_', '')
-        context.user_data[f'fallback_enabled_{habit_id}'] = False
-        context.user_data.pop(f'fallback_time_{habit_id}', None)
-        
-        keyboard = [[InlineKeyboardButton("⬅ Back to Settings", callback_data=f'remind_setup_{habit_id}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "✅ Fallback reminder disabled.",
-            reply_markup=reply_markup
-        )
+    await query.edit_message_text(
+        get_translation(language, 'fallback_prompt'),
+        parse_mode='Markdown'
+    )
+
+@callbacks.route('disable_fallback', 'fd', legacy_prefix='disable_fallback_')
+async def disable_fallback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Turn off the fallback reminder"""
+    query = update.callback_query
+    draft = get_state(context.user_data).schedule_draft(habit_id)
+    draft['fallback_enabled'] = False
+    draft.pop('fallback_time', None)
+    language = await user_language(context, str(query.from_user.id))
     
-    elif query.data == 'settings_language_more':
-        keyboard = [
-            [InlineKeyboardButton("🇸🇦 العربية", callback_data='set_lang_ar'),
-             InlineKeyboardButton("🇮🇳 हिन्दी", callback_data='set_lang_hi')],
-            [InlineKeyboardButton("🇹🇷 Türkçe", callback_data='set_lang_tr'),
-             InlineKeyboardButton("🇳🇱 Nederlands", callback_data='set_lang_nl')],
-            [InlineKeyboardButton("🇵🇱 Polski", callback_data='set_lang_pl'),
-             InlineKeyboardButton("🇸🇪 Svenska", callback_data='set_lang_sv')],
-            [InlineKeyboardButton("🇺🇦 Українська", callback_data='set_lang_uk'),
-             InlineKeyboardButton("🇨🇿 Čeština", callback_data='set_lang_cs')],
-            [InlineKeyboardButton("🇩🇰 Dansk", callback_data='set_lang_da'),
-             InlineKeyboardButton("🇫🇮 Suomi", callback_data='set_lang_fi')],
-            [InlineKeyboardButton("🇭🇺 Magyar", callback_data='set_lang_hu'),
-             InlineKeyboardButton("🇷🇴 Română", callback_data='set_lang_ro')],
-            [InlineKeyboardButton("🇧🇬 Български", callback_data='set_lang_bg')],
-            [InlineKeyboardButton("⬅ Back", callback_data='settings_language')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "🌐 Select your language:",
-            reply_markup=reply_markup
-        )
+    keyboard = [[InlineKeyboardButton(get_translation(language, 'btn_back_to_settings'), callback_data=callbacks.encode('remind_setup', habit_id))]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
     
-    elif query.data == 'settings_language':
-        # Create a multi-page language selection
-        keyboard = [
-            [InlineKeyboardButton("🇬🇧 English", callback_data='set_lang_en'),
-             InlineKeyboardButton("🇪🇸 Español", callback_data='set_lang_es')],
-            [InlineKeyboardButton("🇫🇷 Français", callback_data='set_lang_fr'),
-             InlineKeyboardButton("🇩🇪 Deutsch", callback_data='set_lang_de')],
-            [InlineKeyboardButton("🇮🇹 Italiano", callback_data='set_lang_it'),
-             InlineKeyboardButton("🇵🇹 Português", callback_data='set_lang_pt')],
-            [InlineKeyboardButton("🇷🇺 Русский", callback_data='set_lang_ru'),
-             InlineKeyboardButton("🇨🇳 中文", callback_data='set_lang_zh')],
-            [InlineKeyboardButton("🇯🇵 日本語", callback_data='set_lang_ja'),
-             InlineKeyboardButton("🇰🇷 한국어", callback_data='set_lang_ko')],
-            [InlineKeyboardButton("➡ More Languages", callback_data='settings_language_more')],
-            [InlineKeyboardButton("⬅ Back", callback_data='settings_back')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "🌐 Select your language / Seleccione su idioma / Choisissez votre langue:",
-            reply_markup=reply_markup
-        )
+    await query.edit_message_text(
+        get_translation(language, 'fallback_disabled'),
+        reply_markup=reply_markup
+    )
+
+# Screens that depend only on tier and language, built once and shared (Telegram objects are immutable)
+VIEW_CACHE_SIZE = 1024  # Room for every (view, tier, language) plus the settings menu per timezone
+
+# Language picker pages, as (flag and native name, code) rows
+LANGUAGE_PAGES = {
+    'settings_language': [
+        [('🇬🇧 English', 'en'), ('🇪🇸 Español', 'es')],
+        [('🇫🇷 Français', 'fr'), ('🇩🇪 Deutsch', 'de')],
+        [('🇮🇹 Italiano', 'it'), ('🇵🇹 Português', 'pt')],
+        [('🇷🇺 Русский', 'ru'), ('🇨🇳 中文', 'zh')],
+        [('🇯🇵 日本語', 'ja'), ('🇰🇷 한국어', 'ko')]
+    ],
+    'settings_language_more': [
+        [('🇸🇦 العربية', 'ar'), ('🇮🇳 हिन्दी', 'hi')],
+        [('🇹🇷 Türkçe', 'tr'), ('🇳🇱 Nederlands', 'nl')],
+        [('🇵🇱 Polski', 'pl'), ('🇸🇪 Svenska', 'sv')],
+        [('🇺🇦 Українська', 'uk'), ('🇨🇿 Čeština', 'cs')],
+        [('🇩🇰 Dansk', 'da'), ('🇫🇮 Suomi', 'fi')],
+        [('🇭🇺 Magyar', 'hu'), ('🇷🇴 Română', 'ro')],
+        [('🇧🇬 Български', 'bg')]
+    ]
+}
+
+def commands_view(tier, language):
+    """/commands for a tier"""
+    message = get_translation(language, 'commands_main')
+    if tier == 'coach':
+        message += get_translation(language, 'commands_coach')
+    elif tier == 'basic':
+        message += get_translation(language, 'commands_basic')
+    message += get_translation(language, 'commands_other')
+    if tier == 'free':
+        message += get_translation(language, 'commands_free_footer', limit=FREE_HABIT_LIMIT)
+    elif tier == 'basic':
+        message += get_translation(language, 'commands_basic_footer')
+    else:
+        message += get_translation(language, 'commands_coach_footer')
+    return message, None
+
+def commands_short_view(tier, language):
+    """/commands when the tier couldn't be read"""
+    return get_translation(language, 'commands_short'), None
+
+def upgrade_view(tier, language):
+    """Plan comparison with a button per tier"""
+    keyboard = [
+        [InlineKeyboardButton(get_translation(language, 'btn_plan_basic'), callback_data=callbacks.encode('upgrade_basic'))],
+        [InlineKeyboardButton(get_translation(language, 'btn_plan_coach'), callback_data=callbacks.encode('upgrade_coach'))]
+    ]
+    return get_translation(language, 'plans'), InlineKeyboardMarkup(keyboard)
+
+def language_page_rows(page):
+    return [
+        [InlineKeyboardButton(name, callback_data=callbacks.encode('set_lang', code)) for name, code in row]
+        for row in LANGUAGE_PAGES[page]
+    ]
+
+def language_picker_view(tier, language):
+    """First page of the language picker"""
+    keyboard = language_page_rows('settings_language')
+    keyboard.append([InlineKeyboardButton(get_translation(language, 'btn_more_languages'), callback_data=callbacks.encode('settings_language_more'))])
+    keyboard.append([InlineKeyboardButton(get_translation(language, 'btn_back'), callback_data=callbacks.encode('settings_back'))])
+    return get_translation(language, 'choose_language'), InlineKeyboardMarkup(keyboard)
+
+def language_picker_more_view(tier, language):
+    """Second page of the language picker"""
+    keyboard = language_page_rows('settings_language_more')
+    keyboard.append([InlineKeyboardButton(get_translation(language, 'btn_back'), callback_data=callbacks.encode('settings_language'))])
+    return get_translation(language, 'choose_language'), InlineKeyboardMarkup(keyboard)
+
+def settings_view(tier, language, timezone):
+    """Settings menu, shared by /settings and the Back button"""
+    keyboard = [
+        [InlineKeyboardButton(get_translation(language, 'btn_change_language'), callback_data=callbacks.encode('settings_language'))],
+        [InlineKeyboardButton(get_translation(language, 'btn_change_timezone'), callback_data=callbacks.encode('settings_timezone'))]
+    ]
+    message = get_translation(language, 'settings') + "\n\n"
+    message += f"🌐 {get_translation(language, 'language')}: {LANGUAGE_NAMES.get(language, language)}\n"
+    message += f"🕒 {get_translation(language, 'timezone')}: {timezone}\n\n"
+    message += get_translation(language, 'settings_choose')
+    return message, InlineKeyboardMarkup(keyboard)
+
+VIEWS = {
+    'commands': commands_view,
+    'commands_short': commands_short_view,
+    'upgrade': upgrade_view,
+    'settings_language': language_picker_view,
+    'settings_language_more': language_picker_more_view,
+    'settings': settings_view
+}
+
+@lru_cache(maxsize=VIEW_CACHE_SIZE)
+def render_view(view, tier, language, *args):
+    """(text, reply_markup) for a view, built on first use; tier is None for views that don't depend on it"""
+    return VIEWS[view](tier, language, *args)
+
+@callbacks.route('settings_language_more', 'lm', legacy='settings_language_more')
+async def settings_language_more_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Second page of the language picker"""
+    query = update.callback_query
+    language = await user_language(context, str(query.from_user.id))
+    message, reply_markup = render_view('settings_language_more', None, language)
+    await query.edit_message_text(message, reply_markup=reply_markup)
+
+@callbacks.route('settings_language', 'lg', legacy='settings_language')
+async def settings_language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """First page of the language picker"""
+    query = update.callback_query
+    language = await user_language(context, str(query.from_user.id))
+    message, reply_markup = render_view('settings_language', None, language)
+    await query.edit_message_text(message, reply_markup=reply_markup)
+
+@callbacks.route('set_lang', 'sl', legacy_prefix='set_lang_')
+async def set_lang_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, lang) -> None:
+    """Save the chosen language"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    
+    if lang not in LANGUAGE_NAMES:
+        lang = DEFAULT_LANGUAGE
+    try:
+        # Update language in profile
+        await run_query(supabase.table('profiles').update({
+            'language': lang
+        }).eq('user_id', user_id))
+        context.user_data['language'] = lang
+        
+        # Confirm in the new language
+        await query.edit_message_text(get_translation(lang, 'language_changed', language=LANGUAGE_NAMES[lang]))
+    
+    except Exception as e:
+        await query.edit_message_text(get_translation(context.user_data.get('language'), 'language_error'))
+        print(f"Error setting language: {e}")
+
+@callbacks.route('settings_timezone', 'tz', legacy='settings_timezone')
+async def settings_timezone_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ask the user for their timezone"""
+    query = update.callback_query
+    language = await user_language(context, str(query.from_user.id))
+    await query.edit_message_text(
+        get_translation(language, 'timezone_prompt'),
+        parse_mode='Markdown'
+    )
+    get_state(context.user_data).expect(AWAITING_TIMEZONE)
+
+@callbacks.route('tz_pick', 'tp')
+async def tz_pick_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, tz_name) -> None:
+    """Save a timezone picked from the search results"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    language = await user_language(context, user_id)
+    
+    if tz_name not in pytz.all_timezones_set:
+        await query.edit_message_text(get_translation(language, 'invalid_timezone'))
+        return
+    try:
+        await save_timezone(user_id, tz_name)
+        get_state(context.user_data).done()
+        await query.edit_message_text(get_translation(language, 'timezone_updated', timezone=tz_name))
+    except Exception as e:
+        print(f"Error in tz_pick: {e}")
+        await query.edit_message_text(get_translation(language, 'timezone_error'))
+
+@callbacks.route('settings_back', 'sb', legacy='settings_back')
+async def settings_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Go back to the main settings menu"""
+    query = update.callback_query
     
-    elif query.data.startswith('set_lang_'):
-        lang = query.data.replace('set_lang_', '')
-        user_id = str(query.from_user.id)
+    # Go back to main settings
+    user_id = str(query.from_user.id)
+    try:
+        # Retrieve user profile
+        profile_result = await run_query(supabase.table('profiles').select("language, users(timezone)").eq('user_id', user_id))
+        if not profile_result.data:
+            await query.edit_message_text(get_translation(context.user_data.get('language'), 'profile_not_found'))
+            return
         
-        try:
-            # Update language in profile
-            profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
-            profile_data = profile_result.data[0]['data']
-            profile_data['language'] = lang
-            
-            supabase.table('profiles').update({
-                'data': profile_data
-            }).eq('user_id', user_id).execute()
-            
-            lang_names = {
-                'en': 'English', 'es': 'Español', 'fr': 'Français', 'de': 'Deutsch',
-                'it': 'Italiano', 'pt': 'Português', 'ru': 'Русский', 'zh': '中文',
-                'ja': '日本語', 'ko': '한국어', 'ar': 'العربية', 'hi': 'हिन्दी',
-                'tr': 'Türkçe', 'nl': 'Nederlands', 'pl': 'Polski', 'sv': 'Svenska',
-                'uk': 'Українська', 'cs': 'Čeština', 'da': 'Dansk', 'fi': 'Suomi',
-                'hu': 'Magyar', 'ro': 'Română', 'bg': 'Български'
-            }
-            await query.edit_message_text(f"✅ Language changed to {lang_names.get(lang, lang)}!")
-            
-        except Exception as e:
-            await query.edit_message_text("❌ Error updating language.")
-            print(f"Error setting language: {e}")
+        profile = profile_result.data[0]
+        language = profile['language'] or DEFAULT_LANGUAGE
+        context.user_data['language'] = language
+        timezone = (profile.get('users') or {}).get('timezone') or 'UTC'
+        
+        message, reply_markup = render_view('settings', None, language, timezone)
+        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    except Exception as e:
+        print(f"Error in settings_back: {e}")
+        await query.edit_message_text(get_translation(context.user_data.get('language'), 'settings_load_error'))
+
+@callbacks.route('complete', 'cp', legacy_prefix='complete_')
+async def complete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, habit_id) -> None:
+    """Log a habit completion and award XP"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    language = await user_language(context, user_id)
     
-    elif query.data.startswith('settings_timezone'):
-        await query.edit_message_text(
-            "🕒 **Set Timezone**\n\n"
-            "Please send your timezone in format:\n"
-            "• `Europe/London`\n"
-            "• `America/New_York`\n"
-            "• `Asia/Tokyo`\n\n"
-            "Common timezones:\n"
-            "• UTC\n"
-            "• Europe/London\n"
-            "• America/New_York\n"
-            "• America/Los_Angeles\n"
-            "• Asia/Singapore",
-            parse_mode='Markdown'
-        )
-        context.user_data['setting_timezone'] = True
+    try:
+        # Log the completion
+        await run_query(supabase.table('habit_logs').insert({
+            'habit_id': habit_id,
+            'user_id': user_id,
+            'streak_count': 1  # TODO: Calculate actual streak
+        }))
+        
+        # Update user XP in one atomic statement
+        xp_result = await run_query(supabase.rpc('award_xp', {
+            'p_user_id': user_id,
+            'p_amount': XP_PER_COMPLETION,
+            'p_level_xp': LEVEL_XP_REQUIREMENT
+        }))
+        new_xp = xp_result.data[0]['xp']
+        new_level = xp_result.data[0]['level']
+        
+        # Get habit name
+        habit_result = await run_query(supabase.table('habits').select("name").eq('id', habit_id))
+        habit_name = habit_result.data[0]['name']
+        
+        await query.edit_message_text(get_translation(
+            language, 'completed', habit=habit_name, gained=XP_PER_COMPLETION, xp=new_xp, level=new_level
+        ))
     
-    elif query.data == 'settings_back':
-        # Go back to main settings
-        user_id = str(query.from_user.id)
-        try:
-            # Retrieve user profile
-            profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
-            if not profile_result.data:
-                await query.edit_message_text("❌ Profile not found. Please use /start first.")
-                return
-            
-            profile_data = profile_result.data[0]['data']
-            language = profile_data.get('language', 'en')
-            timezone = profile_data.get('timezone', 'UTC')
-            
-            # Create inline keyboard for settings
-            keyboard = [
-                [InlineKeyboardButton("🌐 Change Language", callback_data='settings_language')],
-                [InlineKeyboardButton("🕒 Change Timezone", callback_data='settings_timezone')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            message = "🔧 **Settings**\n\n"
-            message += f"🌐 Language: {language}\n"
-            message += f"🕒 Timezone: {timezone}\n\n"
-            message += "Choose what you'd like to change:"
-            
-            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-        except Exception as e:
-            print(f"Error in settings_back: {e}")
-            await query.edit_message_text("❌ Error loading settings.")
+    except Exception as e:
+        await query.edit_message_text(get_translation(language, 'completion_error'))
+        print(f"Error in handle_completion: {e}")
+
+# Handle callback queries
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
     
-    elif query.data.startswith('complete_'):
-        habit_id = query.data.replace('complete_', '')
-        user_id = str(query.from_user.id)
+    # Timed per route, so /metrics shows which buttons are slow
+    with track_handler(f"callback:{callbacks.name_for(query.data or '')}", update.update_id):
+        await query.answer()
         
-        try:
-            # Log the completion
-            supabase.table('habit_logs').insert({
-                'habit_id': habit_id,
-                'user_id': user_id,
-                'streak_count': 1  # TODO: Calculate actual streak
-            }).execute()
-            
-            # Update user XP
-            profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
-            profile_data = profile_result.data[0]['data']
-            
-            new_xp = profile_data.get('xp', 0) + XP_PER_COMPLETION
-            new_level = (new_xp // LEVEL_XP_REQUIREMENT) + 1
-            
-            profile_data['xp'] = new_xp
-            profile_data['level'] = new_level
-            
-            supabase.table('profiles').update({
-                'data': profile_data
-            }).eq('user_id', user_id).execute()
-            
-            # Get habit name
-            habit_result = supabase.table('habits').select("name").eq('id', habit_id).execute()
-            habit_name = habit_result.data[0]['name']
-            
-            await query.edit_message_text(
-                f"✅ Great job! You completed '{habit_name}'!\n\n"
-                f"🌟 +{XP_PER_COMPLETION} XP earned!\n"
-                f"📊 Total XP: {new_xp}\n"
-                f"🎯 Level: {new_level}"
-            )
-            
-        except Exception as e:
-            await query.edit_message_text("❌ Error recording completion. Please try again.")
-            print(f"Error in handle_completion: {e}")
+        # One dict lookup on the compact callback data instead of a chain of prefix checks
+        await callbacks.dispatch(update, context)
 
 # View stats
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     try:
         # Get user profile
-        profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
+        profile_result = await run_query(supabase.table('profiles').select("xp, level").eq('user_id', user_id))
         
         if not profile_result.data:
-            await update.message.reply_text("❌ Profile not found. Please use /start first.")
+            await update.message.reply_text(get_translation(language, 'profile_not_found'))
             return
         
-        profile_data = profile_result.data[0]['data']
-        xp = profile_data.get('xp', 0)
-        level = profile_data.get('level', 1)
+        xp = profile_result.data[0]['xp']
+        level = profile_result.data[0]['level']
         
         # Calculate progress to next level
         current_level_xp = (level - 1) * LEVEL_XP_REQUIREMENT
@@ -1027,54 +1063,32 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         progress = xp - current_level_xp
         needed = next_level_xp - xp
         
-        # Count total completions
-        completions_result = supabase.table('habit_logs').select("id").eq('user_id', user_id).execute()
-        total_completions = len(completions_result.data)
+        # Count total completions (archived months come from the rollups)
+        completions_result = await run_query(supabase.rpc('count_user_completions', {'p_user_id': user_id}))
+        total_completions = completions_result.data or 0
         
         # Get active habits count
-        habits_result = supabase.table('habits').select("id").eq('user_id', user_id).eq('is_active', True).execute()
+        habits_result = await run_query(supabase.table('habits').select("id").eq('user_id', user_id).eq('is_active', True))
         active_habits = len(habits_result.data)
         
-        message = f"📊 Your Statistics:\n\n"
-        message += f"🎯 Level: {level}\n"
-        message += f"⭐ Total XP: {xp}\n"
-        message += f"📈 Progress: {progress}/{LEVEL_XP_REQUIREMENT} XP\n"
-        message += f"🎮 Next level in: {needed} XP\n\n"
-        message += f"✅ Total completions: {total_completions}\n"
-        message += f"📋 Active habits: {active_habits}\n"
+        message = get_translation(
+            language, 'stats', level=level, xp=xp, progress=progress, level_xp=LEVEL_XP_REQUIREMENT,
+            needed=needed, completions=total_completions, habits=active_habits
+        )
         
         await update.message.reply_text(message)
-        
+    
     except Exception as e:
-        await update.message.reply_text("❌ Error fetching stats. Please try again.")
+        await update.message.reply_text(get_translation(language, 'stats_error'))
         print(f"Error in stats: {e}")
 
 # Upgrade to premium
 async def upgrade(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     # Show tier selection
-    keyboard = [
-        [InlineKeyboardButton("🌟 Basic (£0.50/month)", callback_data='upgrade_basic')],
-        [InlineKeyboardButton("💪 Coach (£2.50/month)", callback_data='upgrade_coach')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    message = "🚀 Choose Your Plan!\n\n"
-    message += "🌟 **Basic Premium** (£0.50/month)\n"
-    message += "• Unlimited habits\n"
-    message += "• Advanced statistics\n"
-    message += "• Priority support\n"
-    message += "• Export your data\n\n"
-    message += "💪 **Coach Tier** (£2.50/month)\n"
-    message += "• Everything in Basic, plus:\n"
-    message += "• 🤖 AI Habit Coach - Get personalized advice\n"
-    message += "• Unlimited AI coaching sessions\n"
-    message += "• Deep habit analysis\n"
-    message += "• Personalized motivation\n\n"
-    message += "❌ Cancel anytime\n\n"
-    message += "Select your preferred plan:"
-    
+    message, reply_markup = render_view('upgrade', None, language)
     await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
 
 # Manage settings
@@ -1083,141 +1097,220 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     try:
         # Retrieve user profile
-        profile_result = supabase.table('profiles').select("data").eq('user_id', user_id).execute()
+        profile_result = await run_query(supabase.table('profiles').select("language, users(timezone)").eq('user_id', user_id))
         if not profile_result.data:
-            await update.message.reply_text("❌ Profile not found. Please use /start first.")
+            await update.message.reply_text(get_translation(context.user_data.get('language'), 'profile_not_found'))
             return
         
-        profile_data = profile_result.data[0]['data']
-        language = profile_data.get('language', 'en')
-        timezone = profile_data.get('timezone', 'UTC')
-        
-        # Create inline keyboard for settings
-        keyboard = [
-            [InlineKeyboardButton("🌐 Change Language", callback_data='settings_language')],
-            [InlineKeyboardButton("🕒 Change Timezone", callback_data='settings_timezone')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message = "🔧 **Settings**\n\n"
-        message += f"🌐 Language: {language}\n"
-        message += f"🕒 Timezone: {timezone}\n\n"
-        message += "Choose what you'd like to change:"
+        profile = profile_result.data[0]
+        language = profile['language'] or DEFAULT_LANGUAGE
+        context.user_data['language'] = language
+        timezone = (profile.get('users') or {}).get('timezone') or 'UTC'
         
+        message, reply_markup = render_view('settings', None, language, timezone)
         await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
     except Exception as e:
         print(f"Error fetching settings: {e}")
-        await update.message.reply_text("❌ Error fetching settings. Please try again.")
+        await update.message.reply_text(get_translation(context.user_data.get('language'), 'settings_error'))
+
+
+# AI Coach prompts
+COACH_VALIDATION_PROMPT = (
+    "You are a filter that determines if a question is related to habits, discipline, motivation, or personal development. "
+    "Respond with only 'YES' if the question is about habits, building discipline, motivation, productivity, breaking bad habits, "
+    "forming good habits, or similar self-improvement topics. Respond with 'NO' for anything else like general knowledge, "
+    "technical questions, entertainment, or unrelated topics."
+)
+
+COACH_SYSTEM_PROMPT = (
+    "You are an expert habit coach helping users build better habits. "
+    "Be supportive, practical, and concise. Give actionable advice. "
+    "Use emojis sparingly for emphasis. Format with markdown. "
+    "Focus only on habits, discipline, motivation, and personal development."
+)
+
+_openai_client = None
 
+def get_openai_client():
+    """Shared OpenAI client so connections are reused between coach calls"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    return _openai_client
+
+async def validate_coach_question(client, question):
+    """Ask the model whether a question is on-topic for the habit coach"""
+    with track_call('openai', 'validate'):
+        validation = await asyncio.to_thread(
+            client.chat.completions.create,
+            model="gpt-4o-mini",  # Cheapest model available
+            messages=[
+                {"role": "system", "content": COACH_VALIDATION_PROMPT},
+                {"role": "user", "content": question}
+            ],
+            max_tokens=10,
+            temperature=0
+        )
+    return validation.choices[0].message.content.strip().upper() == 'YES'
+
+async def create_coach_completion(client, messages, max_retries=3):
+    """Get a coach answer, retrying rate limits and falling back to gpt-3.5-turbo"""
+    retry_delay = 1
+    completion = None
+    
+    for attempt in range(max_retries):
+        try:
+            # Try gpt-4o-mini first (cheapest and newest)
+            try:
+                with track_call('openai', 'gpt-4o-mini'):
+                    completion = await asyncio.to_thread(
+                        client.chat.completions.create,
+                        model="gpt-4o-mini",
+                        messages=messages,
+                        max_tokens=500,
+                        temperature=0.7
+                    )
+                break  # Success, exit retry loop
+            except Exception as mini_error:
+                # Fallback to GPT-3.5-turbo if mini model not available
+                print(f"gpt-4o-mini failed, falling back to gpt-3.5-turbo: {mini_error}")
+                with track_call('openai', 'gpt-3.5-turbo'):
+                    completion = await asyncio.to_thread(
+                        client.chat.completions.create,
+                        model="gpt-3.5-turbo",
+                        messages=messages,
+                        max_tokens=500,
+                        temperature=0.7
+                    )
+                break  # Success, exit retry loop
+        except openai.RateLimitError as rate_error:
+            if attempt < max_retries - 1:
+                print(f"Rate limit hit, retrying in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2  # Exponential backoff
+            else:
+                raise rate_error  # Re-raise on final attempt
+        except Exception as e:
+            print(f"OpenAI API error attempt {attempt + 1}: {e}")
+            if attempt == max_retries - 1:
+                raise e  # Re-raise on final attempt
+    
+    return completion
+
+async def release_coach_session(user_id):
+    """Give back a claimed coach session that didn't produce an answer"""
+    try:
+        await run_query(supabase.rpc('release_coach_session', {'p_user_id': user_id}))
+    except Exception as e:
+        print(f"Error releasing coach session: {e}")
+
+async def log_coach_conversation(client, user_id, question, response_text, messages, memory):
+    """Store a coach answer and update the user's rolling memory"""
+    # Calculate approximate tokens used (rough estimate)
+    tokens_used = len(question.split()) * 1.3 + len(response_text.split()) * 1.3
+    
+    # Runs after /coach has replied and its trace is closed, so it's traced on its own
+    with track_handler('/coach:log'):
+        try:
+            await run_query(supabase.table('coach_conversations').insert({
+                'user_id': user_id,
+                'question': question,
+                'response': response_text,
+                'tokens_used': int(tokens_used),
+                'prompt_tokens': prompt_tokens(messages),
+                'naive_prompt_tokens': naive_prompt_tokens(messages, memory)
+            }))
+            await record_coach_turn(supabase, client, user_id, memory, {
+                'question': question,
+                'response': response_text
+            })
+        except Exception as log_error:
+            print(f"Error logging conversation: {log_error}")
 
 # AI Habit Coach (Premium Feature)
 async def coach(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
     
+    question = ' '.join(context.args) if context.args else None
+    quota = None
+    habits_task = memory_task = None
+    language = await user_language(context, user_id)
+    
     # Check if user has coach tier
     try:
-        user_result = supabase.table('users').select("subscription_tier, coach_sessions_used, coach_sessions_reset_at").eq('user_id', user_id).execute()
-        
-        if not user_result.data:
-            await update.message.reply_text("❌ Please use /start first to set up your account.")
+        entitlement = await get_entitlement(user_id)
+        if entitlement is None:
+            await update.message.reply_text(get_translation(language, 'account_required'))
             return
-            
-        user_data = user_result.data[0]
-        subscription_tier = user_data['subscription_tier']
-        sessions_used = user_data['coach_sessions_used'] or 0
-        reset_date = user_data['coach_sessions_reset_at']
+        subscription_tier = entitlement.tier
+        
+        if subscription_tier == 'coach' and not question:
+            # Read-only, so the intro still tells users who have used up today's sessions
+            quota_result = await run_query(supabase.rpc('coach_quota', {
+                'p_user_id': user_id,
+                'p_daily_limit': DAILY_COACH_LIMIT
+            }))
+            quota = quota_result.data[0] if quota_result.data else None
+            if not quota or quota['tier'] != 'coach':
+                forget_entitlement(user_id)
+                subscription_tier = quota['tier'] if quota else 'free'
+        elif question and subscription_tier == 'coach':
+            # Start the free lookups together with the claim so latency is the slowest one, not the sum.
+            # Anything still running when we bail out early is cancelled in the finally below.
+            # The paid validation call only starts once a session is claimed, it can't be cancelled.
+            habits_task = asyncio.create_task(run_query(
+                supabase.table('habits').select("name").eq('user_id', user_id).eq('is_active', True)
+            ))
+            memory_task = asyncio.create_task(load_coach_memory(supabase, user_id))
+            
+            # Reset the daily counter if needed and claim a session in one round trip
+            quota_result = await run_query(supabase.rpc('claim_coach_session', {
+                'p_user_id': user_id,
+                'p_daily_limit': DAILY_COACH_LIMIT
+            }))
+            quota = quota_result.data[0] if quota_result.data else None
+            if not quota or quota['tier'] != 'coach':
+                # The database knows better than the cache, re-read it next time
+                forget_entitlement(user_id)
+                subscription_tier = quota['tier'] if quota else 'free'
         
         if subscription_tier != 'coach':
-            keyboard = [[InlineKeyboardButton("💪 Upgrade to Coach Tier", callback_data='upgrade_coach')]]
+            keyboard = [[InlineKeyboardButton(get_translation(language, 'btn_upgrade_coach'), callback_data=callbacks.encode('upgrade_coach'))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await update.message.reply_text(
-                "🤖 **AI Habit Coach** (Coach Tier Feature)\n\n"
-                "Get personalized coaching from our AI to help you:\n"
-                "• Understand why you're breaking streaks\n"
-                "• Build better discipline\n"
-                "• Get motivational support\n"
-                "• Personalized habit recommendations\n\n"
-                "Upgrade to Coach tier (£2.50/month) to unlock this feature!",
+                get_translation(language, 'coach_upsell'),
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
             return
         
         # Check daily limit
-        today = datetime.now().date()
-        if reset_date and str(reset_date) < str(today):
-            # Reset daily counter
-            sessions_used = 0
-            supabase.table('users').update({
-                'coach_sessions_used': 0,
-                'coach_sessions_reset_at': today.isoformat()
-            }).eq('user_id', user_id).execute()
-        
-        if sessions_used >= DAILY_COACH_LIMIT:
+        if quota and not (quota['claimed'] if question else quota['remaining']):
             await update.message.reply_text(
-                f"⏰ **Daily Limit Reached**\n\n"
-                f"You've used all {DAILY_COACH_LIMIT} coaching sessions for today.\n"
-                f"Your sessions will reset tomorrow!\n\n"
-                f"💡 Tip: Make your questions count by being specific about your habit challenges.",
+                get_translation(language, 'coach_limit', limit=DAILY_COACH_LIMIT),
                 parse_mode='Markdown'
             )
             return
         
         # For premium users - show coach interface
-        if context.args and len(context.args) > 0:
-            # User provided a question
-            question = ' '.join(context.args)
-            
+        if question:
             # Check if OpenAI API key is configured
             if not OPENAI_API_KEY:
-                await update.message.reply_text(
-                    "⚠️ AI Coach is not configured yet. Using helpful tips instead:\n\n"
-                    "Ask about breaking streaks, building discipline, or staying motivated!"
-                )
+                await release_coach_session(user_id)
+                await update.message.reply_text(get_translation(language, 'coach_not_configured'))
                 return
             
-            # First, validate if this is a habit-related question
-            validation_prompt = (
-                "You are a filter that determines if a question is related to habits, discipline, motivation, or personal development. "
-                "Respond with only 'YES' if the question is about habits, building discipline, motivation, productivity, breaking bad habits, "
-                "forming good habits, or similar self-improvement topics. Respond with 'NO' for anything else like general knowledge, "
-                "technical questions, entertainment, or unrelated topics."
-            )
-            
             try:
-                # Validate the question first
-                print(f"Initializing OpenAI client...")
-                print(f"API Key present: {bool(OPENAI_API_KEY)}")
-                print(f"API Key length: {len(OPENAI_API_KEY) if OPENAI_API_KEY else 0}")
-                
-                client = openai.OpenAI(api_key=OPENAI_API_KEY)
-                print(f"OpenAI client created successfully")
-                
-                print(f"Attempting validation call...")
-                validation = client.chat.completions.create(
-                    model="gpt-4o-mini",  # Cheapest model available
-                    messages=[
-                        {"role": "system", "content": validation_prompt},
-                        {"role": "user", "content": question}
-                    ],
-                    max_tokens=10,
-                    temperature=0
-                )
-                print(f"Validation call successful")
-                
-                is_valid = validation.choices[0].message.content.strip().upper() == 'YES'
+                # First, validate if this is a habit-related question (habits and memory keep loading meanwhile)
+                client = get_openai_client()
+                is_valid = await validate_coach_question(client, question)
                 
                 if not is_valid:
+                    # Off-topic questions don't count towards the daily limit
+                    await release_coach_session(user_id)
                     await update.message.reply_text(
-                        "🚫 **Off-Topic Question**\n\n"
-                        "I'm your habit coach, and I can only help with:\n"
-                        "• Building better habits\n"
-                        "• Breaking bad habits\n"
-                        "• Staying motivated\n"
-                        "• Understanding discipline\n"
-                        "• Overcoming procrastination\n\n"
-                        "Please ask me something related to habits or personal development!",
+                        get_translation(language, 'coach_off_topic'),
                         parse_mode='Markdown'
                     )
                     return
@@ -1226,89 +1319,38 @@ async def coach(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
                 
                 # Get user's habit data for context
-                habits_result = supabase.table('habits').select("name").eq('user_id', user_id).eq('is_active', True).execute()
+                habits_result = await habits_task
                 habit_names = [h['name'] for h in habits_result.data] if habits_result.data else []
                 
-                # Create context-aware prompt
-                system_prompt = (
-                    "You are an expert habit coach helping users build better habits. "
-                    "Be supportive, practical, and concise. Give actionable advice. "
-                    "Use emojis sparingly for emphasis. Format with markdown. "
-                    "Focus only on habits, discipline, motivation, and personal development."
-                )
-                
                 user_context = f"User's current habits: {', '.join(habit_names)}" if habit_names else "User has no habits yet"
                 
-                # Call OpenAI API with retry logic for rate limits
-                max_retries = 3
-                retry_delay = 1
-                completion = None
+                # Replay recent coaching turns plus a rolling summary of older ones
+                try:
+                    memory = await memory_task
+                except Exception as memory_error:
+                    print(f"Error loading coach memory: {memory_error}")
+                    memory = empty_memory()
+                messages = build_coach_messages(COACH_SYSTEM_PROMPT, f"{user_context}\n\nQuestion: {question}", memory)
                 
-                for attempt in range(max_retries):
-                    try:
-                        # Try gpt-4o-mini first (cheapest and newest)
-                        try:
-                            completion = client.chat.completions.create(
-                                model="gpt-4o-mini",
-                                messages=[
-                                    {"role": "system", "content": system_prompt},
-                                    {"role": "user", "content": f"{user_context}\n\nQuestion: {question}"}
-                                ],
-                                max_tokens=500,
-                                temperature=0.7
-                            )
-                            break  # Success, exit retry loop
-                        except Exception as mini_error:
-                            # Fallback to GPT-3.5-turbo if mini model not available
-                            print(f"gpt-4o-mini failed, falling back to gpt-3.5-turbo: {mini_error}")
-                            completion = client.chat.completions.create(
-                                model="gpt-3.5-turbo",
-                                messages=[
-                                    {"role": "system", "content": system_prompt},
-                                    {"role": "user", "content": f"{user_context}\n\nQuestion: {question}"}
-                                ],
-                                max_tokens=500,
-                                temperature=0.7
-                            )
-                            break  # Success, exit retry loop
-                    except openai.RateLimitError as rate_error:
-                        if attempt < max_retries - 1:
-                            print(f"Rate limit hit, retrying in {retry_delay} seconds...")
-                            await asyncio.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                        else:
-                            raise rate_error  # Re-raise on final attempt
-                    except Exception as e:
-                        print(f"OpenAI API error attempt {attempt + 1}: {e}")
-                        if attempt == max_retries - 1:
-                            raise e  # Re-raise on final attempt
+                # Call OpenAI API with retry logic for rate limits
+                completion = await create_coach_completion(client, messages)
                 
                 response_text = completion.choices[0].message.content
                 
-                # Calculate approximate tokens used (rough estimate)
-                tokens_used = len(question.split()) * 1.3 + len(response_text.split()) * 1.3
-                
-                # Log the conversation
-                try:
-                    supabase.table('coach_conversations').insert({
-                        'user_id': user_id,
-                        'question': question,
-                        'response': response_text,
-                        'tokens_used': int(tokens_used)
-                    }).execute()
-                except Exception as log_error:
-                    print(f"Error logging conversation: {log_error}")
-                
-                # Update session count
-                supabase.table('users').update({
-                    'coach_sessions_used': sessions_used + 1
-                }).eq('user_id', user_id).execute()
+                # Log the conversation without holding up the reply
+                context.application.create_task(
+                    log_coach_conversation(client, user_id, question, response_text, messages, memory)
+                )
                 
                 # Add coach prefix
-                response = f"🤖 **AI Coach says:**\n\n{response_text}\n\n"
-                response += f"_Sessions today: {sessions_used + 1}/{DAILY_COACH_LIMIT}_"
+                response = get_translation(
+                    language, 'coach_says', response=response_text, used=quota['used'], limit=DAILY_COACH_LIMIT
+                )
                 
             except Exception as e:
+                # Failed answers don't count towards the daily limit
+                await release_coach_session(user_id)
+                
                 # Check specific error types
                 error_type = type(e).__name__
                 print(f"OpenAI error type: {error_type}")
@@ -1384,86 +1426,72 @@ async def coach(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         else:
             # No question provided
             await update.message.reply_text(
-                "🤖 **AI Habit Coach**\n\n"
-                "I'm here to help you build better habits! Ask me anything:\n\n"
-                "Examples:\n"
-                "• /coach Why am I breaking my streak?\n"
-                "• /coach How can I build discipline for reading?\n"
-                "• /coach I feel unmotivated today\n\n"
-                "What would you like help with?",
+                get_translation(language, 'coach_intro'),
                 parse_mode='Markdown'
             )
-            
+    
     except Exception as e:
         print(f"Error in coach: {e}")
-        await update.message.reply_text("❌ Error accessing AI Coach. Please try again.")
+        await update.message.reply_text(get_translation(language, 'coach_error'))
+    finally:
+        cancel_tasks(habits_task, memory_task)
 
 
 # Remind command - Set up reminders
 async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     try:
         # Check if user is premium (free users get default 8pm only)
-        user_result = supabase.table('users').select("subscription_tier").eq('user_id', user_id).execute()
-        subscription_tier = user_result.data[0]['subscription_tier'] if user_result.data else 'free'
+        subscription_tier = await get_tier(user_id)
         
         if subscription_tier == 'free':
             await update.message.reply_text(
-                "🔔 **Reminder Settings** (Free Plan)\n\n"
-                "Free users get daily reminders at 8:00 PM for all habits.\n\n"
-                "✨ Upgrade to Premium to:\n"
-                "• Set custom reminder times per habit\n"
-                "• Choose specific days for each habit\n"
-                "• Enable streak-saving fallback reminders\n\n"
-                "Use /upgrade to unlock custom reminders!",
+                get_translation(language, 'remind_free'),
                 parse_mode='Markdown'
             )
             return
             
         # Get user's habits
-        habits_result = supabase.table('habits').select("*").eq('user_id', user_id).eq('is_active', True).execute()
+        habits_result = await run_query(supabase.table('habits').select("*").eq('user_id', user_id).eq('is_active', True))
         
         if not habits_result.data:
-            await update.message.reply_text("📋 You don't have any habits yet! Use /addhabit to create one.")
+            await update.message.reply_text(get_translation(language, 'no_habits_short'))
             return
         
         # Create inline keyboard with habits
         keyboard = []
         for habit in habits_result.data:
             # Check if habit has existing schedule
-            schedule_result = supabase.table('habit_schedules').select("reminder_time").eq('habit_id', habit['id']).execute()
+            schedule_result = await run_query(supabase.table('habit_schedules').select("reminder_time").eq('habit_id', habit['id']))
             has_reminder = "🔔" if schedule_result.data else ""
             
             keyboard.append([InlineKeyboardButton(
                 f"{has_reminder} {habit['name']}", 
-                callback_data=f"remind_setup_{habit['id']}"
+                callback_data=callbacks.encode('remind_setup', habit['id'])
             )])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
-            "🔔 **Set Reminders**\n\n"
-            "Which habit would you like to set a reminder for?\n\n"
-            "🔔 = Has reminder set",
+            get_translation(language, 'remind_choose'),
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
-        
+    
     except Exception as e:
-        await update.message.reply_text("❌ Error loading habits. Please try again.")
+        await update.message.reply_text(get_translation(language, 'habits_load_error'))
         print(f"Error in remind: {e}")
 
 # Pause habit (vacation mode)
 async def pause_habit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     # Check if dates provided
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
-            "📅 **Pause a Habit**\n\n"
-            "Usage: `/pause [start_date] [end_date]`\n"
-            "Example: `/pause 2024-12-25 2025-01-02`\n\n"
-            "This will pause all your habits during this period.",
+            get_translation(language, 'pause_usage'),
             parse_mode='Markdown'
         )
         return
@@ -1473,147 +1501,91 @@ async def pause_habit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         end_date = datetime.strptime(context.args[1], '%Y-%m-%d').date()
         
         if start_date > end_date:
-            await update.message.reply_text("❌ Start date must be before end date!")
+            await update.message.reply_text(get_translation(language, 'pause_order'))
             return
         
         # Check maximum 3 weeks
         duration = (end_date - start_date).days
         if duration > 21:  # 3 weeks
-            await update.message.reply_text(
-                "❌ Pause period cannot exceed 3 weeks (21 days)!\n\n"
-                "For longer breaks, consider deactivating habits instead."
-            )
+            await update.message.reply_text(get_translation(language, 'pause_too_long'))
             return
         
         # Get all user habits
-        habits_result = supabase.table('habits').select("id").eq('user_id', user_id).eq('is_active', True).execute()
+        habits_result = await run_query(supabase.table('habits').select("id").eq('user_id', user_id).eq('is_active', True))
         
         # Create pause for each habit
         for habit in habits_result.data:
-            supabase.table('habit_pauses').insert({
+            await run_query(supabase.table('habit_pauses').insert({
                 'habit_id': habit['id'],
                 'user_id': user_id,
                 'start_date': start_date.isoformat(),
                 'end_date': end_date.isoformat(),
                 'reason': 'vacation'
-            }).execute()
-        
-        await update.message.reply_text(
-            f"✅ All habits paused from {start_date} to {end_date}!\n\n"
-            "Your streaks will be preserved during this period. 🏖️"
-        )
+            }))
         
+        await update.message.reply_text(get_translation(language, 'paused', start=start_date, end=end_date))
+    
     except ValueError:
         await update.message.reply_text(
-            "❌ Invalid date format! Use YYYY-MM-DD\n"
-            "Example: `/pause 2024-12-25 2025-01-02`",
+            get_translation(language, 'pause_invalid_date'),
             parse_mode='Markdown'
         )
     except Exception as e:
-        await update.message.reply_text("❌ Error setting pause period. Please try again.")
+        await update.message.reply_text(get_translation(language, 'pause_error'))
         print(f"Error in pause_habit: {e}")
 
 # List commands
 async def list_commands(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
+    language = await user_language(context, user_id)
     
     # Check user subscription tier
     try:
-        user_result = supabase.table('users').select("subscription_tier").eq('user_id', user_id).execute()
-        subscription_tier = user_result.data[0]['subscription_tier'] if user_result.data else 'free'
-        
-        message = "📋 **Available Commands**\n\n"
-        message += "🎆 **Habit Tracking**\n"
-        message += "/addhabit - Add a new habit to track\n"
-        message += "/habits - View all your habits\n"
-        message += "/complete - Mark a habit as done\n"
-        message += "/remind - Set up habit reminders\n"
-        message += "/pause - Pause habits for vacation\n\n"
-        
-        message += "📊 **Progress & Stats**\n"
-        message += "/stats - View your XP, level & stats\n\n"
-        
-        if subscription_tier == 'coach':
-            message += "💪 **Coach Tier Features**\n"
-            message += "/coach - AI Habit Coach\n\n"
-        elif subscription_tier == 'basic':
-            message += "🌟 **Basic Premium Features**\n"
-            message += "(Unlimited habits enabled)\n\n"
-        
-        message += "🆙 **Other Commands**\n"
-        message += "/start - Welcome message\n"
-        message += "/settings - Manage your settings\n"
-        message += "/commands - Show this list\n"
-        
-        if subscription_tier == 'free':
-            message += "/upgrade - Get premium features\n\n"
-            message += "🎆 You're using the free version (3 habits max)"
-        elif subscription_tier == 'basic':
-            message += "/upgrade - Upgrade to Coach tier\n\n"
-            message += "🌟 You're a Basic Premium member!"
-        else:
-            message += "\n💪 You're a Coach tier member!"
-        
+        subscription_tier = await get_tier(user_id)
+
+        message, _ = render_view('commands', subscription_tier, language)
         await update.message.reply_text(message, parse_mode='Markdown')
-        
+
     except Exception as e:
         # Fallback message if database check fails
-        message = "📋 **Available Commands**\n\n"
-        message += "/start - Begin or restart\n"
-        message += "/addhabit - Add a new habit\n"
-        message += "/habits - View your habits\n"
-        message += "/complete - Mark habit as done\n"
-        message += "/stats - Check your progress\n"
-        message += "/upgrade - Get premium\n"
-        message += "/commands - Show this list\n"
-        
+        message, _ = render_view('commands_short', None, language)
         await update.message.reply_text(message, parse_mode='Markdown')
 
 
-# Main function
-def main() -> None:
-    # Create application
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Command handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("addhabit", add_habit))
-    app.add_handler(CommandHandler("habits", view_habits))
-    app.add_handler(CommandHandler("complete", complete_habit))
-    app.add_handler(CommandHandler("stats", stats))
-    app.add_handler(CommandHandler("upgrade", upgrade))
-    app.add_handler(CommandHandler("commands", list_commands))
-    app.add_handler(CommandHandler("settings", settings))
-    app.add_handler(CommandHandler("coach", coach))
-    app.add_handler(CommandHandler("remind", remind))
-    app.add_handler(CommandHandler("pause", pause_habit))
+# Application setup, served by server.py
+def build_application():
+    # Create application, keeping user_data (drafts, conversation step, pending checkouts) across restarts.
+    # Different users' updates run concurrently, each user's own updates stay in order.
+    builder = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(build_update_processor())
+    builder = builder.request(TelegramMetricsRequest())  # Records send outcomes for /metrics
+    builder = builder.base_url(TELEGRAM_BASE_URL)
+    persistence = build_persistence()
+    if persistence:
+        builder = builder.persistence(persistence)
+    app = builder.build()
+    
+    # Command handlers, each timed under its command in /metrics
+    app.add_handler(CommandHandler("start", instrument("/start", start)))
+    app.add_handler(CommandHandler("addhabit", instrument("/addhabit", add_habit)))
+    app.add_handler(CommandHandler("habits", instrument("/habits", view_habits)))
+    app.add_handler(CommandHandler("complete", instrument("/complete", complete_habit)))
+    app.add_handler(CommandHandler("stats", instrument("/stats", stats)))
+    app.add_handler(CommandHandler("upgrade", instrument("/upgrade", upgrade)))
+    app.add_handler(CommandHandler("commands", instrument("/commands", list_commands)))
+    app.add_handler(CommandHandler("settings", instrument("/settings", settings)))
+    app.add_handler(CommandHandler("coach", instrument("/coach", coach)))
+    app.add_handler(CommandHandler("remind", instrument("/remind", remind)))
+    app.add_handler(CommandHandler("pause", instrument("/pause", pause_habit)))
     
     # Message handler
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument("message", handle_message)))
     
     # Callback query handler
     app.add_handler(CallbackQueryHandler(handle_callback))
     
-    # Note: Job Queue doesn't work well with webhooks
-    # Use the separate send_reminders.py script with a cron job instead
-    # See send_reminders.py for the reminder implementation
-    
-    # Run the bot with webhook
-    print("🤖 Bot is starting with webhook...")
-    
-    # Get the port from environment variable (Render provides this)
-    PORT = int(os.environ.get('PORT', 8443))
-    
-    # Your Render app URL
-    RENDER_APP_URL = os.environ.get('RENDER_EXTERNAL_URL') or 'https://telegram-habit-tracker-12qk.onrender.com'
-    
-    # Start webhook
-    app.run_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        url_path=TELEGRAM_BOT_TOKEN,
-        webhook_url=f"{RENDER_APP_URL}/{TELEGRAM_BOT_TOKEN}"
-    )
+    return app
 
 if __name__ == '__main__':
+    # The bot runs inside the unified server alongside the Stripe webhook and reminders
+    from server import main
     main()
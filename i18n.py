@@ -0,0 +1,116 @@
+"""
+Translation catalog for the bot's messages.
+
+translations.json holds one dict of message templates per language. It is read
+from next to this file on the first lookup, and each language is compiled the
+first time a user needs it: its templates are laid over the English ones, so a
+key the translation lacks falls back to English, and every template is parsed
+up front into an equivalent %-mapping pattern, so rendering a message is one
+substitution instead of a str.format parse.
+"""
+
+import json
+import os
+import string
+from functools import lru_cache
+
+TRANSLATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'translations.json')
+DEFAULT_LANGUAGE = 'en'
+
+# Shown in the language picker and settings, in each language's own name
+LANGUAGE_NAMES = {
+    'en': 'English', 'es': 'Español', 'fr': 'Français', 'de': 'Deutsch',
+    'it': 'Italiano', 'pt': 'Português', 'ru': 'Русский', 'zh': '中文',
+    'ja': '日本語', 'ko': '한국어', 'ar': 'العربية', 'hi': 'हिन्दी',
+    'tr': 'Türkçe', 'nl': 'Nederlands', 'pl': 'Polski', 'sv': 'Svenska',
+    'uk': 'Українська', 'cs': 'Čeština', 'da': 'Dansk', 'fi': 'Suomi',
+    'hu': 'Magyar', 'ro': 'Română', 'bg': 'Български'
+}
+
+_formatter = string.Formatter()
+
+
+class Template:
+    """A message template with fields, pre-parsed once"""
+    __slots__ = ('text', 'pattern', 'fields')
+
+    def __init__(self, text, pattern, fields):
+        self.text = text
+        self.pattern = pattern  # %-style equivalent, None if the template needs str.format (specs, indexing)
+        self.fields = fields
+
+
+def compile_template(text):
+    """Plain text for templates without fields, a Template otherwise"""
+    literals = []
+    pattern = []
+    fields = set()
+    simple = True
+    for literal, field, spec, conversion in _formatter.parse(text):
+        literals.append(literal)
+        pattern.append(literal.replace('%', '%%'))
+        if field is None:
+            continue
+        fields.add(field.split('.')[0].split('[')[0])
+        if spec or conversion or not field.isidentifier():
+            simple = False
+        pattern.append(f'%({field})s')
+    if not fields:
+        return ''.join(literals)  # parse() has already turned {{ and }} into braces
+    # Mapping %-formatting renders the same text as str.format for plain {name} fields, only faster
+    return Template(text, ''.join(pattern) if simple else None, frozenset(fields))
+
+
+def template_fields(compiled):
+    return compiled.fields if isinstance(compiled, Template) else frozenset()
+
+
+@lru_cache(maxsize=None)
+def load_translations():
+    """The raw catalog, read once per process"""
+    with open(TRANSLATIONS_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def compile_language(language):
+    """key -> compiled template for one language, English filling the gaps"""
+    translations = load_translations()
+    if language == DEFAULT_LANGUAGE:
+        return {key: compile_template(text) for key, text in translations[language].items()}
+
+    english = compile_language(DEFAULT_LANGUAGE)
+    catalog = dict(english)
+    for key, text in translations[language].items():
+        compiled = compile_template(text)
+        # A translation asking for a value the English text doesn't pass would raise at send time
+        if key in english and not template_fields(compiled) <= template_fields(english[key]):
+            print(f"⚠️ Translation '{language}.{key}' uses unknown fields, falling back to English")
+            continue
+        catalog[key] = compiled
+    return catalog
+
+
+_catalogs = {}  # language -> compiled catalog, for the per-message lookup
+
+
+def get_catalog(language):
+    """The compiled catalog for a language, English for unknown or missing ones"""
+    catalog = _catalogs.get(language)
+    if catalog is None:
+        if language not in load_translations():
+            return get_catalog(DEFAULT_LANGUAGE)
+        catalog = _catalogs[language] = compile_language(language)
+    return catalog
+
+
+def get_translation(language, key, /, **kwargs):
+    """Render a message in the user's language, then English, then the bare key"""
+    compiled = get_catalog(language).get(key)
+    if compiled is None:
+        return key
+    if compiled.__class__ is str:
+        return compiled
+    if compiled.pattern is not None:
+        return compiled.pattern % kwargs
+    return compiled.text.format_map(kwargs)
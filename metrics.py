@@ -0,0 +1,202 @@
+"""
+In-process metrics for the bot, served in Prometheus text format on /metrics.
+
+Every command, callback route and conversation message is timed as a handler,
+and the Supabase queries, Stripe and OpenAI calls and Telegram API requests it
+makes are recorded against it through a context variable, so a slow command
+shows up together with the work behind it. Background work (reminders, Stripe
+events) is labelled the same way, and each run also gets a query trace for
+N+1 detection (query_trace.py). Metrics are plain dicts updated on the event
+loop, so no client library or lock is needed, and they reset on restart.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from telegram.request import HTTPXRequest
+import query_trace
+
+# Upper bounds in seconds, from a cached screen up to a slow coach answer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Handler the current task is running, for attributing queries and API calls
+current_handler = ContextVar('current_handler', default='other')
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> count
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, dict(zip(self.labels, labels)), value
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [count per bucket (+Inf last), sum]
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            base = dict(zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket', {**base, 'le': le}, cumulative
+            yield f'{self.name}_count', base, cumulative
+            yield f'{self.name}_sum', base, total
+
+
+handler_seconds = Histogram(
+    'bot_handler_seconds', "Time spent in each handler", ('handler',))
+handler_errors = Counter(
+    'bot_handler_errors_total', "Exceptions raised out of each handler", ('handler',))
+db_queries = Counter(
+    'bot_db_queries_total', "Supabase queries issued, by handler and outcome", ('handler', 'outcome'))
+db_query_seconds = Histogram(
+    'bot_db_query_seconds', "Supabase query latency, by handler", ('handler',))
+external_call_seconds = Histogram(
+    'bot_external_call_seconds', "OpenAI and Stripe call latency",
+    ('handler', 'service', 'operation', 'outcome'))
+telegram_requests = Counter(
+    'bot_telegram_requests_total', "Telegram Bot API requests, by handler, method and outcome",
+    ('handler', 'method', 'outcome'))
+telegram_request_seconds = Histogram(
+    'bot_telegram_request_seconds', "Telegram Bot API request latency, by method", ('method',))
+webhook_updates = Counter(
+    'bot_webhook_updates_total', "Updates received on the webhook", ())
+update_queue_seconds = Histogram(
+    'bot_update_queue_seconds', "Time from webhook receipt until an update's handlers start", ())
+update_seconds = Histogram(
+    'bot_update_seconds', "Time from webhook receipt until an update is handled", ())
+flood_rejected = Counter(
+    'bot_flood_rejected_total', "Updates dropped by flood control before reaching the handlers, by reason",
+    ('class', 'reason'))
+
+REGISTRY = [
+    handler_seconds, handler_errors, db_queries, db_query_seconds,
+    external_call_seconds, telegram_requests, telegram_request_seconds,
+    webhook_updates, update_queue_seconds, update_seconds, flood_rejected
+]
+
+_received = {}  # update_id -> perf_counter() at webhook receipt, until the update is handled
+
+
+@contextmanager
+def track_handler(name, update_id=None):
+    """Time a block as handler name, attribute the calls made inside it and trace its queries"""
+    token = current_handler.set(name)
+    trace_token = query_trace.start(name, update_id)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        handler_errors.inc(name)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, name)
+        query_trace.finish(trace_token)
+        current_handler.reset(token)
+
+
+def instrument(name, callback):
+    """Wrap a handler(update, context) callback so each run is tracked under name"""
+    @wraps(callback)
+    async def wrapper(update, *args, **kwargs):
+        with track_handler(name, getattr(update, 'update_id', None)):
+            return await callback(update, *args, **kwargs)
+    return wrapper
+
+
+def update_received(update_id):
+    webhook_updates.inc()
+    _received[update_id] = time.perf_counter()
+
+
+def update_started(update):
+    """Record how long an update waited in the queue and for its user's earlier updates"""
+    received = _received.get(getattr(update, 'update_id', None))
+    if received is not None:
+        update_queue_seconds.observe(time.perf_counter() - received)
+
+
+def update_finished(update):
+    received = _received.pop(getattr(update, 'update_id', None), None)
+    if received is not None:
+        update_seconds.observe(time.perf_counter() - received)
+
+
+def record_query(seconds, ok):
+    handler = current_handler.get()
+    db_queries.inc(handler, 'ok' if ok else 'error')
+    db_query_seconds.observe(seconds, handler)
+
+
+@contextmanager
+def track_call(service, operation):
+    """Time an OpenAI or Stripe call made by the current handler"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        external_call_seconds.observe(
+            time.perf_counter() - start, current_handler.get(), service, operation, outcome)
+
+
+class TelegramMetricsRequest(HTTPXRequest):
+    """The bot's HTTP client, recording each Bot API request's method, outcome and latency"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+            if status != 200:
+                outcome = str(status)  # 400 bad request, 403 blocked by the user, 429 flood control
+            return status, payload
+        except Exception as e:
+            outcome = type(e).__name__  # TimedOut, NetworkError
+            raise
+        finally:
+            telegram_requests.inc(current_handler.get(), api_method, outcome)
+            telegram_request_seconds.observe(time.perf_counter() - start, api_method)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {kind}')
+        for name, labels, value in metric.samples():
+            label_text = ','.join(f'{key}="{escape(val)}"' for key, val in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API.
+Lets the AI coach be load tested without spending real OpenAI credits.
+
+Usage:
+    python mock_openai_server.py --port 8089 --latency-ms 800 --jitter-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=test python habit_bot.py
+
+GET /stats returns request, rate limit and token counters for benchmarks.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COACH_SENTENCES = [
+    "Start with a version of the habit so small it feels almost silly.",
+    "Stack the new habit right after something you already do every day.",
+    "Missing one day is fine, missing two is the start of a new pattern.",
+    "Track the streak somewhere you will see it first thing in the morning.",
+    "Make the cue obvious and remove friction from the first step.",
+    "Plan for the hard days in advance so motivation isn't required.",
+    "Celebrate the completion right away so your brain links it to a reward.",
+    "Focus on becoming the kind of person who shows up, not on the outcome.",
+]
+
+
+class MockState:
+    """Configuration and counters shared by all request threads"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.stats = {
+            'requests': 0,
+            'completions': 0,
+            'streamed': 0,
+            'rate_limited': 0,
+            'unavailable': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'by_model': {}
+        }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def over_rpm_limit(self):
+        """Fixed one-minute window, like OpenAI's requests-per-minute limit"""
+        if not self.args.rpm:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            return self.window_count > self.args.rpm
+
+    def sample_latency(self):
+        """Draw a response latency in seconds from the configured distribution"""
+        mean = self.args.latency_ms
+        jitter = self.args.jitter_ms
+        distribution = self.args.distribution
+        if distribution == 'uniform':
+            value = random.uniform(mean - jitter, mean + jitter)
+        elif distribution == 'normal':
+            value = random.gauss(mean, jitter)
+        elif distribution == 'lognormal' and mean > 0:
+            # Long right tail, like real model latency
+            sigma = min(jitter / mean, 2.0) if jitter else 0.0
+            value = random.lognormvariate(0, sigma) * mean
+        else:
+            value = mean
+        return max(value, 0) / 1000
+
+
+def estimate_tokens(text):
+    """Same rough heuristic the bot uses for usage logging"""
+    return int(len((text or '').split()) * 1.3)
+
+
+def is_validation(body):
+    """The coach's topic filter asks for a single YES/NO word"""
+    return (body.get('max_tokens') or 500) <= 10
+
+
+def generate_reply(body, state):
+    """Build the assistant reply for a chat completion request"""
+    max_tokens = body.get('max_tokens') or 500
+    if is_validation(body):
+        return 'NO' if random.random() < state.args.off_topic_ratio else 'YES'
+
+    target = random.randint(state.args.min_words, state.args.max_words)
+    words = []
+    while len(words) < target:
+        words.extend(random.choice(COACH_SENTENCES).split())
+    # Respect max_tokens the way the real API truncates output
+    limit = max(int(max_tokens / 1.3), 1)
+    return ' '.join(words[:min(target, limit)])
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes, don't wait for delayed ACKs
+    state = None
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, error_type, code, headers=None):
+        self.send_json(status, {
+            'error': {'message': message, 'type': error_type, 'param': None, 'code': code}
+        }, headers)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.state.lock:
+                self.send_json(200, self.state.stats)
+        elif self.path.rstrip('/').endswith('/models'):
+            models = ['gpt-4o-mini', 'gpt-3.5-turbo', 'gpt-4o']
+            self.send_json(200, {
+                'object': 'list',
+                'data': [{'id': m, 'object': 'model', 'owned_by': 'mock'} for m in models]
+            })
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", 'invalid_request_error', None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_error_json(400, "Invalid JSON body", 'invalid_request_error', None)
+            return
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error_json(404, f"Unknown path {self.path}", 'invalid_request_error', None)
+            return
+
+        state = self.state
+        model = body.get('model', 'gpt-4o-mini')
+        state.count('requests')
+        with state.lock:
+            state.stats['by_model'][model] = state.stats['by_model'].get(model, 0) + 1
+
+        latency = state.sample_latency()
+
+        unavailable = model in state.args.unavailable_models
+        if unavailable and not (state.args.unavailable_after_validation and is_validation(body)):
+            state.count('unavailable')
+            time.sleep(latency / 4)
+            self.send_error_json(
+                404, f"The model `{model}` does not exist or you do not have access to it.",
+                'invalid_request_error', 'model_not_found'
+            )
+            return
+
+        if state.over_rpm_limit() or random.random() < state.args.rate_limit_ratio:
+            state.count('rate_limited')
+            retry_after = state.args.retry_after
+            self.send_error_json(
+                429,
+                f"Rate limit reached for {model} on requests per min (RPM): "
+                f"Limit {state.args.rpm or 3}. Please try again in {retry_after}s.",
+                'requests', 'rate_limit_exceeded',
+                headers={
+                    'retry-after': str(retry_after),
+                    'x-ratelimit-limit-requests': str(state.args.rpm or 3),
+                    'x-ratelimit-remaining-requests': '0',
+                    'x-ratelimit-reset-requests': f"{retry_after}s"
+                }
+            )
+            return
+
+        reply = generate_reply(body, state)
+        prompt_tokens = sum(estimate_tokens(m.get('content')) for m in body.get('messages', []))
+        completion_tokens = max(estimate_tokens(reply), 1)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+        state.count('prompt_tokens', prompt_tokens)
+        state.count('completion_tokens', completion_tokens)
+        state.count('completions')
+
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if body.get('stream'):
+            state.count('streamed')
+            self.stream_reply(completion_id, created, model, reply, usage, latency, body)
+            return
+
+        time.sleep(latency)
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': reply},
+                'finish_reason': 'stop'
+            }],
+            'usage': usage
+        })
+
+    def stream_reply(self, completion_id, created, model, reply, usage, latency, body):
+        """Send the reply as server-sent events, one word per chunk"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}] if delta is not None else []
+            }
+            if chunk_usage:
+                payload['usage'] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        # Time to first token, then a steady per-token delay
+        time.sleep(latency)
+        chunk({'role': 'assistant', 'content': ''})
+        for i, word in enumerate(reply.split(' ')):
+            chunk({'content': word if i == 0 else f" {word}"})
+            time.sleep(self.state.args.token_ms / 1000)
+        chunk({}, finish_reason='stop')
+        if (body.get('stream_options') or {}).get('include_usage'):
+            chunk(None, chunk_usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=800, help="Mean response latency")
+    parser.add_argument('--jitter-ms', type=float, default=300, help="Spread of the latency distribution")
+    parser.add_argument('--distribution', choices=['fixed', 'uniform', 'normal', 'lognormal'], default='lognormal')
+    parser.add_argument('--token-ms', type=float, default=15, help="Delay between streamed tokens")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument('--rpm', type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    parser.add_argument('--retry-after', type=int, default=1, help="Seconds suggested in 429 responses")
+    parser.add_argument('--off-topic-ratio', type=float, default=0.0, help="Share of validation calls answered NO")
+    parser.add_argument('--unavailable-models', nargs='*', default=[], help="Models answered with model_not_found")
+    parser.add_argument('--unavailable-after-validation', action='store_true',
+                        help="Still answer topic validation calls for --unavailable-models, failing only the answers")
+    parser.add_argument('--min-words', type=int, default=60)
+    parser.add_argument('--max-words', type=int, default=220)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def make_server(args):
+    """Create the HTTP server without starting it"""
+    handler = type('ConfiguredMockOpenAIHandler', (MockOpenAIHandler,), {'state': MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(args)
+    print(f"🤖 Mock OpenAI server listening on http://{args.host}:{args.port}/v1")
+    print(f"   Latency: {args.distribution} {args.latency_ms}ms ± {args.jitter_ms}ms, "
+          f"429 ratio: {args.rate_limit_ratio}, RPM: {args.rpm or 'unlimited'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping mock server")
+        server.server_close()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of the Stripe API the bot uses.
+Serves a generated set of subscriptions so reconcile_subscriptions.py and the
+upgrade flow can be exercised without a Stripe account.
+
+Usage:
+    python mock_stripe_server.py --subscriptions 5000 --coach-ratio 0.3
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_mock STRIPE_PRICE_ID=price_mock_basic \
+        STRIPE_COACH_PRICE_ID=price_mock_coach python reconcile_subscriptions.py --dry-run
+
+Endpoints:
+    GET  /v1/subscriptions             paged with limit / starting_after, filtered by status
+    GET  /v1/subscriptions/<id>
+    POST /v1/checkout/sessions         returns an open session with a fake URL
+    GET  /v1/checkout/sessions/<id>
+    GET  /stats                        request counters
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+MAX_PAGE_SIZE = 100  # Same cap as Stripe
+
+
+def generate_subscriptions(args):
+    """Deterministic subscriptions, newest first like Stripe lists them"""
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    subscriptions = []
+    for i in range(args.subscriptions):
+        user_id = str(args.first_user_id + i)
+        tier = 'coach' if rng.random() < args.coach_ratio else 'basic'
+        status = 'canceled' if rng.random() < args.canceled_ratio else 'active'
+        created = now - (i + 1) * 3600
+        period_end = now + rng.randint(1, 30) * 86400
+        metadata = {} if rng.random() < args.no_metadata_ratio else {'telegram_user_id': user_id, 'tier': tier}
+        subscriptions.append({
+            'id': f'sub_mock{i:08d}',
+            'object': 'subscription',
+            'status': status,
+            'customer': f'cus_mock{i:08d}',
+            'created': created,
+            'metadata': metadata,
+            'items': {
+                'object': 'list',
+                'data': [{
+                    'id': f'si_mock{i:08d}',
+                    'object': 'subscription_item',
+                    'price': {'id': args.coach_price if tier == 'coach' else args.basic_price, 'object': 'price'},
+                    'current_period_end': period_end
+                }],
+                'has_more': False
+            }
+        })
+    return subscriptions
+
+
+class MockState:
+    """Generated data and counters shared by all request threads"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.subscriptions = generate_subscriptions(args)
+        self.index = {sub['id']: i for i, sub in enumerate(self.subscriptions)}
+        self.sessions = {}
+        self.stats = {'requests': 0, 'list_pages': 0, 'subscriptions_listed': 0, 'sessions_created': 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+
+class MockStripeHandler(BaseHTTPRequestHandler):
+    state = None  # Set by make_server
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes, don't wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', f'req_{uuid.uuid4().hex[:14]}')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def not_found(self, kind, object_id):
+        self.send_json(404, {'error': {
+            'type': 'invalid_request_error',
+            'code': 'resource_missing',
+            'message': f"No such {kind}: '{object_id}'"
+        }})
+
+    def simulate_latency(self):
+        if self.state.args.latency_ms:
+            time.sleep(self.state.args.latency_ms / 1000)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/stats':
+            with self.state.lock:
+                self.send_json(200, dict(self.state.stats))
+            return
+
+        self.state.count('requests')
+        self.simulate_latency()
+
+        if url.path == '/v1/subscriptions':
+            self.list_subscriptions(query)
+        elif url.path.startswith('/v1/subscriptions/'):
+            sub_id = url.path.rsplit('/', 1)[1]
+            position = self.state.index.get(sub_id)
+            if position is None:
+                self.not_found('subscription', sub_id)
+            else:
+                self.send_json(200, self.state.subscriptions[position])
+        elif url.path.startswith('/v1/checkout/sessions/'):
+            session_id = url.path.rsplit('/', 1)[1]
+            session = self.state.sessions.get(session_id)
+            if session is None:
+                self.not_found('checkout.session', session_id)
+            else:
+                self.send_json(200, session)
+        else:
+            self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL (GET: {url.path})'}})
+
+    def list_subscriptions(self, query):
+        limit = min(int(query.get('limit', 10)), MAX_PAGE_SIZE)
+        status = query.get('status', 'active')  # Stripe leaves canceled ones out unless asked
+        start = 0
+        if 'starting_after' in query:
+            position = self.state.index.get(query['starting_after'])
+            if position is None:
+                self.not_found('subscription', query['starting_after'])
+                return
+            start = position + 1
+
+        page = []
+        position = start
+        subscriptions = self.state.subscriptions
+        while position < len(subscriptions) and len(page) < limit:
+            sub = subscriptions[position]
+            if status == 'all' or sub['status'] == status:
+                page.append(sub)
+            position += 1
+        remaining = itertools.islice(subscriptions, position, None)
+        has_more = any(status == 'all' or sub['status'] == status for sub in remaining)
+
+        self.state.count('list_pages')
+        self.state.count('subscriptions_listed', len(page))
+        self.send_json(200, {'object': 'list', 'url': '/v1/subscriptions', 'has_more': has_more, 'data': page})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+
+        self.state.count('requests')
+        self.simulate_latency()
+
+        if url.path == '/v1/checkout/sessions':
+            session_id = f'cs_test_{uuid.uuid4().hex}'
+            metadata = {key[len('metadata['):-1]: value for key, value in form.items() if key.startswith('metadata[')}
+            session = {
+                'id': session_id,
+                'object': 'checkout.session',
+                'mode': form.get('mode', 'payment'),
+                'status': 'open',
+                'payment_status': 'unpaid',
+                'url': f'https://checkout.stripe.com/c/pay/{session_id}',
+                'expires_at': int(time.time()) + 24 * 3600,
+                'client_reference_id': form.get('client_reference_id'),
+                'metadata': metadata
+            }
+            with self.state.lock:
+                self.state.sessions[session_id] = session
+            self.state.count('sessions_created')
+            self.send_json(200, session)
+        else:
+            self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL (POST: {url.path})'}})
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Stripe API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--subscriptions', type=int, default=1000, help="Number of generated subscriptions")
+    parser.add_argument('--first-user-id', type=int, default=100000, help="Telegram user id of the first subscription")
+    parser.add_argument('--coach-ratio', type=float, default=0.3, help="Share of subscriptions on the Coach price")
+    parser.add_argument('--canceled-ratio', type=float, default=0.1, help="Share of canceled subscriptions")
+    parser.add_argument('--no-metadata-ratio', type=float, default=0.0,
+                        help="Share without telegram_user_id metadata, like subscriptions created before it was added")
+    parser.add_argument('--basic-price', default='price_mock_basic')
+    parser.add_argument('--coach-price', default='price_mock_coach')
+    parser.add_argument('--latency-ms', type=float, default=0, help="Added to every API response")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def make_server(args):
+    """Create the HTTP server without starting it"""
+    handler = type('ConfiguredMockStripeHandler', (MockStripeHandler,), {'state': MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(args)
+    print(f"💳 Mock Stripe server listening on http://{args.host}:{args.port}")
+    print(f"   {args.subscriptions} subscriptions, coach ratio {args.coach_ratio}, "
+          f"canceled ratio {args.canceled_ratio}, prices {args.basic_price} / {args.coach_price}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping mock server")
+        server.server_close()
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of Supabase's REST API (PostgREST) the bot uses.
+Serves a generated population of users, habits and completion history from
+memory, so handlers can be benchmarked with the real Supabase client and no
+database.
+
+Usage:
+    python mock_supabase_server.py --users 2000 --latency-ms 15
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=mock python bench_handlers.py
+
+Endpoints:
+    GET/POST/PATCH/DELETE /rest/v1/<table>   eq, neq, gt, gte, lt, lte, in, is and not. filters,
+                                             select with embedded users(...), order, limit, offset,
+                                             upsert via on_conflict
+    POST /rest/v1/rpc/<function>             award_xp, count_user_completions,
+                                             claim_coach_session, coach_quota, release_coach_session,
+                                             record_coach_memory,
+                                             claim_stripe_events (always empty)
+    GET  /stats                              request and row counters
+
+Lookups by id, user_id and habit_id use hash indexes, like the bot's
+indexes in Postgres, so the cost of a query grows with the rows it returns.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+TABLES = [
+    'users', 'profiles', 'habits', 'habit_logs', 'habit_schedules', 'habit_pauses',
+    'coach_conversations', 'coach_memory', 'stripe_events'
+]
+INDEXED_COLUMNS = ('id', 'user_id', 'habit_id')
+TIMESTAMP_COLUMNS = {
+    'completed_at', 'created_at', 'updated_at', 'tier_expires_at', 'start_date', 'end_date',
+    'last_sent_at', 'locked_until', 'processed_at', 'summarized_through', 'coach_sessions_reset_at'
+}
+CONFLICT_KEYS = {'users': 'user_id', 'profiles': 'user_id', 'coach_memory': 'user_id', 'habit_schedules': 'habit_id'}
+UUID_TABLES = {'habits', 'habit_logs', 'habit_schedules', 'habit_pauses', 'coach_conversations'}  # id DEFAULT gen_random_uuid()
+
+HABIT_NAMES = [
+    'Drink 8 glasses of water', 'Morning run', 'Read 10 pages', 'Meditate', 'Stretch',
+    'No phone after 10pm', 'Journal', 'Practice Spanish', 'Walk 10k steps', 'Sleep by 11pm'
+]
+TIMEZONES = ['UTC', 'Europe/London', 'Europe/Berlin', 'America/New_York', 'America/Los_Angeles', 'Asia/Kolkata', 'Asia/Tokyo']
+LANGUAGES = ['en'] * 6 + ['es', 'de', 'fr', 'pt', 'ru', 'hi']
+# History length in days, most users are new and a few have used the bot for a year
+HISTORY_DAYS = [(0, 0.15), (7, 0.25), (30, 0.25), (90, 0.2), (180, 0.1), (365, 0.05)]
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def generate_data(args):
+    """Deterministic users with habits, schedules and completion history"""
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    tables = {name: [] for name in TABLES}
+    for i in range(args.users):
+        user_id = str(args.first_user_id + i)
+        roll = rng.random()
+        tier = 'coach' if roll < args.coach_ratio else 'basic' if roll < args.coach_ratio + args.basic_ratio else 'free'
+        history = weighted(rng, HISTORY_DAYS)
+        created = now - timedelta(days=history, hours=rng.randint(0, 23))
+        tables['users'].append({
+            'user_id': user_id, 'is_premium': tier != 'free', 'subscription_tier': tier, 'tier_expires_at': None,
+            'timezone': rng.choice(TIMEZONES), 'reminder_enabled': True,
+            'coach_sessions_used': 0, 'coach_sessions_reset_at': None, 'created_at': created.isoformat()
+        })
+        tables['profiles'].append({
+            'user_id': user_id, 'name': f'User {i}', 'xp': 0, 'level': 1,
+            'language': rng.choice(LANGUAGES), 'data': {}, 'updated_at': now.isoformat()
+        })
+
+        max_habits = 3 if tier == 'free' else args.max_habits
+        habit_count = min(int(rng.expovariate(1 / args.mean_habits)) + (history > 0), max_habits)
+        completions = 0
+        for name in rng.sample(HABIT_NAMES, min(habit_count, len(HABIT_NAMES))):
+            habit_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            tables['habits'].append({
+                'id': habit_id, 'user_id': user_id, 'name': name, 'frequency': 'daily',
+                'is_active': rng.random() > 0.05, 'schedule_days': None, 'created_at': created.isoformat()
+            })
+            if rng.random() < args.schedule_ratio:
+                tables['habit_schedules'].append({
+                    'id': str(uuid.UUID(int=rng.getrandbits(128))), 'user_id': user_id, 'habit_id': habit_id,
+                    'days': ['Mon', 'Tue', 'Wed', 'Thu', 'Fri'], 'reminder_time': f'{rng.randint(6, 22):02d}:00:00',
+                    'fallback_time': None, 'fallback_enabled': False, 'snooze_enabled': True,
+                    'last_sent_at': None, 'created_at': created.isoformat()
+                })
+            rate = rng.uniform(0.3, 0.95)
+            for day in range(history, 0, -1):
+                if rng.random() < rate:
+                    completed = now - timedelta(days=day, minutes=rng.randint(0, 720))
+                    tables['habit_logs'].append({
+                        'id': str(uuid.UUID(int=rng.getrandbits(128))), 'habit_id': habit_id, 'user_id': user_id,
+                        'completed_at': completed.isoformat(), 'streak_count': 1
+                    })
+                    completions += 1
+        profile = tables['profiles'][-1]
+        profile['xp'] = completions * 10
+        profile['level'] = completions * 10 // 100 + 1
+    return tables
+
+
+def parse_timestamp(value):
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def coerce(column, stored, raw):
+    """The filter value as the stored column's type, so comparisons work like in Postgres"""
+    if column in TIMESTAMP_COLUMNS and stored is not None:
+        return parse_timestamp(stored), parse_timestamp(raw)
+    if isinstance(stored, bool):
+        return stored, raw == 'true'
+    if isinstance(stored, (int, float)):
+        return stored, float(raw)
+    return stored, raw
+
+
+def split_list(raw):
+    """in.(a,"b c") -> ['a', 'b c']"""
+    return [item.strip().strip('"') for item in raw.strip('()').split(',') if item.strip()]
+
+
+def matches(row, column, op, raw):
+    stored = row.get(column)
+    if op == 'is':
+        return stored is {'null': None, 'true': True, 'false': False}[raw]
+    if stored is None:
+        return False
+    if op == 'in':
+        return any(left == right for left, right in (coerce(column, stored, value) for value in split_list(raw)))
+    left, right = coerce(column, stored, raw)
+    return {
+        'eq': left == right, 'neq': left != right, 'gt': left > right,
+        'gte': left >= right, 'lt': left < right, 'lte': left <= right
+    }[op]
+
+
+def parse_filters(params):
+    """[(column, negated, op, value)] from PostgREST query parameters"""
+    filters = []
+    for column, value in params:
+        if column in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns'):
+            continue
+        op, _, raw = value.partition('.')
+        negated = op == 'not'
+        if negated:
+            op, _, raw = raw.partition('.')
+        filters.append((column, negated, op, raw))
+    return filters
+
+
+def split_select(select):
+    """'*, users(timezone)' -> (['*'], {'users': ['timezone']})"""
+    columns, embeds = [], {}
+    depth, current = 0, ''
+    for char in select + ',':
+        if char == ',' and depth == 0:
+            item = current.strip()
+            current = ''
+            if '(' in item:
+                name, inner = item.split('(', 1)
+                embeds[name.strip()] = [c.strip() for c in inner.rstrip(')').split(',')]
+            elif item:
+                columns.append(item)
+            continue
+        depth += (char == '(') - (char == ')')
+        current += char
+    return columns, embeds
+
+
+class MockState:
+    """Generated tables, indexes and counters shared by all request threads"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.tables = generate_data(args)
+        self.indexes = {}  # (table, column) -> value -> rows
+        for table, rows in self.tables.items():
+            for row in rows:
+                self.index_row(table, row)
+        self.stats = {'requests': 0, 'rows_returned': 0, 'rows_scanned': 0, 'by_table': {}}
+
+    def index_row(self, table, row):
+        for column in INDEXED_COLUMNS:
+            if column in row:
+                self.indexes.setdefault((table, column), {}).setdefault(row[column], []).append(row)
+
+    def unindex_row(self, table, row):
+        for column in INDEXED_COLUMNS:
+            if column in row:
+                bucket = self.indexes[(table, column)][row[column]]
+                bucket.remove(row)
+
+    def candidates(self, table, filters):
+        """Rows that can match, from an index on an eq or in filter when there is one"""
+        for column, negated, op, raw in filters:
+            index = self.indexes.get((table, column))
+            if index is None or negated:
+                continue
+            if op == 'eq':
+                return list(index.get(raw, ()))
+            if op == 'in':
+                return [row for value in split_list(raw) for row in index.get(value, ())]
+        return list(self.tables[table])
+
+    def select(self, table, filters):
+        rows = self.candidates(table, filters)
+        self.stats['rows_scanned'] += len(rows)
+        return [row for row in rows if all(matches(row, c, op, raw) != negated for c, negated, op, raw in filters)]
+
+    def count(self, table):
+        self.stats['requests'] += 1
+        self.stats['by_table'][table] = self.stats['by_table'].get(table, 0) + 1
+
+
+class MockSupabaseHandler(BaseHTTPRequestHandler):
+    state = None  # Set by make_server
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes, don't wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def error(self, status, code, message):
+        self.send_json(status, {'code': code, 'details': None, 'hint': None, 'message': message})
+
+    def simulate_latency(self):
+        args = self.state.args
+        if args.latency_ms or args.jitter_ms:
+            delay = max(0.0, random.gauss(args.latency_ms, args.jitter_ms))
+            time.sleep(delay / 1000)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def route(self):
+        """(table or rpc name, is_rpc, query params) for the request, None for /stats"""
+        url = urlparse(self.path)
+        if not url.path.startswith('/rest/v1/'):
+            return None
+        name = url.path[len('/rest/v1/'):]
+        is_rpc = name.startswith('rpc/')
+        return (name[4:] if is_rpc else name), is_rpc, parse_qsl(url.query, keep_blank_values=True)
+
+    def handle_request(self, method):
+        if urlparse(self.path).path == '/stats':
+            with self.state.lock:
+                stats = dict(self.state.stats, by_table=dict(self.state.stats['by_table']))
+            self.send_json(200, stats)
+            return
+        route = self.route()
+        if route is None:
+            self.error(404, 'PGRST000', f'Unknown path {self.path}')
+            return
+        name, is_rpc, params = route
+        body = self.read_body() if method in ('POST', 'PATCH') else None
+        self.simulate_latency()
+
+        with self.state.lock:
+            if is_rpc:
+                self.state.count(f'rpc/{name}')
+                result = self.call_rpc(name, body or {})
+                if result is NotImplemented:
+                    self.error(404, 'PGRST202', f'Could not find the function public.{name}')
+                else:
+                    self.send_json(200, result)
+                return
+            if name not in self.state.tables:
+                self.error(404, 'PGRST205', f"Could not find the table 'public.{name}' in the schema cache")
+                return
+            self.state.count(name)
+            self.total = None  # Matching rows before limit/offset, set by table_get
+            rows = getattr(self, f'table_{method.lower()}')(name, params, body)
+            total = len(rows) if self.total is None else self.total
+
+        prefer = self.headers.get('Prefer', '')
+        headers = {'Content-Range': f'0-{max(len(rows) - 1, 0)}/{total if "count=" in prefer else "*"}'}
+        if method != 'GET' and 'return=minimal' in prefer:
+            self.send_json(200, [], headers)
+            return
+        select = dict(params).get('select')
+        self.send_json(200, [self.project(row, select) for row in rows], headers)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def project(self, row, select):
+        """Apply the select list, embedding the user's row for users(...)"""
+        if not select:
+            return dict(row)
+        columns, embeds = split_select(select)
+        result = dict(row) if '*' in columns else {c: row.get(c) for c in columns}
+        for table, embed_columns in embeds.items():
+            related = self.state.indexes.get((table, 'user_id'), {}).get(row.get('user_id'))
+            related = related[0] if related else None
+            if related is not None and '*' not in embed_columns:
+                related = {c: related.get(c) for c in embed_columns}
+            result[table] = related
+        return result
+
+    def table_get(self, table, params, body):
+        rows = self.state.select(table, parse_filters(params))
+        options = dict(params)
+        if 'order' in options:
+            for item in reversed(options['order'].split(',')):
+                column, _, direction = item.partition('.')
+                rows.sort(key=lambda row: (row.get(column) is None, row.get(column) or ''),
+                          reverse=direction.startswith('desc'))
+        self.total = len(rows)
+        offset = int(options.get('offset', 0))
+        if 'limit' in options:
+            rows = rows[offset:offset + int(options['limit'])]
+        elif offset:
+            rows = rows[offset:]
+        self.state.stats['rows_returned'] += len(rows)
+        return rows
+
+    def table_post(self, table, params, body):
+        records = body if isinstance(body, list) else [body or {}]
+        prefer = self.headers.get('Prefer', '')
+        upsert = 'resolution=' in prefer
+        conflict = dict(params).get('on_conflict') or CONFLICT_KEYS.get(table, 'id')
+        now = datetime.now(timezone.utc).isoformat()
+        written = []
+        for record in records:
+            if upsert and record.get(conflict) is not None:
+                existing = self.state.indexes.get((table, conflict), {}).get(record[conflict]) \
+                    if conflict in INDEXED_COLUMNS else \
+                    [row for row in self.state.tables[table] if row.get(conflict) == record[conflict]]
+                if existing:
+                    if 'ignore-duplicates' not in prefer:
+                        existing[0].update(record)
+                        written.append(existing[0])
+                    continue
+            row = dict(record)
+            if table in UUID_TABLES:
+                row.setdefault('id', str(uuid.uuid4()))
+            row.setdefault('created_at', now)
+            if table == 'habit_logs':
+                row.setdefault('completed_at', now)
+            self.state.tables[table].append(row)
+            self.state.index_row(table, row)
+            written.append(row)
+        return written
+
+    def table_patch(self, table, params, body):
+        rows = self.state.select(table, parse_filters(params))
+        for row in rows:
+            self.state.unindex_row(table, row)
+            row.update(body or {})
+            self.state.index_row(table, row)
+        return rows
+
+    def table_delete(self, table, params, body):
+        rows = self.state.select(table, parse_filters(params))
+        for row in rows:
+            self.state.unindex_row(table, row)
+            self.state.tables[table].remove(row)
+        return rows
+
+    def call_rpc(self, name, body):
+        """Same results as the SQL functions in the migrations"""
+        state = self.state
+        user_id = body.get('p_user_id')
+        users = state.indexes.get(('users', 'user_id'), {}).get(user_id) or [None]
+        user = users[0]
+
+        if name == 'award_xp':
+            profiles = state.indexes.get(('profiles', 'user_id'), {}).get(user_id)
+            if not profiles:
+                return []
+            profile = profiles[0]
+            profile['xp'] = (profile.get('xp') or 0) + body['p_amount']
+            profile['level'] = profile['xp'] // body['p_level_xp'] + 1
+            return [{'xp': profile['xp'], 'level': profile['level']}]
+
+        if name == 'count_user_completions':
+            return len(state.indexes.get(('habit_logs', 'user_id'), {}).get(user_id, ()))
+
+        if name == 'claim_coach_session':
+            if user is None:
+                return []
+            today = datetime.now(timezone.utc).date().isoformat()
+            if user.get('coach_sessions_reset_at') != today:
+                user['coach_sessions_used'], user['coach_sessions_reset_at'] = 0, today
+            used = user['coach_sessions_used']
+            claimed = user['subscription_tier'] == 'coach' and used < body['p_daily_limit']
+            if claimed:
+                used = user['coach_sessions_used'] = used + 1
+            return [{
+                'tier': user['subscription_tier'], 'used': used,
+                'remaining': max(body['p_daily_limit'] - used, 0), 'claimed': claimed
+            }]
+
+        if name == 'coach_quota':
+            if user is None:
+                return []
+            today = datetime.now(timezone.utc).date().isoformat()
+            used = user['coach_sessions_used'] if user.get('coach_sessions_reset_at') == today else 0
+            return [{
+                'tier': user['subscription_tier'], 'used': used,
+                'remaining': max(body['p_daily_limit'] - used, 0)
+            }]
+
+        if name == 'release_coach_session':
+            if user is not None:
+                user['coach_sessions_used'] = max((user.get('coach_sessions_used') or 0) - 1, 0)
+            return None
+
+        if name == 'record_coach_memory':
+            rows = state.indexes.get(('coach_memory', 'user_id'), {}).get(user_id)
+            if rows:
+                memory = rows[0]
+            else:
+                memory = {'user_id': user_id, 'summary': None, 'summarized_through': None, 'history_tokens': 0}
+                state.tables['coach_memory'].append(memory)
+                state.index_row('coach_memory', memory)
+            memory['history_tokens'] = (memory.get('history_tokens') or 0) + body['p_tokens']
+            through = body.get('p_summarized_through')
+            if through and (not memory.get('summarized_through')
+                            or parse_timestamp(through) > parse_timestamp(memory['summarized_through'])):
+                memory['summary'], memory['summarized_through'] = body.get('p_summary'), through
+            return None
+
+        if name == 'claim_stripe_events':
+            return []  # No Stripe inbox here, keeps server.py's event worker idle
+
+        return NotImplemented
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Supabase REST server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--users', type=int, default=1000, help="Number of generated users")
+    parser.add_argument('--first-user-id', type=int, default=100000, help="Telegram user id of the first user")
+    parser.add_argument('--coach-ratio', type=float, default=0.1, help="Share of users on the Coach tier")
+    parser.add_argument('--basic-ratio', type=float, default=0.2, help="Share of users on the Basic tier")
+    parser.add_argument('--mean-habits', type=float, default=2.5, help="Mean habits per user (exponential)")
+    parser.add_argument('--max-habits', type=int, default=10, help="Cap for premium users, free users stop at 3")
+    parser.add_argument('--schedule-ratio', type=float, default=0.4, help="Share of habits with a reminder")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Added to every response, like the network to Supabase")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Standard deviation of the added latency")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def make_server(args):
+    """Create the HTTP server without starting it"""
+    handler = type('ConfiguredMockSupabaseHandler', (MockSupabaseHandler,), {'state': MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(args)
+    tables = server.RequestHandlerClass.state.tables
+    print(f"🗄️ Mock Supabase server listening on http://{args.host}:{args.port}")
+    print(f"   {len(tables['users'])} users, {len(tables['habits'])} habits, "
+          f"{len(tables['habit_logs'])} completions, {len(tables['habit_schedules'])} reminders")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping mock server")
+        server.server_close()
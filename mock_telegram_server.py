@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API.
+Answers every method the bot calls with a plausible result, so handlers and
+the webhook server can be benchmarked without sending real messages.
+
+Usage:
+    python mock_telegram_server.py --latency-ms 40 --blocked-ratio 0.02
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 python server.py
+
+Endpoints:
+    POST /bot<token>/<method>   getMe, sendMessage, editMessageText, editMessageReplyMarkup,
+                                answerCallbackQuery, setWebhook and the rest (answered with true)
+    GET  /stats                 request counters by method and outcome
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+BOT_USER = {
+    'id': 1000000001, 'is_bot': True, 'first_name': 'Habit Tracker', 'username': 'mock_habit_bot',
+    'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False
+}
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendPhoto', 'sendDocument'}
+
+
+class MockState:
+    """Configuration and counters shared by all request threads"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+        self.message_id = 0
+        self.stats = {'requests': 0, 'by_method': {}, 'blocked': 0, 'flood_limited': 0}
+
+    def next_message_id(self):
+        with self.lock:
+            self.message_id += 1
+            return self.message_id
+
+    def count(self, method):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['by_method'][method] = self.stats['by_method'].get(method, 0) + 1
+
+    def is_blocked(self, chat_id):
+        """The same chats are always blocked, like users who blocked the bot"""
+        return zlib.crc32(str(chat_id).encode()) % 10000 < self.args.blocked_ratio * 10000
+
+    def is_flood_limited(self):
+        with self.lock:
+            return self.rng.random() < self.args.flood_ratio
+
+
+class MockTelegramHandler(BaseHTTPRequestHandler):
+    state = None  # Set by make_server
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes, don't wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def simulate_latency(self):
+        args = self.state.args
+        if args.latency_ms or args.jitter_ms:
+            time.sleep(max(0.0, random.gauss(args.latency_ms, args.jitter_ms)) / 1000)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            with self.state.lock:
+                stats = dict(self.state.stats, by_method=dict(self.state.stats['by_method']))
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode()
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(body or '{}')
+        else:
+            params = dict(parse_qsl(body))  # The bot sends form fields with JSON-encoded values
+        method = urlparse(self.path).path.rsplit('/', 1)[-1]
+
+        self.state.count(method)
+        self.simulate_latency()
+
+        if method in MESSAGE_METHODS and self.state.is_blocked(params.get('chat_id')):
+            with self.state.lock:
+                self.state.stats['blocked'] += 1
+            self.send_json(403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'})
+            return
+        if method in MESSAGE_METHODS and self.state.is_flood_limited():
+            with self.state.lock:
+                self.state.stats['flood_limited'] += 1
+            retry_after = self.state.args.retry_after
+            self.send_json(429, {
+                'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after}
+            })
+            return
+
+        self.send_json(200, {'ok': True, 'result': self.result(method, params)})
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in MESSAGE_METHODS:
+            chat_id = int(params.get('chat_id') or 0)
+            message_id = params.get('message_id')
+            return {
+                'message_id': int(message_id) if message_id else self.state.next_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', '')
+            }
+        return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Telegram Bot API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Added to every response")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Standard deviation of the added latency")
+    parser.add_argument('--blocked-ratio', type=float, default=0.0, help="Share of chats that blocked the bot (403)")
+    parser.add_argument('--flood-ratio', type=float, default=0.0, help="Share of sends answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Seconds suggested in 429 responses")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def make_server(args):
+    """Create the HTTP server without starting it"""
+    handler = type('ConfiguredMockTelegramHandler', (MockTelegramHandler,), {'state': MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(args)
+    print(f"✈️ Mock Telegram Bot API listening on http://{args.host}:{args.port}")
+    print(f"   latency {args.latency_ms}ms, blocked ratio {args.blocked_ratio}, flood ratio {args.flood_ratio}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping mock server")
+        server.server_close()
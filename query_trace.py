@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Per-update Supabase query tracing with N+1 detection.
+
+Each handler run (a Telegram update, a reminder run, a Stripe event) gets a
+trace, and run_query adds every query to it as its shape: the operation, the
+table and the filtered columns with their operators, without values. When a
+run issues the same shape more than N_PLUS_ONE_THRESHOLD times it is a query
+inside a loop, which is flagged with a warning. Finished traces are folded
+into a per-handler summary that can be exported as JSON, e.g. from a benchmark
+run in CI, and checked with this script.
+
+Usage:
+    QUERY_TRACE_EXPORT=trace.json python bench_handlers.py
+    python query_trace.py trace.json
+    python query_trace.py trace.json --max-queries /habits=3 --max-queries /stats=4 --allow-n-plus-one
+"""
+
+import argparse
+import atexit
+import json
+import os
+import sys
+from collections import deque
+from contextvars import ContextVar
+
+QUERY_TRACE = os.getenv('QUERY_TRACE', '1') != '0'
+N_PLUS_ONE_THRESHOLD = int(os.getenv('QUERY_TRACE_N1_THRESHOLD', '3'))  # Same-shape queries allowed per run
+QUERY_TRACE_EXPORT = os.getenv('QUERY_TRACE_EXPORT')  # Write the summary here on exit
+FLAGGED_KEPT = 100  # Most recent N+1 runs kept in the summary
+
+# Query parameters that aren't filters
+NON_FILTER_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+OPERATIONS = {'GET': 'select', 'POST': 'insert', 'PATCH': 'update', 'DELETE': 'delete', 'HEAD': 'count'}
+
+current_trace = ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """Queries issued by one handler run"""
+    __slots__ = ('handler', 'update_id', 'queries')
+
+    def __init__(self, handler, update_id=None):
+        self.handler = handler
+        self.update_id = update_id
+        self.queries = []  # (shape, seconds, ok)
+
+
+def query_shape(query):
+    """'select habit_logs [habit_id=eq, completed_at=gte]' for a Supabase query builder"""
+    try:
+        request = query.request
+        path = request.path.path.split('/rest/v1/', 1)[-1]
+        method = str(getattr(request.http_method, 'value', request.http_method))
+        params = request.params
+    except AttributeError:
+        return type(query).__name__
+    if path.startswith('rpc/'):
+        return f"rpc {path[4:]}"
+
+    operation = OPERATIONS.get(method, method.lower())
+    if operation == 'insert' and 'resolution=' in request.headers.get('prefer', ''):
+        operation = 'upsert'
+    filters = []
+    for column, value in params.multi_items():
+        if column in NON_FILTER_PARAMS:
+            continue
+        op = value.split('.', 2)
+        filters.append(f"{column}={'.'.join(op[:2]) if op[0] == 'not' else op[0]}")
+    shape = f"{operation} {path}"
+    if 'select' in params and operation == 'select':
+        shape += f" ({params['select']})"
+    if filters:
+        shape += f" [{', '.join(filters)}]"
+    return shape
+
+
+def record(query, seconds, ok):
+    """Add a finished query to the current run's trace, if there is one"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.queries.append((query_shape(query), seconds, ok))
+
+
+def start(handler, update_id=None):
+    """Begin tracing a handler run, returns a token for finish()"""
+    if not QUERY_TRACE:
+        return None
+    return current_trace.set(Trace(handler, update_id))
+
+
+def finish(token):
+    """Stop tracing the current run, flag repeated shapes and add it to the summary"""
+    if token is None:
+        return
+    trace = current_trace.get()
+    current_trace.reset(token)
+    summary.add(trace)
+
+
+class Summary:
+    """Per-handler query counts across runs"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.flagged = deque(maxlen=FLAGGED_KEPT)
+
+    def add(self, trace):
+        stats = self.handlers.get(trace.handler)
+        if stats is None:
+            stats = self.handlers[trace.handler] = {
+                'runs': 0, 'queries': 0, 'max_queries': 0, 'errors': 0,
+                'seconds': 0.0, 'n_plus_one_runs': 0, 'shapes': {}
+            }
+        stats['runs'] += 1
+        stats['queries'] += len(trace.queries)
+        stats['max_queries'] = max(stats['max_queries'], len(trace.queries))
+
+        per_run = {}
+        for shape, seconds, ok in trace.queries:
+            per_run[shape] = per_run.get(shape, 0) + 1
+            stats['seconds'] += seconds
+            if not ok:
+                stats['errors'] += 1
+            shape_stats = stats['shapes'].get(shape)
+            if shape_stats is None:
+                shape_stats = stats['shapes'][shape] = {'count': 0, 'max_per_run': 0, 'seconds': 0.0}
+            shape_stats['count'] += 1
+            shape_stats['seconds'] += seconds
+
+        repeated = False
+        for shape, count in per_run.items():
+            shape_stats = stats['shapes'][shape]
+            shape_stats['max_per_run'] = max(shape_stats['max_per_run'], count)
+            if count > N_PLUS_ONE_THRESHOLD:
+                repeated = True
+                self.flagged.append({
+                    'handler': trace.handler, 'update_id': trace.update_id, 'shape': shape, 'count': count
+                })
+                update = f" (update {trace.update_id})" if trace.update_id is not None else ""
+                print(f"⚠️ N+1 in {trace.handler}{update}: {count}× {shape}")
+        if repeated:
+            stats['n_plus_one_runs'] += 1
+
+    def as_dict(self):
+        return {
+            'threshold': N_PLUS_ONE_THRESHOLD,
+            'handlers': self.handlers,
+            'flagged': list(self.flagged)
+        }
+
+    def export(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=2, ensure_ascii=False)
+
+    def clear(self):
+        self.handlers.clear()
+        self.flagged.clear()
+
+
+summary = Summary()
+
+# Not when running as the checker, which would overwrite the file it reads
+if QUERY_TRACE and QUERY_TRACE_EXPORT and __name__ != '__main__':
+    atexit.register(lambda: summary.export(QUERY_TRACE_EXPORT))
+
+
+def check(data, max_queries, allow_n_plus_one):
+    """Failures in an exported summary, as messages"""
+    failures = []
+    for handler, stats in data['handlers'].items():
+        if stats['n_plus_one_runs'] and not allow_n_plus_one:
+            shapes = [shape for shape, s in stats['shapes'].items() if s['max_per_run'] > data['threshold']]
+            failures.append(f"{handler}: repeated queries in {stats['n_plus_one_runs']} runs: {'; '.join(shapes)}")
+        limit = max_queries.get(handler)
+        if limit is not None and stats['max_queries'] > limit:
+            failures.append(f"{handler}: {stats['max_queries']} queries in one run, limit is {limit}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on and check an exported query trace summary")
+    parser.add_argument('summary', help="JSON written via QUERY_TRACE_EXPORT")
+    parser.add_argument('--max-queries', action='append', default=[], metavar='HANDLER=N',
+                        help="Fail if one run of HANDLER issued more than N queries")
+    parser.add_argument('--allow-n-plus-one', action='store_true', help="Report repeated queries without failing")
+    args = parser.parse_args()
+
+    with open(args.summary, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    max_queries = {}
+    for item in args.max_queries:
+        handler, _, limit = item.rpartition('=')
+        max_queries[handler] = int(limit)
+
+    print(f"{'handler':<32}{'runs':>6}{'queries/run':>13}{'max':>6}{'ms/run':>9}{'N+1 runs':>10}")
+    for handler, stats in sorted(data['handlers'].items()):
+        runs = stats['runs'] or 1
+        print(f"{handler:<32}{stats['runs']:>6}{stats['queries'] / runs:>13.1f}{stats['max_queries']:>6}"
+              f"{stats['seconds'] / runs * 1000:>9.1f}{stats['n_plus_one_runs']:>10}")
+
+    failures = check(data, max_queries, args.allow_n_plus_one)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Query trace checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Reconcile Stripe subscriptions with users.subscription_tier / tier_expires_at.
+
+Pages through every Stripe subscription, works out the tier each user should
+have (their best active subscription), then pages through paying users in the
+database and corrects any drift in batched upserts. Only one Stripe page and
+one users page are held in memory at a time; the tier/expiry entry per Stripe
+customer is kept in a temporary SQLite file keyed by user_id, so memory stays
+flat however many customers there are.
+
+Nothing is written if an active subscription's price is neither
+STRIPE_PRICE_ID nor STRIPE_COACH_PRICE_ID: with a wrong or missing coach price
+every Coach subscriber would otherwise be downgraded to Basic.
+
+Usage:
+    python reconcile_subscriptions.py --dry-run            # report only
+    python reconcile_subscriptions.py                      # apply corrections
+    python reconcile_subscriptions.py --downgrade-unmatched --report drift.jsonl
+    python reconcile_subscriptions.py --allow-unknown-prices   # treat other prices as Basic
+
+Paid users with no Stripe subscription at all (e.g. upgraded by hand with
+fix_coach_tier.py) are only reported unless --downgrade-unmatched is given.
+Run it against mock_stripe_server.py by setting STRIPE_API_BASE, with
+STRIPE_PRICE_ID=price_mock_basic and STRIPE_COACH_PRICE_ID=price_mock_coach.
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+import stripe
+from services import STRIPE_PRICE_ID, STRIPE_COACH_PRICE_ID, supabase
+
+ACTIVE_STATUSES = {'active', 'trialing', 'past_due'}  # Same as stripe_webhook.py
+TIER_RANK = {'free': 0, 'basic': 1, 'coach': 2}
+EXPIRY_TOLERANCE = 60  # Seconds of tier_expires_at difference that isn't worth a write
+
+# Kinds of drift, in report order
+UPGRADE = 'upgrade'  # Paying in Stripe, free in the database
+DOWNGRADE = 'downgrade'  # Only canceled subscriptions in Stripe, paid in the database
+TIER = 'tier'  # Paying for a different tier than recorded, or is_premium out of step
+EXPIRY = 'expiry'  # Right tier, stale expiry
+UNMATCHED = 'unmatched'  # Paid in the database, unknown to Stripe
+UNKNOWN_USER = 'unknown_user'  # Stripe subscription for a user missing from the database
+
+
+def tier_for_price(price_id):
+    return 'coach' if price_id and price_id == STRIPE_COACH_PRICE_ID else 'basic'
+
+
+def iter_subscription_pages(page_size):
+    """Every Stripe subscription, one page at a time"""
+    params = {'status': 'all', 'limit': page_size}
+    while True:
+        page = stripe.Subscription.list(**params)
+        subscriptions = [sub.to_dict() for sub in page.data]
+        if subscriptions:
+            yield subscriptions
+        if not page.has_more or not subscriptions:
+            return
+        params['starting_after'] = subscriptions[-1]['id']
+
+
+def users_for_subscriptions(subscription_ids):
+    """Telegram user ids of subscriptions recorded in subscription_history"""
+    if not subscription_ids:
+        return {}
+    result = supabase.table('subscription_history')\
+        .select("user_id, stripe_subscription_id")\
+        .in_('stripe_subscription_id', subscription_ids)\
+        .execute()
+    return {row['stripe_subscription_id']: row['user_id'] for row in result.data}
+
+
+def subscription_price(sub):
+    items = (sub.get('items') or {}).get('data') or []
+    return items[0]['price']['id'] if items else None
+
+
+def subscription_entitlement(sub):
+    """(tier, expires_at epoch) a subscription grants, tier 'free' if it's over"""
+    items = (sub.get('items') or {}).get('data') or []
+    price_id = subscription_price(sub)
+    period_end = sub.get('current_period_end') or (items[0].get('current_period_end') if items else None)
+    if sub.get('status') not in ACTIVE_STATUSES:
+        return 'free', None
+    return tier_for_price(price_id), period_end
+
+
+class ExpectedTiers:
+    """user_id -> (tier, expires_at) according to Stripe, spilled to a temporary SQLite file"""
+
+    def __init__(self):
+        self.conn = sqlite3.connect('')  # Private temporary database, deleted on close
+        self.conn.execute(
+            "CREATE TABLE expected (user_id TEXT PRIMARY KEY, tier TEXT NOT NULL, rank INTEGER NOT NULL, expires_at REAL)"
+        )
+
+    def add(self, entries):
+        """Merge (user_id, (tier, expires_at)) pairs, keeping each user's best entitlement"""
+        # Higher tier wins, then the later expiry
+        self.conn.executemany("""
+            INSERT INTO expected (user_id, tier, rank, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET tier = excluded.tier, rank = excluded.rank, expires_at = excluded.expires_at
+            WHERE excluded.rank > expected.rank
+               OR (excluded.rank = expected.rank AND COALESCE(excluded.expires_at, 0) >= COALESCE(expected.expires_at, 0))
+        """, [(user_id, tier, TIER_RANK[tier], expires_at) for user_id, (tier, expires_at) in entries])
+
+    def pop(self, user_id):
+        row = self.conn.execute("SELECT tier, expires_at FROM expected WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM expected WHERE user_id = ?", (user_id,))
+        return row
+
+    def iter_paid_pages(self, page_size):
+        """Remaining user ids with a paid entitlement, page_size at a time in user_id order"""
+        last_user_id = ''
+        while True:
+            page = [row[0] for row in self.conn.execute(
+                "SELECT user_id FROM expected WHERE tier != 'free' AND user_id > ? ORDER BY user_id LIMIT ?",
+                (last_user_id, page_size)
+            )]
+            if not page:
+                return
+            yield page
+            last_user_id = page[-1]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM expected").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def collect_expected(page_size, stats):
+    """ExpectedTiers for every Stripe customer linked to a user"""
+    expected = ExpectedTiers()
+    configured_prices = {STRIPE_PRICE_ID, STRIPE_COACH_PRICE_ID} - {None}
+    for page in iter_subscription_pages(page_size):
+        stats['stripe_pages'] += 1
+        stats['stripe_subscriptions'] += len(page)
+
+        # Older subscriptions lack metadata, look those up in one query per page
+        missing = [sub['id'] for sub in page if not (sub.get('metadata') or {}).get('telegram_user_id')]
+        known = users_for_subscriptions(missing)
+
+        entries = []
+        for sub in page:
+            if sub.get('status') in ACTIVE_STATUSES and subscription_price(sub) not in configured_prices:
+                stats['stripe_unknown_price'] += 1
+            user_id = (sub.get('metadata') or {}).get('telegram_user_id') or known.get(sub['id'])
+            if not user_id:
+                stats['stripe_unlinked'] += 1
+                continue
+            entries.append((user_id, subscription_entitlement(sub)))
+        expected.add(entries)
+    return expected
+
+
+def iter_paid_user_pages(page_size):
+    """Users the database treats as paying, ordered by user_id (keyset paging)"""
+    last_user_id = ''
+    while True:
+        result = supabase.table('users')\
+            .select("user_id, is_premium, subscription_tier, tier_expires_at")\
+            .or_('is_premium.eq.true,subscription_tier.neq.free')\
+            .gt('user_id', last_user_id)\
+            .order('user_id')\
+            .limit(page_size)\
+            .execute()
+        if not result.data:
+            return
+        yield result.data
+        last_user_id = result.data[-1]['user_id']
+
+
+def iter_user_pages(user_ids, page_size):
+    """Rows for specific users, page_size ids per query"""
+    for i in range(0, len(user_ids), page_size):
+        chunk = user_ids[i:i + page_size]
+        result = supabase.table('users')\
+            .select("user_id, is_premium, subscription_tier, tier_expires_at")\
+            .in_('user_id', chunk)\
+            .execute()
+        yield chunk, result.data
+
+
+def parse_expiry(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if not parsed.tzinfo:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def diff_user(row, want):
+    """(kind, correction) for a user row against what Stripe says, or None if in sync"""
+    current_tier = row.get('subscription_tier') or 'free'
+    current_expiry = parse_expiry(row.get('tier_expires_at'))
+
+    if want is None:
+        if current_tier == 'free' and not row.get('is_premium'):
+            return None
+        kind, tier, expires_at = UNMATCHED, 'free', None
+    else:
+        tier, expires_at = want
+        if tier == current_tier:
+            if tier == 'free' and not row.get('is_premium'):
+                return None
+            stale = (expires_at is None) != (current_expiry is None) or \
+                (expires_at and abs(expires_at - current_expiry) > EXPIRY_TOLERANCE)
+            if tier != 'free' and bool(row.get('is_premium')) and not stale:
+                return None
+            kind = DOWNGRADE if tier == 'free' else EXPIRY if stale else TIER
+        elif current_tier == 'free':
+            kind = UPGRADE
+        elif tier == 'free':
+            kind = DOWNGRADE
+        else:
+            kind = TIER
+
+    return kind, {
+        'user_id': row['user_id'],
+        'is_premium': tier != 'free',
+        'subscription_tier': tier,
+        'tier_expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat() if expires_at else None
+    }
+
+
+class Reconciler:
+    def __init__(self, args):
+        self.args = args
+        self.pending = []
+        self.stats = {
+            'stripe_pages': 0, 'stripe_subscriptions': 0, 'stripe_unlinked': 0, 'stripe_unknown_price': 0,
+            'users_checked': 0, 'corrections_written': 0, 'write_batches': 0
+        }
+        self.drift = {kind: 0 for kind in (UPGRADE, DOWNGRADE, TIER, EXPIRY, UNMATCHED, UNKNOWN_USER)}
+        self.examples = []
+        self.report = open(args.report, 'w') if args.report else None
+
+    def record(self, kind, row, correction):
+        self.drift[kind] += 1
+        entry = {
+            'kind': kind,
+            'user_id': correction['user_id'],
+            'database': {key: row.get(key) for key in ('is_premium', 'subscription_tier', 'tier_expires_at')} if row else None,
+            'stripe': {key: correction[key] for key in ('subscription_tier', 'tier_expires_at')}
+        }
+        if len(self.examples) < self.args.show:
+            self.examples.append(entry)
+        if self.report:
+            self.report.write(json.dumps(entry) + '\n')
+
+        if kind == UNKNOWN_USER or (kind == UNMATCHED and not self.args.downgrade_unmatched):
+            return
+        self.pending.append(correction)
+        if len(self.pending) >= self.args.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if not self.args.dry_run:
+            # Every row already exists, so the upsert only updates these columns
+            supabase.table('users').upsert(self.pending, on_conflict='user_id').execute()
+            self.stats['corrections_written'] += len(self.pending)
+            self.stats['write_batches'] += 1
+        self.pending = []
+
+    def check(self, row, expected):
+        self.stats['users_checked'] += 1
+        drift = diff_user(row, expected.pop(row['user_id']))
+        if drift:
+            self.record(drift[0], row, drift[1])
+
+    def run(self):
+        started = time.monotonic()
+        expected = collect_expected(self.args.page_size, self.stats)
+        print(f"💳 Read {self.stats['stripe_subscriptions']} Stripe subscriptions for {len(expected)} users")
+        unknown_prices = self.stats['stripe_unknown_price']
+        if unknown_prices and not self.args.dry_run and not self.args.allow_unknown_prices:
+            expected.close()
+            raise SystemExit(
+                f"❌ {unknown_prices} active subscriptions use a price that is neither STRIPE_PRICE_ID nor "
+                f"STRIPE_COACH_PRICE_ID, nothing written. Check both are set (--dry-run shows the drift), "
+                f"or pass --allow-unknown-prices to treat them as Basic."
+            )
+
+        # Everyone the database thinks is paying
+        for page in iter_paid_user_pages(self.args.db_page_size):
+            for row in page:
+                self.check(row, expected)
+
+        # Stripe customers the database has down as free, or doesn't know at all
+        for page in expected.iter_paid_pages(self.args.db_page_size):
+            for chunk, rows in iter_user_pages(page, self.args.db_page_size):
+                for row in rows:
+                    self.check(row, expected)
+                for user_id in chunk:
+                    want = expected.pop(user_id)
+                    if want:
+                        tier, expires_at = want
+                        self.record(UNKNOWN_USER, None, {
+                            'user_id': user_id,
+                            'subscription_tier': tier,
+                            'tier_expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat() if expires_at else None
+                        })
+
+        self.flush()
+        expected.close()
+        if self.report:
+            self.report.close()
+        self.print_report(time.monotonic() - started)
+
+    def print_report(self, elapsed):
+        mode = "DRY RUN - nothing written" if self.args.dry_run else "applied"
+        print(f"\n📊 Reconciliation report ({mode}, {elapsed:.1f}s)")
+        print("-" * 50)
+        for key, value in self.stats.items():
+            print(f"{key:<24}{value:>10}")
+        print("-" * 50)
+        for kind, count in self.drift.items():
+            note = ""
+            if kind == UNMATCHED and count and not self.args.downgrade_unmatched:
+                note = "  (not corrected, use --downgrade-unmatched)"
+            elif kind == UNKNOWN_USER and count:
+                note = "  (not corrected)"
+            print(f"{kind:<24}{count:>10}{note}")
+        if self.examples:
+            print(f"\nFirst {len(self.examples)} differences:")
+            for entry in self.examples:
+                print(f"  {entry['kind']:<13} user {entry['user_id']}: database {entry['database']} -> stripe {entry['stripe']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile Stripe subscriptions with user tiers")
+    parser.add_argument('--dry-run', action='store_true', help="Report drift without writing")
+    parser.add_argument('--downgrade-unmatched', action='store_true',
+                        help="Also downgrade paid users with no Stripe subscription")
+    parser.add_argument('--allow-unknown-prices', action='store_true',
+                        help="Apply corrections even if some active subscriptions use an unconfigured price (as Basic)")
+    parser.add_argument('--page-size', type=int, default=100, help="Stripe subscriptions per request (max 100)")
+    parser.add_argument('--db-page-size', type=int, default=500, help="Users per database query")
+    parser.add_argument('--batch-size', type=int, default=500, help="Corrections per write")
+    parser.add_argument('--show', type=int, default=20, help="Differences to print")
+    parser.add_argument('--report', help="Write every difference to this JSONL file")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    Reconciler(parse_args()).run()
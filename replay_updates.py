@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Load test the webhook server by replaying captured Telegram traffic.
+
+Replays a capture from update_capture.py (UPDATE_CAPTURE_PATH) against
+server.py at increasing speed-ups, each for a fixed time, looping over the
+capture when it is shorter. By default the server is started here against the
+local stand-ins from bench_handlers.py (Supabase, Telegram, OpenAI, Stripe);
+with --url it targets a server that is already running, e.g. one deployed on
+the instance size being sized, with its backends pointed at the mocks.
+
+For each step it reports the offered rate, the rate updates were handled
+at, webhook acknowledgement latency, queueing delay (receipt until the
+handlers start, from /metrics), updates dropped by flood control (answered but
+deliberately not handled), and webhook, handler and Bot API errors. The
+first step where the server falls behind the offered rate, drops updates or
+queueing delay exceeds --max-queue-delay is reported as the saturation point.
+The server started here runs with FLOOD_CONTROL=0, so the replay measures the
+handlers rather than the per-user limits; against --url, updates throttled by
+flood control count as falling behind.
+
+Usage:
+    UPDATE_CAPTURE_PATH=updates.jsonl python server.py   # capture for a while
+    python replay_updates.py updates.jsonl --speedups 1 5 10 25 50 --step-seconds 30
+    python replay_updates.py updates.jsonl --url http://10.0.0.5:8443 --token <bot token> --metrics-token <token>
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+import httpx
+from bench_handlers import start_mocks, free_port, wait_for_port, percentile, BOT_TOKEN
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_capture(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        raise SystemExit(f"No updates in {path}")
+    records.sort(key=lambda record: record['t'])
+    start = records[0]['t']
+    return [(record['t'] - start, record['update']) for record in records]
+
+
+def remap_users(value, users, first_user_id):
+    """Point captured pseudonyms at users that exist in the mock population"""
+    if isinstance(value, list):
+        return [remap_users(item, users, first_user_id) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {key: remap_users(item, users, first_user_id) for key, item in value.items()}
+    is_user = result.get('is_bot') is False or result.get('type') == 'private'  # A User, or their private chat
+    if is_user and isinstance(result.get('id'), int):
+        result['id'] = first_user_id + result['id'] % users
+    return result
+
+
+def parse_metrics(text):
+    """{(name, frozenset of labels): value} from the Prometheus text format"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        pairs = frozenset(tuple(item.split('=', 1)) for item in labels.rstrip('}').split('",') if item)
+        samples[(name, frozenset((key, val.strip('"')) for key, val in pairs))] = float(value)
+    return samples
+
+
+def metric_delta(before, after, name, **match):
+    """Sum of a metric's growth between two scrapes, over series whose labels match"""
+    total = 0.0
+    for (series, labels), value in after.items():
+        if series != name:
+            continue
+        labels = dict(labels)
+        if all(labels.get(key) == val for key, val in match.items()):
+            total += value - before.get((series, frozenset(labels.items())), 0.0)
+    return total
+
+
+def histogram_quantile(before, after, name, q):
+    """Upper bound of the bucket holding quantile q of the observations between two scrapes"""
+    buckets = []
+    for (series, labels), value in after.items():
+        if series == f'{name}_bucket':
+            le = dict(labels)['le']
+            buckets.append((float('inf') if le == '+Inf' else float(le), value - before.get((series, labels), 0.0)))
+    buckets.sort()
+    if not buckets or not buckets[-1][1]:
+        return None
+    for bound, count in buckets:
+        if count >= q * buckets[-1][1]:
+            return bound
+    return buckets[-1][0]
+
+
+class Replayer:
+    def __init__(self, args, records, base_url, token, secret):
+        self.args = args
+        self.records = records
+        self.webhook_url = f"{base_url}/{token}"
+        self.metrics_url = f"{base_url}/metrics"
+        self.headers = {'Content-Type': 'application/json'}
+        if secret:
+            self.headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+        self.metrics_headers = {'Authorization': f'Bearer {args.metrics_token}'} if args.metrics_token else {}
+        self.update_id = 0
+        # Gap after the last update before the capture repeats, the capture's mean gap
+        self.span = records[-1][0] + (records[-1][0] / max(len(records) - 1, 1) or 0.1)
+
+    async def scrape(self, client):
+        response = await client.get(self.metrics_url, headers=self.metrics_headers)
+        response.raise_for_status()
+        return parse_metrics(response.text)
+
+    def schedule(self, speedup, seconds):
+        """(send offset, payload) pairs for one step, looping over the capture"""
+        loop = 0
+        while True:
+            for offset, update in self.records:
+                due = (loop * self.span + offset) / speedup
+                if due >= seconds:
+                    return
+                self.update_id += 1
+                payload = dict(update, update_id=self.update_id)
+                if self.args.users:
+                    payload = remap_users(payload, self.args.users, self.args.first_user_id)
+                yield due, payload
+            loop += 1
+
+    async def run_step(self, client, speedup):
+        args = self.args
+        acks, failures = [], []
+
+        async def post(payload):
+            started = time.perf_counter()
+            try:
+                response = await client.post(self.webhook_url, content=json.dumps(payload), headers=self.headers)
+                if response.status_code == 200:
+                    acks.append(time.perf_counter() - started)
+                else:
+                    failures.append(str(response.status_code))
+            except httpx.HTTPError as e:
+                failures.append(type(e).__name__)
+
+        before = await self.scrape(client)
+        started = time.perf_counter()
+        tasks = []
+        lag = 0.0
+        for due, payload in self.schedule(speedup, args.step_seconds):
+            delay = started + due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+            tasks.append(asyncio.create_task(post(payload)))
+        await asyncio.gather(*tasks)
+        sent_seconds = time.perf_counter() - started
+
+        # Wait for the backlog to drain, so handled counts every update of this step
+        deadline = time.perf_counter() + args.drain_timeout
+        while True:
+            after = await self.scrape(client)
+            handled = metric_delta(before, after, 'bot_update_seconds_count')
+            # Acked but dropped by flood control; backlog rejections were answered with 503 and are failures
+            throttled = metric_delta(before, after, 'bot_flood_rejected_total') \
+                - metric_delta(before, after, 'bot_flood_rejected_total', reason='backlog')
+            if handled >= len(acks) - throttled or time.perf_counter() > deadline:
+                break
+            await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+
+        sent = len(tasks)
+        return {
+            'speedup': speedup,
+            'sent': sent,
+            'offered_per_s': sent / args.step_seconds,
+            'handled_per_s': handled / elapsed,
+            'drain_s': elapsed - sent_seconds,
+            'ack_p95_ms': percentile(acks, 95) * 1000 if acks else None,
+            'queue_p50_s': histogram_quantile(before, after, 'bot_update_queue_seconds', 0.5),
+            'queue_p95_s': histogram_quantile(before, after, 'bot_update_queue_seconds', 0.95),
+            'queue_p99_s': histogram_quantile(before, after, 'bot_update_queue_seconds', 0.99),
+            'webhook_errors': len(failures),
+            'throttled': throttled,
+            'unhandled': max(len(acks) - throttled - handled, 0),
+            'handler_errors': metric_delta(before, after, 'bot_handler_errors_total'),
+            'db_errors': metric_delta(before, after, 'bot_db_queries_total', outcome='error'),
+            'bot_api_errors': metric_delta(before, after, 'bot_telegram_requests_total')
+                              - metric_delta(before, after, 'bot_telegram_requests_total', outcome='ok'),
+            'send_lag_s': lag,
+        }
+
+
+def saturated(result, args):
+    queue_p95 = result['queue_p95_s']
+    return (result['handled_per_s'] < result['offered_per_s'] * args.min_handled_ratio
+            or result['throttled'] > 0
+            or result['unhandled'] > 0
+            or result['webhook_errors'] > 0
+            or (queue_p95 is not None and queue_p95 > args.max_queue_delay))
+
+
+def start_server(args, env):
+    """server.py on a free port against the mocks, returns (process, base url, secret)"""
+    port = free_port()
+    secret = secrets.token_hex(16)
+    server_env = dict(os.environ, **env, PORT=str(port), REMINDER_SCHEDULER='0', TELEGRAM_WEBHOOK_SECRET=secret,
+                      RENDER_EXTERNAL_URL=f'http://127.0.0.1:{port}', QUERY_TRACE='0', FLOOD_CONTROL='0')
+    output = None if args.verbose else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, 'server.py')], env=server_env, stdout=output)
+    wait_for_port(port, process)
+    return process, f'http://127.0.0.1:{port}', secret
+
+
+def fmt(value, scale=1, digits=0):
+    if value is None:
+        return '-'
+    return '+Inf' if value == float('inf') else f"{value * scale:.{digits}f}"
+
+
+async def replay(args, records, base_url, token, secret):
+    replayer = Replayer(args, records, base_url, token, secret)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    results = []
+    print(f"\n{'speedup':>8}{'sent':>8}{'offered/s':>11}{'handled/s':>11}{'ack p95':>9}{'queue p50':>11}"
+          f"{'p95':>8}{'p99':>8}{'drain s':>9}{'throttled':>11}{'errors':>8}")
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        for speedup in args.speedups:
+            result = await replayer.run_step(client, speedup)
+            results.append(result)
+            errors = result['webhook_errors'] + result['handler_errors'] + result['bot_api_errors'] + result['db_errors']
+            print(f"{speedup:>8g}{result['sent']:>8}{result['offered_per_s']:>11.1f}{result['handled_per_s']:>11.1f}"
+                  f"{fmt(result['ack_p95_ms'], 1, 1):>9}{fmt(result['queue_p50_s'], 1000):>11}"
+                  f"{fmt(result['queue_p95_s'], 1000):>8}{fmt(result['queue_p99_s'], 1000):>8}"
+                  f"{result['drain_s']:>9.1f}{int(result['throttled']):>11}{int(errors):>8}")
+            if result['send_lag_s'] > 1:
+                print(f"   ⚠️ The replayer fell {result['send_lag_s']:.1f}s behind schedule, offered rate is a ceiling")
+            if saturated(result, args):
+                print(f"\n🚧 Saturated at {speedup:g}× ({result['offered_per_s']:.1f} updates/s offered, "
+                      f"{result['handled_per_s']:.1f}/s handled, {int(result['throttled'])} throttled)")
+                if not args.keep_going:
+                    break
+        else:
+            print(f"\n✅ Kept up with every step, up to {results[-1]['offered_per_s']:.1f} updates/s")
+    print("queue = webhook receipt until handlers start, in ms (bucket upper bounds); "
+          "errors = webhook, handler, Supabase and Bot API errors")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured updates against the webhook server")
+    parser.add_argument('capture', help="JSONL written via UPDATE_CAPTURE_PATH")
+    parser.add_argument('--speedups', type=float, nargs='+', default=[1, 2, 5, 10, 20, 50])
+    parser.add_argument('--step-seconds', type=float, default=20, help="Time spent sending at each speed-up")
+    parser.add_argument('--drain-timeout', type=float, default=60, help="Longest wait for the backlog after a step")
+    parser.add_argument('--max-queue-delay', type=float, default=1.0, help="p95 queueing delay (s) that counts as saturated")
+    parser.add_argument('--min-handled-ratio', type=float, default=0.9,
+                        help="Handled rate below this share of the offered rate is saturated")
+    parser.add_argument('--keep-going', action='store_true', help="Run every step even after saturation")
+    parser.add_argument('--connections', type=int, default=100, help="Concurrent webhook connections")
+    parser.add_argument('--timeout', type=float, default=30, help="Webhook request timeout (s)")
+    parser.add_argument('--url', help="Running server to target instead of starting one with local mocks")
+    parser.add_argument('--token', default=BOT_TOKEN, help="Bot token in the webhook path (with --url)")
+    parser.add_argument('--secret', help="TELEGRAM_WEBHOOK_SECRET of the target server (with --url)")
+    parser.add_argument('--metrics-token', help="METRICS_TOKEN of the target server, when it isn't local")
+    parser.add_argument('--users', type=int, default=None,
+                        help="Map captured users onto this many mock users (default: the mock population when started here)")
+    parser.add_argument('--first-user-id', type=int, default=100000)
+    parser.add_argument('--db-latency-ms', type=float, default=10)
+    parser.add_argument('--telegram-latency-ms', type=float, default=30)
+    parser.add_argument('--openai-latency-ms', type=float, default=500)
+    parser.add_argument('--stripe-latency-ms', type=float, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Write the step results here")
+    parser.add_argument('--verbose', action='store_true', help="Show the server's output")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)
+    print(f"📼 {len(records)} updates over {records[-1][0]:.0f}s in {args.capture}")
+
+    processes = []
+    try:
+        if args.url:
+            base_url, token, secret = args.url.rstrip('/'), args.token, args.secret
+            args.users = args.users or 0
+        else:
+            args.users = args.users or 1000
+            processes, env = start_mocks(args)
+            server, base_url, secret = start_server(args, env)
+            processes.append(server)
+            token = BOT_TOKEN
+            print(f"🤖 server.py on {base_url} with local mocks, {args.users} users")
+        results = asyncio.run(replay(args, records, base_url, token, secret))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'steps': results}, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,17 @@
 #!/usr/bin/env python3
 """
-Reminder sender script - Run this as a cron job every hour
-Can be scheduled on Render/Railway or run via Supabase Edge Functions
+Reminder sender - server.py runs this every hour on its own event loop
+Can also be run standalone as an hourly cron job (set REMINDER_SCHEDULER=0 on the server then)
 """
 
-import os
 import asyncio
-from datetime import datetime, time
-from dotenv import load_dotenv
+from datetime import datetime, timedelta
 from telegram import Bot
-from supabase import create_client, Client
 import pytz
+from services import TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL, supabase, run_query
+from day_bounds import local_now, day_bounds, local_date_of
 
-load_dotenv()
-
-# Environment variables
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-
-# Initialize services
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-
-async def send_reminders():
+async def send_reminders(bot):
     """Send reminders to users based on their schedules"""
     try:
         now = datetime.now(pytz.utc)
@@ -31,11 +19,11 @@ async def send_reminders():
         
         print(f"Running reminder check at {now} for {current_weekday}")
         
-        # Get all active habit schedules for today
-        schedules = supabase.table('habit_schedules')\
+        # It's yesterday or tomorrow somewhere, so fetch all three and check each user's own weekday
+        nearby_weekdays = [(now + timedelta(days=offset)).strftime('%a') for offset in (-1, 0, 1)]
+        schedules = await run_query(supabase.table('habit_schedules')\
             .select("*, habits(name, is_active), users(timezone)")\
-            .contains('days', [current_weekday])\
-            .execute()
+            .overlaps('days', nearby_weekdays))
         
         for schedule in schedules.data:
             try:
@@ -43,21 +31,23 @@ async def send_reminders():
                 if not schedule['habits']['is_active']:
                     continue
                 
+                # Get user timezone
+                tz_name = schedule['users']['timezone']
+                local_time = local_now(tz_name, now)
+                today = local_time.date()
+                if local_time.strftime('%a') not in schedule['days']:
+                    continue
+                
                 # Check if in pause period
-                pause_check = supabase.table('habit_pauses')\
+                pause_check = await run_query(supabase.table('habit_pauses')\
                     .select("id")\
                     .eq('habit_id', schedule['habit_id'])\
-                    .lte('start_date', now.date().isoformat())\
-                    .gte('end_date', now.date().isoformat())\
-                    .execute()
+                    .lte('start_date', today.isoformat())\
+                    .gte('end_date', today.isoformat()))
                 
                 if pause_check.data:
                     continue
                 
-                # Get user timezone
-                user_tz = pytz.timezone(schedule['users']['timezone'] or 'UTC')
-                local_time = now.astimezone(user_tz)
-                
                 # Check if it's time for main reminder
                 reminder_time = datetime.strptime(schedule['reminder_time'], '%H:%M:%S').time()
                 current_hour = local_time.hour
@@ -67,10 +57,8 @@ async def send_reminders():
                 if current_hour == reminder_hour:
                     # Check if already sent today
                     last_sent = schedule.get('last_sent_at')
-                    if last_sent:
-                        last_sent_date = datetime.fromisoformat(last_sent).date()
-                        if last_sent_date == now.date():
-                            continue
+                    if last_sent and local_date_of(last_sent, tz_name) == today:
+                        continue
                     
                     # Send reminder
                     habit_name = schedule['habits']['name']
@@ -85,10 +73,9 @@ async def send_reminders():
                     )
                     
                     # Update last sent
-                    supabase.table('habit_schedules')\
+                    await run_query(supabase.table('habit_schedules')\
                         .update({'last_sent_at': now.isoformat()})\
-                        .eq('id', schedule['id'])\
-                        .execute()
+                        .eq('id', schedule['id']))
                     
                     print(f"Sent reminder to {schedule['user_id']} for {habit_name}")
                 
@@ -98,13 +85,14 @@ async def send_reminders():
                     fallback_hour = fallback_time.hour
                     
                     if current_hour == fallback_hour:
-                        # Check if habit was completed today
-                        today_start = datetime.combine(now.date(), time.min)
-                        completion_check = supabase.table('habit_logs')\
+                        # Check if habit was completed during the user's day
+                        today_start, today_end = day_bounds(tz_name, today)
+                        completion_check = await run_query(supabase.table('habit_logs')\
                             .select("id")\
                             .eq('habit_id', schedule['habit_id'])\
-                            .gte('completed_at', today_start.isoformat())\
-                            .execute()
+                            .gte('completed_at', today_start)\
+                            .lt('completed_at', today_end)\
+                            .limit(1))
                         
                         if not completion_check.data:
                             # Send fallback reminder
@@ -128,46 +116,39 @@ async def send_reminders():
     except Exception as e:
         print(f"Error in send_reminders: {e}")
 
-async def send_free_user_reminders():
+async def send_free_user_reminders(bot):
     """Send default 8 PM reminders to free users"""
     try:
         now = datetime.now(pytz.utc)
         
         # Get all free users
-        free_users = supabase.table('users')\
+        free_users = await run_query(supabase.table('users')\
             .select("user_id, timezone")\
             .eq('subscription_tier', 'free')\
-            .eq('reminder_enabled', True)\
-            .execute()
+            .eq('reminder_enabled', True))
         
         for user in free_users.data:
             try:
                 # Check if it's 8 PM in their timezone
-                user_tz = pytz.timezone(user['timezone'] or 'UTC')
-                local_time = now.astimezone(user_tz)
+                local_time = local_now(user['timezone'], now)
                 
                 if local_time.hour == 20:  # 8 PM
                     # Get user's active habits
-                    habits = supabase.table('habits')\
+                    habits = await run_query(supabase.table('habits')\
                         .select("id, name")\
                         .eq('user_id', user['user_id'])\
-                        .eq('is_active', True)\
-                        .execute()
+                        .eq('is_active', True))
                     
                     if habits.data:
-                        # Check which habits haven't been completed today
-                        today_start = datetime.combine(now.date(), time.min)
-                        incomplete_habits = []
-                        
-                        for habit in habits.data:
-                            completion_check = supabase.table('habit_logs')\
-                                .select("id")\
-                                .eq('habit_id', habit['id'])\
-                                .gte('completed_at', today_start.isoformat())\
-                                .execute()
-                            
-                            if not completion_check.data:
-                                incomplete_habits.append(habit['name'])
+                        # Check which habits haven't been completed during the user's day
+                        today_start, today_end = day_bounds(user['timezone'], local_time.date())
+                        completion_check = await run_query(supabase.table('habit_logs')\
+                            .select("habit_id")\
+                            .in_('habit_id', [habit['id'] for habit in habits.data])\
+                            .gte('completed_at', today_start)\
+                            .lt('completed_at', today_end))
+                        done = {row['habit_id'] for row in completion_check.data}
+                        incomplete_habits = [habit['name'] for habit in habits.data if habit['id'] not in done]
                         
                         if incomplete_habits:
                             message = f"🔔 **Daily Reminder** (8 PM)\\n\\n"
@@ -191,12 +172,17 @@ async def send_free_user_reminders():
     except Exception as e:
         print(f"Error in send_free_user_reminders: {e}")
 
-async def main():
-    """Main function to run both reminder types"""
+async def run_reminders(bot):
+    """Run both reminder types"""
     await asyncio.gather(
-        send_reminders(),
-        send_free_user_reminders()
+        send_reminders(bot),
+        send_free_user_reminders(bot)
     )
 
+async def main():
+    """Standalone run for cron"""
+    async with Bot(token=TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_BASE_URL) as bot:
+        await run_reminders(bot)
+
 if __name__ == '__main__':
     asyncio.run(main())
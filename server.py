@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Single process serving the whole bot on one event loop:
+- POST /<bot token>     Telegram webhook, fed into the bot's update queue
+- POST /stripe-webhook  Stripe events, stored and applied by a background worker (stripe_webhook.py)
+- GET /healthz          Liveness check
+- GET /metrics          Handler metrics for Prometheus, from localhost or with METRICS_TOKEN
+- Hourly reminders (send_reminders.py), unless REMINDER_SCHEDULER=0
+- Anonymized capture of webhook updates when UPDATE_CAPTURE_PATH is set (update_capture.py)
+- Per-user rate limits and a backlog cap on webhook updates (flood_control.py)
+
+All parts share the Supabase client from services.py and the bot's HTTP
+connection pool. Startup brings the bot up before accepting requests, and
+SIGTERM/SIGINT shut down in reverse so queued updates and state are flushed.
+
+Usage:
+    python server.py
+"""
+
+import os
+import hmac
+import json
+import signal
+import asyncio
+from datetime import datetime, timedelta
+import tornado.web
+from telegram import Update
+from metrics import render as render_metrics, track_handler, update_received
+from services import TELEGRAM_BOT_TOKEN
+from habit_bot import build_application
+from send_reminders import run_reminders
+from stripe_webhook import StripeWebhookHandler, StripeEventWorker
+from update_capture import build_capture
+from flood_control import admit
+
+# Get the port from environment variable (Render provides this)
+PORT = int(os.environ.get('PORT', 8443))
+
+# Your Render app URL
+RENDER_APP_URL = os.environ.get('RENDER_EXTERNAL_URL') or 'https://telegram-habit-tracker-12qk.onrender.com'
+
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')  # Optional, checked on every webhook call
+REMINDER_SCHEDULER = os.getenv('REMINDER_SCHEDULER', '1') != '0'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # Optional bearer token for scraping /metrics from outside the host
+REMINDER_OFFSET = 30  # Seconds past the hour to run reminders
+SHUTDOWN_GRACE = 20  # Seconds to let running reminder and Stripe work finish on shutdown
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_app, capture=None):
+        self.bot_app = bot_app
+        self.capture = capture
+
+    async def post(self):
+        if TELEGRAM_WEBHOOK_SECRET and \
+                self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != TELEGRAM_WEBHOOK_SECRET:
+            self.set_status(403)
+            return
+
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+
+        if self.capture:
+            self.capture.write(data)
+
+        # Decoded before admit(), which counts the update as in flight until a handler releases it
+        try:
+            update = Update.de_json(data, self.bot_app.bot)
+        except Exception as e:
+            print(f"Error decoding webhook update: {e}")
+            self.set_status(400)
+            return
+
+        # Floods are answered here, before the update costs any queries
+        rejection = admit(data)
+        if rejection:
+            self.set_status(rejection.status)
+            if rejection.reply:
+                self.write(rejection.reply)
+            return
+
+        # Acknowledge right away, handlers run from the queue
+        update_received(data.get('update_id'))
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write({'status': 'ok'})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        # The port is public on Render, so only local scrapes (or ones with the token) are served
+        local = self.request.remote_ip in ('127.0.0.1', '::1')
+        authorized = METRICS_TOKEN and hmac.compare_digest(
+            self.request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+        if not (local or authorized):
+            self.set_status(403)
+            return
+
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(render_metrics())
+
+
+async def reminder_scheduler(bot, stopping):
+    """Run the reminder job shortly after every full hour until stopping is set"""
+    while not stopping.is_set():
+        now = datetime.now()
+        next_run = now.replace(minute=0, second=REMINDER_OFFSET, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(hours=1)
+
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=(next_run - now).total_seconds())
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            with track_handler('reminders'):
+                await run_reminders(bot)
+        except Exception as e:
+            print(f"Error running reminders: {e}")
+
+
+async def serve():
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    # Bot first: restores persisted state and fetches the bot's identity
+    bot_app = build_application()
+    await bot_app.initialize()
+    http_server = None
+    scheduler = None
+    stripe_worker = StripeEventWorker()
+    stripe_worker_task = None
+    capture = build_capture()
+    try:
+        await bot_app.start()
+
+        # Apply any Stripe events stored before a restart
+        stripe_worker_task = asyncio.create_task(stripe_worker.run(stopping))
+
+        web_app = tornado.web.Application([
+            (f'/{TELEGRAM_BOT_TOKEN}', TelegramWebhookHandler, {'bot_app': bot_app, 'capture': capture}),
+            ('/stripe-webhook', StripeWebhookHandler, {'worker': stripe_worker}),
+            ('/healthz', HealthHandler),
+            ('/metrics', MetricsHandler),
+        ])
+        http_server = web_app.listen(PORT, address='0.0.0.0')
+
+        await bot_app.bot.set_webhook(
+            url=f"{RENDER_APP_URL}/{TELEGRAM_BOT_TOKEN}",
+            allowed_updates=Update.ALL_TYPES,
+            secret_token=TELEGRAM_WEBHOOK_SECRET
+        )
+
+        if REMINDER_SCHEDULER:
+            scheduler = asyncio.create_task(reminder_scheduler(bot_app.bot, stopping))
+
+        print(f"🤖 Server is running on port {PORT}")
+        await stopping.wait()
+    finally:
+        print("🛑 Shutting down...")
+        stopping.set()
+
+        # Reverse order: finish reminders, stop accepting requests, finish Stripe events,
+        # drain updates, flush state
+        if scheduler:
+            try:
+                await asyncio.wait_for(scheduler, timeout=SHUTDOWN_GRACE)
+            except asyncio.TimeoutError:
+                print("Reminder run interrupted by shutdown")
+
+        if http_server:
+            http_server.stop()
+            await http_server.close_all_connections()
+
+        if stripe_worker_task:
+            try:
+                await asyncio.wait_for(stripe_worker_task, timeout=SHUTDOWN_GRACE)
+            except asyncio.TimeoutError:
+                print("Stripe event processing interrupted by shutdown, leased events will be retried")
+
+        if bot_app.running:
+            await bot_app.stop()
+        await bot_app.shutdown()
+        if capture:
+            capture.close()
+            print(f"📼 Captured {capture.count} updates")
+        print("👋 Server stopped")
+
+
+def main():
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
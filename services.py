@@ -0,0 +1,63 @@
+"""
+Configuration and clients shared by the bot, the Stripe webhook and the reminder job.
+
+Each is created once per process, so when server.py hosts all three they share
+one Supabase client (and its connection pool) and one Stripe configuration.
+"""
+
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+from supabase import create_client, Client
+import stripe
+import metrics
+import query_trace
+
+load_dotenv()
+
+# Environment variables
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_PRICE_ID = os.getenv('STRIPE_PRICE_ID')
+STRIPE_COACH_PRICE_ID = os.getenv('STRIPE_COACH_PRICE_ID')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')  # e.g. mock_stripe_server.py for offline testing
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE')  # e.g. mock_telegram_server.py for offline testing
+TELEGRAM_BASE_URL = f"{TELEGRAM_API_BASE.rstrip('/')}/bot" if TELEGRAM_API_BASE else 'https://api.telegram.org/bot'
+
+# Initialize services
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+stripe.api_key = STRIPE_SECRET_KEY
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+
+
+async def run_query(query):
+    """Execute a Supabase query in a worker thread so the event loop stays free"""
+    start = time.perf_counter()
+    ok = False
+    try:
+        result = await asyncio.to_thread(query.execute)
+        ok = True
+        return result
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.record_query(seconds, ok)
+        query_trace.record(query, seconds, ok)
+
+
+def stripe_operation(func):
+    """Metric label for a Stripe call, e.g. Session.create"""
+    owner = getattr(func, '__self__', None)
+    if isinstance(owner, type):
+        return f"{owner.__name__}.{func.__name__}"
+    return getattr(func, '__qualname__', repr(func))
+
+
+async def run_stripe(func, *args, **kwargs):
+    """Run a blocking Stripe API call in a worker thread"""
+    with metrics.track_call('stripe', stripe_operation(func)):
+        return await asyncio.to_thread(func, *args, **kwargs)
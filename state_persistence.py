@@ -0,0 +1,247 @@
+"""
+Durable storage for per-user bot state (context.user_data).
+
+Reminder drafts, pending Stripe checkout sessions and the conversation step
+live in user_data, which the Application keeps in memory. This persistence
+saves it to SQLite (default) or Postgres so a redeploy or crash doesn't lose
+it. Changed users are collected and written in one batch every
+STATE_FLUSH_INTERVAL seconds and on shutdown, never once per update.
+"""
+
+import asyncio
+import os
+import pickle
+import sqlite3
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+STATE_MAX_AGE = 14 * 24 * 3600  # Drop state for users idle this long (seconds)
+RETRY_MIN_DELAY = 1  # Seconds before retrying a failed write, doubled after each failure
+RETRY_MAX_DELAY = 60
+
+
+class SQLiteStateStore:
+    """user_data rows in a local SQLite file"""
+
+    def __init__(self, path):
+        # Only ever used from one worker thread at a time (see BatchedPersistence)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bot_user_data ("
+            "user_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def load_all(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM bot_user_data WHERE updated_at < ?", (time.time() - STATE_MAX_AGE,))
+        return self.conn.execute("SELECT user_id, data FROM bot_user_data").fetchall()
+
+    def write(self, upserts, deletes):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO bot_user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(user_id, blob, now) for user_id, blob in upserts]
+            )
+            self.conn.executemany("DELETE FROM bot_user_data WHERE user_id = ?", [(user_id,) for user_id in deletes])
+
+    def close(self):
+        self.conn.close()
+
+
+class PostgresStateStore:
+    """user_data rows in Postgres, e.g. the Supabase database itself"""
+
+    def __init__(self, dsn):
+        try:
+            import psycopg
+        except ImportError:
+            raise RuntimeError("Postgres state persistence needs psycopg: pip install 'psycopg[binary]'")
+        self.conn = psycopg.connect(dsn, autocommit=False)
+        with self.conn.transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bot_user_data ("
+                "user_id BIGINT PRIMARY KEY, data BYTEA NOT NULL, updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW())"
+            )
+
+    def load_all(self):
+        with self.conn.transaction():
+            self.conn.execute(
+                "DELETE FROM bot_user_data WHERE updated_at < NOW() - make_interval(secs => %s)", (STATE_MAX_AGE,)
+            )
+            return self.conn.execute("SELECT user_id, data FROM bot_user_data").fetchall()
+
+    def write(self, upserts, deletes):
+        with self.conn.transaction():
+            with self.conn.cursor() as cur:
+                cur.executemany(
+                    "INSERT INTO bot_user_data (user_id, data, updated_at) VALUES (%s, %s, NOW()) "
+                    "ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at",
+                    upserts
+                )
+                if deletes:
+                    cur.execute("DELETE FROM bot_user_data WHERE user_id = ANY(%s)", (deletes,))
+
+    def close(self):
+        self.conn.close()
+
+
+class BatchedPersistence(BasePersistence):
+    """Persists user_data only, batching all changed users into one write"""
+
+    def __init__(self, store, update_interval=10):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+        self._pending = {}  # user_id -> pickled data, or None to delete
+        self._written = {}  # user_id -> hash of the last stored data
+        self._write_lock = asyncio.Lock()
+        self._write_task = None
+        self._retry_delay = 0  # Backoff after failed writes, 0 once a write succeeds
+        self._closing = asyncio.Event()
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(self.store.load_all)
+        user_data = {}
+        for user_id, blob in rows:
+            blob = bytes(blob)
+            try:
+                user_data[user_id] = pickle.loads(blob)
+            except Exception as e:
+                print(f"Skipping unreadable state for user {user_id}: {e}")
+                continue
+            self._written[user_id] = hash(blob)
+        print(f"💾 Restored bot state for {len(user_data)} users")
+        return user_data
+
+    async def update_user_data(self, user_id, data):
+        if not data:
+            await self.drop_user_data(user_id)
+            return
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._written.get(user_id) == hash(blob):
+            return  # Unchanged since the last write
+        self._pending[user_id] = blob
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        if user_id in self._written or user_id in self._pending:
+            self._pending[user_id] = None
+            self._schedule_write()
+
+    def _schedule_write(self):
+        # The Application calls update_user_data for every changed user at once,
+        # so a single task started here picks all of them up in one batch. Users
+        # changed while it runs are picked up by the write it schedules next
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self, delay=0):
+        if delay:
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)  # flush() ends the wait early
+            except asyncio.TimeoutError:
+                pass
+        if await self._write_batch():
+            self._retry_delay = 0
+        else:
+            self._retry_delay = min(max(self._retry_delay * 2, RETRY_MIN_DELAY), RETRY_MAX_DELAY)
+        if self._pending and not self._closing.is_set():
+            self._write_task = asyncio.create_task(self._write_pending(self._retry_delay))
+
+    async def _write_batch(self):
+        """Write the pending users in one batch, False if the write failed"""
+        async with self._write_lock:
+            if not self._pending:
+                return True
+            batch, self._pending = self._pending, {}
+            upserts = [(user_id, blob) for user_id, blob in batch.items() if blob is not None]
+            deletes = [user_id for user_id, blob in batch.items() if blob is None]
+            # Record the batch before writing so calls arriving mid-write compare against it
+            previous = {user_id: self._written.get(user_id) for user_id in batch}
+            for user_id, blob in upserts:
+                self._written[user_id] = hash(blob)
+            for user_id in deletes:
+                self._written.pop(user_id, None)
+            try:
+                await asyncio.to_thread(self.store.write, upserts, deletes)
+            except Exception as e:
+                print(f"Error saving bot state for {len(batch)} users: {e}")
+                # Retried after a backoff unless newer data arrived meanwhile
+                for user_id, blob in batch.items():
+                    if previous[user_id] is None:
+                        self._written.pop(user_id, None)
+                    else:
+                        self._written[user_id] = previous[user_id]
+                    self._pending.setdefault(user_id, blob)
+                return False
+            return True
+
+    async def flush(self):
+        self._closing.set()
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_batch()
+        await asyncio.to_thread(self.store.close)
+
+    # Only user_data is stored
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+def build_persistence():
+    """Create the persistence configured by STATE_BACKEND, or None if disabled"""
+    backend = os.getenv('STATE_BACKEND', 'sqlite').lower()
+    flush_interval = float(os.getenv('STATE_FLUSH_INTERVAL', '10'))
+
+    if backend == 'none':
+        return None
+    if backend == 'postgres':
+        dsn = os.getenv('STATE_DATABASE_URL') or os.getenv('DATABASE_URL')
+        if not dsn:
+            raise RuntimeError("STATE_BACKEND=postgres needs STATE_DATABASE_URL or DATABASE_URL")
+        store = PostgresStateStore(dsn)
+    else:
+        store = SQLiteStateStore(os.getenv('STATE_DB_PATH', 'bot_state.db'))
+
+    return BatchedPersistence(store, update_interval=flush_interval)
@@ -1,52 +1,203 @@
-import os
-from flask import Flask, request
+"""
+Stripe webhook, served by server.py on POST /stripe-webhook.
+
+The handler verifies the signature, stores the event in the stripe_events
+inbox (keyed by event id, so retries are ignored) and answers 200 straight
+away. StripeEventWorker applies stored events in the background: checkouts
+and subscription updates/cancellations go through the apply_subscription_change
+function, which updates users and subscription_history and marks the event
+done in one transaction. The resulting tier and expiry are pushed into the
+entitlement cache the bot's tier checks read. Events that can't be tied to a
+user (no telegram_user_id and an unknown subscription) are retried like any
+other failure, then left as failed with the reason in last_error.
+"""
+
+import json
+import asyncio
+from datetime import datetime, timedelta, timezone
 import stripe
-from supabase import create_client
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Initialize services
-app = Flask(__name__)
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
-
-@app.route('/stripe-webhook', methods=['POST'])
-def stripe_webhook():
-    payload = request.get_data(as_text=True)
-    sig_header = request.headers.get('Stripe-Signature')
-    
-    try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, os.getenv('STRIPE_WEBHOOK_SECRET')
-        )
-    except ValueError as e:
-        print(f'⚠️  Webhook error while parsing basic request: {e}')
-        return '', 400
-    except stripe.error.SignatureVerificationError as e:
-        print(f'⚠️  Webhook signature verification failed: {e}')
-        return '', 400
-
-    # Handle the checkout.session.completed event
+import tornado.web
+
+from services import STRIPE_WEBHOOK_SECRET, STRIPE_COACH_PRICE_ID, supabase, run_query
+from entitlements import set_entitlement
+from metrics import track_handler
+
+EVENT_BATCH_SIZE = 20
+EVENT_LEASE_SECONDS = 120  # A claimed event is retried if not finished within this time
+EVENT_MAX_ATTEMPTS = 8
+EVENT_POLL_INTERVAL = 30  # Seconds between inbox scans when no webhook wakes the worker
+
+# Subscription statuses that keep paid features on
+ACTIVE_STATUSES = {'active', 'trialing', 'past_due'}
+
+
+def tier_for_price(price_id):
+    return 'coach' if price_id and price_id == STRIPE_COACH_PRICE_ID else 'basic'
+
+
+def to_timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat() if seconds else None
+
+
+def subscription_change(event):
+    """Arguments for apply_subscription_change, or None if the event changes nothing
+
+    Raises ValueError for a checkout that doesn't say which user paid.
+    """
+    obj = event['data']['object']
+    created = to_timestamp(event['created'])
+
     if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        telegram_user_id = session.get('metadata', {}).get('telegram_user_id')
-        tier = session.get('metadata', {}).get('tier', 'basic')  # Default to basic if not specified
-        
-        if telegram_user_id:
-            print(f"✅ Payment received for user {telegram_user_id} - Tier: {tier}")
-            
-            # Update user to premium with correct tier
+        metadata = obj.get('metadata') or {}
+        telegram_user_id = metadata.get('telegram_user_id')
+        if not telegram_user_id:
+            raise ValueError(f"Checkout {obj.get('id')} has no telegram_user_id in its metadata")
+        return {
+            'p_event_id': event['id'],
+            'p_event_created': created,
+            'p_user_id': telegram_user_id,
+            'p_subscription_id': obj.get('subscription'),
+            'p_customer_id': obj.get('customer'),
+            'p_tier': metadata.get('tier', 'basic'),  # Default to basic if not specified
+            'p_price_id': None,
+            'p_active': True,
+            'p_current_period_end': None  # Arrives with customer.subscription.created
+        }
+
+    if event['type'] in ('customer.subscription.created', 'customer.subscription.updated',
+                         'customer.subscription.deleted'):
+        items = (obj.get('items') or {}).get('data') or []
+        price_id = items[0]['price']['id'] if items else None
+        # Newer Stripe API versions report the billing period per item
+        period_end = obj.get('current_period_end') or (items[0].get('current_period_end') if items else None)
+        active = event['type'] != 'customer.subscription.deleted' and obj.get('status') in ACTIVE_STATUSES
+        return {
+            'p_event_id': event['id'],
+            'p_event_created': created,
+            'p_user_id': (obj.get('metadata') or {}).get('telegram_user_id'),
+            'p_subscription_id': obj['id'],
+            'p_customer_id': obj.get('customer'),
+            'p_tier': tier_for_price(price_id),
+            'p_price_id': price_id,
+            'p_active': active,
+            'p_current_period_end': to_timestamp(period_end)
+        }
+
+    return None
+
+
+async def store_event(event_id, event_type, payload):
+    """Save an event to the inbox; a duplicate id is silently ignored"""
+    await run_query(supabase.table('stripe_events').upsert({
+        'id': event_id,
+        'type': event_type,
+        'payload': payload
+    }, on_conflict='id', ignore_duplicates=True))
+
+
+async def apply_event(row):
+    change = subscription_change(row['payload'])
+    if change is None:
+        await run_query(supabase.table('stripe_events').update({
+            'status': 'done',
+            'processed_at': datetime.now(timezone.utc).isoformat(),
+            'locked_until': None
+        }).eq('id', row['id']))
+        return
+
+    result = await run_query(supabase.rpc('apply_subscription_change', change))
+    for entitlement in result.data or []:
+        set_entitlement(entitlement['user_id'], entitlement['tier'], entitlement['expires_at'])
+        print(f"✅ Stripe {row['type']} applied for user {entitlement['user_id']} - Tier: {entitlement['tier']}")
+
+
+async def fail_event(row, error):
+    """Schedule a retry with backoff, or give up after EVENT_MAX_ATTEMPTS"""
+    attempts = row['attempts']
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30 * 2 ** min(attempts, 8))
+    if attempts >= EVENT_MAX_ATTEMPTS:
+        print(f"🛑 Giving up on Stripe event {row['id']} ({row['type']}) after {attempts} attempts: {error}")
+    await run_query(supabase.table('stripe_events').update({
+        'status': 'failed' if attempts >= EVENT_MAX_ATTEMPTS else 'pending',
+        'last_error': str(error)[:500],
+        'locked_until': retry_at.isoformat()
+    }).eq('id', row['id']))
+
+
+async def process_pending_events():
+    """Apply claimed inbox events until none are left, returns how many were handled"""
+    handled = 0
+    while True:
+        claimed = await run_query(supabase.rpc('claim_stripe_events', {
+            'p_limit': EVENT_BATCH_SIZE,
+            'p_lease_seconds': EVENT_LEASE_SECONDS
+        }))
+        if not claimed.data:
+            return handled
+
+        for row in claimed.data:
+            try:
+                with track_handler(f"stripe:{row['type']}"):
+                    await apply_event(row)
+            except Exception as e:
+                print(f"❌ Error applying Stripe event {row['id']} ({row['type']}): {e}")
+                try:
+                    await fail_event(row, e)
+                except Exception as e:
+                    print(f"❌ Error recording failure of Stripe event {row['id']}: {e}")
+            handled += 1
+
+
+class StripeEventWorker:
+    """Background task applying inbox events, woken by the webhook"""
+
+    def __init__(self):
+        self.wake = asyncio.Event()
+
+    async def run(self, stopping):
+        while not stopping.is_set():
+            self.wake.clear()
             try:
-                supabase.table('users').update({
-                    'is_premium': True,
-                    'subscription_tier': tier
-                }).eq('user_id', telegram_user_id).execute()
-                print(f"✅ User {telegram_user_id} upgraded to {tier} tier")
+                await process_pending_events()
             except Exception as e:
-                print(f"❌ Error updating user {telegram_user_id}: {e}")
-    
-    return '', 200
+                print(f"Error processing Stripe events: {e}")
+
+            # Sleep until the next webhook, a poll for retries, or shutdown
+            waiters = [asyncio.ensure_future(self.wake.wait()), asyncio.ensure_future(stopping.wait())]
+            await asyncio.wait(waiters, timeout=EVENT_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+
+
+class StripeWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, worker):
+        self.worker = worker
+
+    async def post(self):
+        payload = self.request.body.decode('utf-8')
+        sig_header = self.request.headers.get('Stripe-Signature')
+
+        try:
+            event = stripe.Webhook.construct_event(
+                payload, sig_header, STRIPE_WEBHOOK_SECRET
+            )
+        except ValueError as e:
+            print(f'⚠️  Webhook error while parsing basic request: {e}')
+            self.set_status(400)
+            return
+        except stripe.error.SignatureVerificationError as e:
+            print(f'⚠️  Webhook signature verification failed: {e}')
+            self.set_status(400)
+            return
+
+        try:
+            with track_handler('stripe_webhook'):
+                await store_event(event['id'], event['type'], json.loads(payload))
+        except Exception as e:
+            # Not stored, so let Stripe retry
+            print(f"❌ Error storing Stripe event {event['id']}: {e}")
+            self.set_status(500)
+            return
 
-if __name__ == '__main__':
-    app.run(port=5000)
+        self.worker.wake.set()
+        self.set_status(200)
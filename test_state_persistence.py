@@ -0,0 +1,93 @@
+"""
+Checks that BatchedPersistence writes every changed user without another update
+to trigger it: users changed while a write is running, and batches whose write
+failed. Run with: python -m pytest test_state_persistence.py
+"""
+
+import asyncio
+import pickle
+import threading
+
+import state_persistence
+from state_persistence import BatchedPersistence
+
+
+class FakeStore:
+    """Records each write; the first `failures` writes raise"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.writes = []
+        self.stored = {}
+        self.release = None  # threading.Event that holds the next write until set
+
+    def load_all(self):
+        return []
+
+    def write(self, upserts, deletes):
+        if self.release is not None:
+            self.release.wait(5)
+            self.release = None
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        self.writes.append((list(upserts), list(deletes)))
+        for user_id, blob in upserts:
+            self.stored[user_id] = pickle.loads(blob)
+        for user_id in deletes:
+            self.stored.pop(user_id, None)
+
+    def close(self):
+        pass
+
+
+async def wait_until(condition, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_user_changed_during_a_write_is_written_next():
+    async def run():
+        store = FakeStore()
+        persistence = BatchedPersistence(store)
+        store.release = threading.Event()
+        await persistence.update_user_data(1, {'step': 'first'})
+        await asyncio.sleep(0.05)  # The first write is now blocked in the store
+        await persistence.update_user_data(2, {'step': 'second'})
+        store.release.set()
+        await wait_until(lambda: 2 in store.stored)
+        assert len(store.writes) == 2
+        assert not persistence._pending
+
+    asyncio.run(run())
+
+
+def test_failed_write_is_retried_after_a_backoff(monkeypatch):
+    monkeypatch.setattr(state_persistence, 'RETRY_MIN_DELAY', 0.05)
+
+    async def run():
+        store = FakeStore(failures=2)
+        persistence = BatchedPersistence(store)
+        await persistence.update_user_data(1, {'step': 'first'})
+        await wait_until(lambda: 1 in store.stored)
+        assert store.stored[1] == {'step': 'first'}
+        assert persistence._retry_delay == 0  # Reset by the successful write
+        assert not persistence._pending
+
+    asyncio.run(run())
+
+
+def test_flush_writes_without_waiting_out_the_backoff(monkeypatch):
+    monkeypatch.setattr(state_persistence, 'RETRY_MIN_DELAY', 30)
+
+    async def run():
+        store = FakeStore(failures=1)
+        persistence = BatchedPersistence(store)
+        await persistence.update_user_data(1, {'step': 'first'})
+        await wait_until(lambda: persistence._retry_delay > 0)
+        await asyncio.wait_for(persistence.flush(), 5)
+        assert store.stored == {1: {'step': 'first'}}
+
+    asyncio.run(run())
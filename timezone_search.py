@@ -0,0 +1,136 @@
+"""
+Fuzzy search over IANA timezone names for the settings_timezone flow.
+
+Users type things like "new york", "berlin", "india" or "los angeles" instead
+of exact zone names. The index maps every common zone, its city, its country
+and a few well-known aliases to the zone, and is built once per process on the
+first search. A lookup tries exact and prefix matches on a sorted key list,
+then falls back to trigram overlap for typos, so it stays in the microseconds.
+"""
+
+import bisect
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+import pytz
+
+MAX_RESULTS = 6
+MIN_QUERY_LENGTH = 2
+MIN_FUZZY_SCORE = 0.3  # Share of trigrams in common below which a typo match is dropped
+
+# Big cities and abbreviations that aren't part of any zone name
+CITY_ALIASES = {
+    'san francisco': 'America/Los_Angeles', 'seattle': 'America/Los_Angeles', 'la': 'America/Los_Angeles',
+    'pst': 'America/Los_Angeles', 'pacific': 'America/Los_Angeles',
+    'nyc': 'America/New_York', 'boston': 'America/New_York', 'miami': 'America/New_York',
+    'atlanta': 'America/New_York', 'washington': 'America/New_York', 'est': 'America/New_York',
+    'eastern': 'America/New_York',
+    'dallas': 'America/Chicago', 'houston': 'America/Chicago', 'austin': 'America/Chicago',
+    'cst': 'America/Chicago', 'central': 'America/Chicago',
+    'mst': 'America/Denver', 'mountain': 'America/Denver', 'salt lake city': 'America/Denver',
+    'montreal': 'America/Toronto', 'ottawa': 'America/Toronto',
+    'rio de janeiro': 'America/Sao_Paulo',
+    'manchester': 'Europe/London', 'edinburgh': 'Europe/London', 'gmt': 'Europe/London', 'bst': 'Europe/London',
+    'munich': 'Europe/Berlin', 'frankfurt': 'Europe/Berlin', 'hamburg': 'Europe/Berlin', 'cet': 'Europe/Berlin',
+    'barcelona': 'Europe/Madrid', 'milan': 'Europe/Rome', 'geneva': 'Europe/Zurich',
+    'st petersburg': 'Europe/Moscow', 'msk': 'Europe/Moscow',
+    'mumbai': 'Asia/Kolkata', 'delhi': 'Asia/Kolkata', 'new delhi': 'Asia/Kolkata',
+    'bangalore': 'Asia/Kolkata', 'bengaluru': 'Asia/Kolkata', 'ist': 'Asia/Kolkata',
+    'beijing': 'Asia/Shanghai', 'shenzhen': 'Asia/Shanghai', 'guangzhou': 'Asia/Shanghai',
+    'kiev': 'Europe/Kyiv', 'osaka': 'Asia/Tokyo', 'kyoto': 'Asia/Tokyo', 'jst': 'Asia/Tokyo',
+    'abu dhabi': 'Asia/Dubai', 'hanoi': 'Asia/Ho_Chi_Minh', 'saigon': 'Asia/Ho_Chi_Minh',
+    'canberra': 'Australia/Sydney', 'aest': 'Australia/Sydney', 'wellington': 'Pacific/Auckland',
+}
+
+
+def normalize(text):
+    """Lowercase ASCII words: 'São_Paulo' -> 'sao paulo'"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    for char in '/_-.,()':
+        text = text.replace(char, ' ')
+    return ' '.join(text.lower().split())
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TimezoneIndex:
+    def __init__(self):
+        zones = pytz.common_timezones
+        self.rank = {zone: i for i, zone in enumerate(zones)}
+        self.zones_by_key = defaultdict(set)
+
+        for zone in zones:
+            self.zones_by_key[normalize(zone)].add(zone)
+            self.zones_by_key[normalize(zone.rsplit('/', 1)[-1])].add(zone)  # City
+        for code, country_zones in pytz.country_timezones.items():
+            for key in (normalize(pytz.country_names[code]), code.lower()):
+                self.zones_by_key[key].update(zone for zone in country_zones if zone in self.rank)
+        for alias, zone in CITY_ALIASES.items():
+            self.zones_by_key[alias].add(zone)
+
+        self.keys = sorted(self.zones_by_key)
+        # (word, key) for every word after the first, so "york" finds "new york"
+        self.inner_words = sorted((word, key) for key in self.keys for word in key.split()[1:])
+        self.keys_by_trigram = defaultdict(list)
+        self.trigram_counts = {}
+        for key in self.keys:
+            grams = trigrams(key)
+            self.trigram_counts[key] = len(grams)
+            for gram in grams:
+                self.keys_by_trigram[gram].append(key)
+
+    def search(self, text, limit=MAX_RESULTS):
+        """Best matching zone names, exact matches first, then prefixes, then typos"""
+        query = normalize(text)
+        if len(query) < MIN_QUERY_LENGTH:
+            return []
+        scores = {}
+
+        def add(zones, score):
+            for zone in zones:
+                if score > scores.get(zone, 0):
+                    scores[zone] = score
+
+        add(self.zones_by_key.get(query, ()), 3)
+
+        # Every key starting with the query sits in one run of the sorted list
+        start = bisect.bisect_left(self.keys, query)
+        for key in self.keys[start:start + 50]:
+            if not key.startswith(query):
+                break
+            add(self.zones_by_key[key], 2 + len(query) / len(key))
+
+        if len(scores) < limit and len(query) >= 3:
+            start = bisect.bisect_left(self.inner_words, (query,))
+            for word, key in self.inner_words[start:start + 50]:
+                if not word.startswith(query):
+                    break
+                add(self.zones_by_key[key], 1.5 + len(query) / len(key))
+
+        # Only guess at typos when nothing matched as typed
+        if not scores and len(query) >= 3:
+            grams = trigrams(query)
+            overlap = defaultdict(int)
+            for gram in grams:
+                for key in self.keys_by_trigram.get(gram, ()):
+                    overlap[key] += 1
+            for key, common in overlap.items():
+                score = common / (len(grams) + self.trigram_counts[key] - common)  # Jaccard
+                if score >= MIN_FUZZY_SCORE:
+                    add(self.zones_by_key[key], score)
+
+        ranked = sorted(scores, key=lambda zone: (-scores[zone], self.rank[zone]))
+        return ranked[:limit]
+
+
+@lru_cache(maxsize=None)
+def get_index():
+    """The process-wide index, built on first use"""
+    return TimezoneIndex()
+
+
+def search_timezones(text, limit=MAX_RESULTS):
+    return get_index().search(text, limit)
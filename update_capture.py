@@ -0,0 +1,102 @@
+"""
+Anonymized capture of incoming Telegram updates, for replaying real traffic
+against a test deployment (replay_updates.py).
+
+When UPDATE_CAPTURE_PATH is set, server.py appends every webhook update to it
+as one JSON line: {"t": seconds since capture start, "update": {...}}. Before
+writing, user and chat ids are replaced by keyed pseudonyms (the same person
+keeps the same id within a capture, so per-user ordering and bursts survive),
+names and usernames are dropped, and free text keeps only its shape: commands,
+numbers, dates and times stay, every other word becomes the same number of
+'x's. Callback data is kept, it only holds route codes and record ids.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import time
+
+UPDATE_CAPTURE_PATH = os.getenv('UPDATE_CAPTURE_PATH')
+# Key for the id pseudonyms, random per process unless set (set it to join captures from several runs)
+UPDATE_CAPTURE_SALT = os.getenv('UPDATE_CAPTURE_SALT') or secrets.token_hex(16)
+
+NAME_FIELDS = {'first_name', 'last_name', 'username', 'title'}
+TEXT_FIELDS = {'text', 'caption', 'query'}
+# Content the bot never reads, dropped entirely
+DROPPED_FIELDS = {
+    'contact', 'location', 'venue', 'photo', 'document', 'voice', 'video', 'audio', 'sticker',
+    'animation', 'video_note', 'phone_number', 'email', 'bio', 'description', 'invite_link'
+}
+KEPT_WORD = re.compile(r'^(/\w+(@\w+)?|[\d:./\-+]+)$')  # Commands, numbers, dates and times
+PSEUDONYM_RANGE = 10 ** 12  # Fits Telegram's 52-bit ids
+
+
+def pseudonym(value, salt=UPDATE_CAPTURE_SALT):
+    """Stable stand-in for a user or chat id, keeping the sign of group chat ids"""
+    digest = hmac.new(salt.encode(), str(abs(value)).encode(), hashlib.sha256).digest()
+    number = int.from_bytes(digest[:8], 'big') % PSEUDONYM_RANGE + 1
+    return -number if value < 0 else number
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def scrub_text(text):
+    """Keep commands, numbers and spacing; every other word becomes x's of the same UTF-16 length"""
+    return re.sub(r'\S+', lambda m: m.group() if KEPT_WORD.match(m.group()) else 'x' * utf16_len(m.group()), text)
+
+
+def anonymize(value, salt=UPDATE_CAPTURE_SALT):
+    """A copy of an update payload without personal data"""
+    if isinstance(value, list):
+        return [anonymize(item, salt) for item in value]
+    if not isinstance(value, dict):
+        return value
+    is_person = 'is_bot' in value or ('type' in value and isinstance(value.get('id'), int))  # A User or a Chat
+    result = {}
+    for key, item in value.items():
+        if key in DROPPED_FIELDS:
+            continue
+        if key in NAME_FIELDS:
+            if key == 'first_name':
+                result[key] = 'User'  # Required on User objects
+            continue
+        if key == 'id' and is_person and isinstance(item, int):
+            result[key] = pseudonym(item, salt)
+        elif key == 'chat_instance':
+            result[key] = str(pseudonym(int(hashlib.sha256(item.encode()).hexdigest()[:12], 16), salt))
+        elif key in TEXT_FIELDS and isinstance(item, str):
+            result[key] = scrub_text(item)
+        else:
+            result[key] = anonymize(item, salt)
+    return result
+
+
+class UpdateCapture:
+    """Appends anonymized updates to a JSONL file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)  # Line buffered, lines survive a crash
+        self.started = time.monotonic()
+        self.count = 0
+
+    def write(self, data):
+        record = {'t': round(time.monotonic() - self.started, 3), 'update': anonymize(data)}
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def build_capture():
+    """The capture configured by UPDATE_CAPTURE_PATH, or None"""
+    if not UPDATE_CAPTURE_PATH:
+        return None
+    print(f"📼 Capturing anonymized updates to {UPDATE_CAPTURE_PATH}")
+    return UpdateCapture(UPDATE_CAPTURE_PATH)
@@ -0,0 +1,82 @@
+"""
+Concurrent update processing that keeps each user's updates in order.
+
+Updates from different users run in parallel, so one slow /coach or Stripe
+call no longer holds up everyone else. Updates from the same user wait on a
+per-user lock and run one at a time in arrival order, which keeps their
+conversation state and reminder drafts consistent.
+"""
+
+import asyncio
+import os
+
+from telegram.ext import BaseUpdateProcessor
+from metrics import update_started, update_finished
+from flood_control import release
+
+
+def update_key(update):
+    """Serialization key for an update: the user, else the chat, else None"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return ('user', user.id)
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return ('chat', chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to max_running updates at once, one at a time per user.
+
+    The base class limits how many updates are admitted (running or waiting
+    for their user's lock). The running limit is only taken once the user's
+    lock is held, so a user with a backlog waits on their own lock instead of
+    occupying slots other users could run in.
+    """
+
+    def __init__(self, max_running, max_admitted=None):
+        super().__init__(max_admitted or max_running * 4)
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        self._locks = {}  # key -> [lock, number of updates holding or waiting for it]
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _run(self, update, coroutine):
+        async with self._running:
+            update_started(update)
+            try:
+                await coroutine
+            finally:
+                update_finished(update)
+                release(update)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def build_update_processor():
+    """Processor configured by MAX_CONCURRENT_UPDATES and MAX_PENDING_UPDATES"""
+    max_running = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+    max_admitted = int(os.getenv('MAX_PENDING_UPDATES', '0')) or None
+    return PerUserUpdateProcessor(max_running, max_admitted)